@@ -20,7 +20,8 @@ import mimetypes
 
 from werkzeug.datastructures import FileStorage
 
-from mediagoblin.decorators import oauth_required, require_active_login
+from mediagoblin.decorators import oauth_required, require_active_login, \
+    conditional_get
 from mediagoblin.api.decorators import user_has_privilege
 from mediagoblin.db.models import User, LocalUser, MediaEntry, Comment, TextComment, Activity
 from mediagoblin.tools.federation import create_activity, create_generator
@@ -191,7 +192,7 @@ def inbox_endpoint(request, inbox=None):
         "totalItems": total_items,
     }
 
-    for activity in inbox:
+    for activity in Activity.load_feed_data(inbox):
         try:
             feed["items"].append(activity.serialize(request))
         except AttributeError:
@@ -590,7 +591,7 @@ def feed_endpoint(request, outbox=None):
     outbox = outbox.offset(request.args.get("offset", 0))
 
     # Build feed.
-    for activity in outbox:
+    for activity in Activity.load_feed_data(outbox):
         try:
             feed["items"].append(activity.serialize(request))
         except AttributeError:
@@ -625,7 +626,23 @@ def feed_major_endpoint(request):
     outbox = Activity.query.filter_by(verb="post")
     return feed_endpoint(request, outbox=outbox)
 
+def _object_public_id(request):
+    return request.urlgen(
+        "mediagoblin.api.object",
+        object_type=request.matchdict["object_type"],
+        id=request.matchdict["id"],
+        qualified=True
+    )
+
+def object_validators(request):
+    media = MediaEntry.query.filter_by(
+        public_id=_object_public_id(request)).first()
+    if media is None:
+        return None
+    return media.updated, (media.id, media.num_comments)
+
 @oauth_required
+@conditional_get(object_validators, public=True)
 def object_endpoint(request):
     """ Lookup for a object type """
     object_type = request.matchdict["object_type"]
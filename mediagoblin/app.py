@@ -16,12 +16,13 @@
 
 import os
 import logging
+import time
 from contextlib import contextmanager
 
 from mediagoblin.routing import get_url_map
-from mediagoblin.tools.routing import endpoint_to_controller
+from mediagoblin.tools.routing import endpoint_to_controller, \
+    import_controllers
 
-from werkzeug.wrappers import Request
 from werkzeug.exceptions import HTTPException
 from werkzeug.routing import RequestRedirect
 from werkzeug.wsgi import SharedDataMiddleware
@@ -38,7 +39,7 @@ from mediagoblin.init.celery import setup_celery_from_config
 from mediagoblin.init.plugins import setup_plugins
 from mediagoblin.init import (get_jinja_loader, get_staticdirector,
     setup_global_and_app_config, setup_locales, setup_workbench, setup_database,
-    setup_storage)
+    setup_storage, setup_fragment_cache, setup_feed_cache)
 from mediagoblin.tools.pluginapi import PluginManager, hook_transform
 from mediagoblin.tools.crypto import setup_crypto
 from mediagoblin.auth.tools import check_auth_enabled, no_auth_logout
@@ -80,75 +81,102 @@ class MediaGoblinApp(object):
         """
         _log.info("GNU MediaGoblin %s main server starting", __version__)
         _log.debug("Using config file %s", config_path)
+
+        # (phase, seconds) of the startup, see "gmg startupprofile"
+        self.startup_timings = []
+
         ##############
         # Setup config
         ##############
 
-        # Open and setup the config
-        self.global_config, self.app_config = setup_global_and_app_config(config_path)
+        with self._startup_phase('config'):
+            # Open and setup the config
+            self.global_config, self.app_config = \
+                setup_global_and_app_config(config_path)
 
-        media_type_warning()
+            media_type_warning()
 
-        setup_crypto(self.app_config)
+            setup_crypto(self.app_config)
 
-        ##########################################
-        # Setup other connections / useful objects
-        ##########################################
+            ##########################################
+            # Setup other connections / useful objects
+            ##########################################
 
-        # Setup Session Manager, not needed in celery
-        self.session_manager = session.SessionManager()
+            # Setup Session Manager, not needed in celery
+            self.session_manager = session.SessionManager()
 
-        # load all available locales
-        setup_locales()
+            # load all available locales
+            setup_locales()
 
         # Set up plugins -- need to do this early so that plugins can
         # affect startup.
-        _log.info("Setting up plugins.")
-        setup_plugins()
+        with self._startup_phase('plugins'):
+            _log.info("Setting up plugins.")
+            setup_plugins()
 
         # Set up the database
-        if DISABLE_GLOBALS:
-            self.db_manager = setup_database(self)
-        else:
-            self.db = setup_database(self)
+        with self._startup_phase('database'):
+            if DISABLE_GLOBALS:
+                self.db_manager = setup_database(self)
+            else:
+                self.db = setup_database(self)
 
         # Quit app if need to run dbupdate
         ## NOTE: This is currently commented out due to session errors..
         ##  We'd like to re-enable!
         # check_db_up_to_date()
 
-        # Register themes
-        self.theme_registry, self.current_theme = register_themes(self.app_config)
+        with self._startup_phase('templates'):
+            # Register themes
+            self.theme_registry, self.current_theme = \
+                register_themes(self.app_config)
 
-        # Get the template environment
-        self.template_loader = get_jinja_loader(
-            self.app_config.get('local_templates'),
-            self.current_theme,
-            PluginManager().get_template_paths()
-            )
+            # Get the template environment
+            self.template_loader = get_jinja_loader(
+                self.app_config.get('local_templates'),
+                self.current_theme,
+                PluginManager().get_template_paths()
+                )
 
         # Check if authentication plugin is enabled and respond accordingly.
         self.auth = check_auth_enabled()
         if not self.auth:
             self.app_config['allow_comments'] = False
 
-        # Set up storage systems
-        self.public_store, self.queue_store = setup_storage()
+        with self._startup_phase('storage'):
+            # Set up storage systems
+            self.public_store, self.queue_store = setup_storage()
+
+            # Set up the cache of rendered template fragments
+            self.fragment_cache = setup_fragment_cache()
+
+            # ... and of the Atom feeds
+            self.feed_cache = setup_feed_cache()
+
+        with self._startup_phase('routes'):
+            # set up routing
+            self.url_map = get_url_map()
 
-        # set up routing
-        self.url_map = get_url_map()
+            # Import all the controllers now, rather than during the
+            # first requests
+            if self.app_config['eager_imports']:
+                import_controllers(self.url_map)
 
         # set up staticdirector tool
         self.staticdirector = get_staticdirector(self.app_config)
 
         # Setup celery, if appropriate
-        if setup_celery and not self.app_config.get('celery_setup_elsewhere'):
-            if os.environ.get('CELERY_ALWAYS_EAGER', 'false').lower() == 'true':
-                setup_celery_from_config(
-                    self.app_config, self.global_config,
-                    force_celery_always_eager=True)
-            else:
-                setup_celery_from_config(self.app_config, self.global_config)
+        with self._startup_phase('celery'):
+            if setup_celery and \
+                    not self.app_config.get('celery_setup_elsewhere'):
+                if os.environ.get(
+                        'CELERY_ALWAYS_EAGER', 'false').lower() == 'true':
+                    setup_celery_from_config(
+                        self.app_config, self.global_config,
+                        force_celery_always_eager=True)
+                else:
+                    setup_celery_from_config(
+                        self.app_config, self.global_config)
 
         #######################################################
         # Insert appropriate things into mediagoblin.mg_globals
@@ -170,8 +198,29 @@ class MediaGoblinApp(object):
         self.workbench_manager = setup_workbench()
 
         # instantiate application meddleware
-        self.meddleware = [common.import_component(m)(self)
-                           for m in meddleware.ENABLED_MEDDLEWARE]
+        with self._startup_phase('meddleware'):
+            self.meddleware = [common.import_component(m)(self)
+                               for m in meddleware.ENABLED_MEDDLEWARE]
+
+        # Compile the templates now, rather than during the first requests
+        warmup_locales = self.global_config.get(
+            'jinja2', {}).get('warmup_locales')
+        if warmup_locales:
+            with self._startup_phase('template warmup'):
+                template.warmup_templates(
+                    self, self.template_loader, warmup_locales)
+
+        _log.debug("Started up in %.3fs",
+                   sum(seconds for phase, seconds in self.startup_timings))
+
+    @contextmanager
+    def _startup_phase(self, phase):
+        """Record how long the startup phase in this block takes"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.startup_timings.append((phase, time.time() - start))
 
     @contextmanager
     def gen_context(self, ctx=None, **kwargs):
@@ -209,7 +258,7 @@ class MediaGoblinApp(object):
 
         # Do special things if this is a request
         # --------------------------------------
-        if isinstance(ctx, Request):
+        if isinstance(ctx, mg_request.Request):
             ctx = self._request_only_gen_context(ctx)
 
         return ctx
@@ -250,7 +299,7 @@ class MediaGoblinApp(object):
         return request
 
     def call_backend(self, environ, start_response):
-        request = Request(environ)
+        request = mg_request.Request(environ)
 
         # Compatibility with django, use request.args preferrably
         request.GET = request.args
@@ -15,9 +15,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import six
 import copy
+from itertools import count
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import inspect
+from sqlalchemy import inspect, and_, or_
+from sqlalchemy.sql import operators
 
 from mediagoblin.tools.transition import DISABLE_GLOBALS
 
@@ -25,12 +27,67 @@ if not DISABLE_GLOBALS:
     from sqlalchemy.orm import scoped_session, sessionmaker
     Session = scoped_session(sessionmaker())
 
+def query_position(query, criterion):
+    """
+    Return the 0-based position of the first row matching criterion
+    within the ordered query, or None if no row matches.
+
+    This is done in SQL by counting the rows which sort before the
+    target row, so it costs one (indexed) query no matter how far into
+    the result the row is.  The query's ORDER BY should end in a unique
+    column; otherwise rows that tie with the target are not counted.
+    """
+    columns = []
+    for clause in query._order_by or []:
+        if getattr(clause, 'modifier', None) is operators.desc_op:
+            columns.append((clause.element, True))
+        elif getattr(clause, 'modifier', None) is operators.asc_op:
+            columns.append((clause.element, False))
+        else:
+            columns.append((clause, False))
+
+    if not columns:
+        raise ValueError(u'query_position() needs an ordered query')
+
+    values = query.with_entities(
+        *[column for column, descending in columns]).filter(
+            criterion).first()
+    if values is None:
+        return None
+
+    # (a, b) < (x, y)  <=>  a < x OR (a == x AND b < y), and so on
+    before = []
+    for i, (column, descending) in enumerate(columns):
+        equal = [c == v for (c, d), v in zip(columns[:i], values[:i])]
+        if descending:
+            equal.append(column > values[i])
+        else:
+            equal.append(column < values[i])
+        before.append(and_(*equal))
+
+    return query.filter(or_(*before)).order_by(None).count()
+
+
 class FakeCursor(object):
 
-    def __init__ (self, cursor, mapper, filter=None):
+    def __init__ (self, cursor, mapper, filter=None, id_criterion=None,
+                  prefetch=None):
+        """
+        Wraps cursor so that iterating it yields mapper(row) for each row.
+
+        id_criterion, if given, is a callable turning the id of a mapped
+        object into a criterion on cursor selecting its row, for use with
+        position_of().
+
+        prefetch, if given, is called with the list of rows of a slice
+        before they are mapped, so it can load whatever mapper needs
+        for all of them at once.
+        """
         self.cursor = cursor
         self.mapper = mapper
         self.filter = filter
+        self.id_criterion = id_criterion
+        self.prefetch = prefetch
 
     def count(self):
         return self.cursor.count()
@@ -38,7 +95,21 @@ class FakeCursor(object):
     def __copy__(self):
         # Or whatever the function is named to make
         # copy.copy happy?
-        return FakeCursor(copy.copy(self.cursor), self.mapper, self.filter)
+        return FakeCursor(copy.copy(self.cursor), self.mapper, self.filter,
+                          self.id_criterion, self.prefetch)
+
+    def position_of(self, obj_id):
+        """
+        Return the position of the mapped object with id obj_id in the
+        cursor, or None if it isn't there
+        """
+        if self.id_criterion is None:
+            # Nothing to ask the database, so walk the mapped objects
+            for obj, position in six.moves.zip(copy.copy(self), count(0)):
+                if obj.id == obj_id:
+                    return position
+            return None
+        return query_position(self.cursor, self.id_criterion(obj_id))
 
     def __iter__(self):
         return six.moves.filter(self.filter, six.moves.map(self.mapper, self.cursor))
@@ -48,6 +119,9 @@ class FakeCursor(object):
 
     def slice(self, *args, **kwargs):
         r = self.cursor.slice(*args, **kwargs)
+        if self.prefetch is not None:
+            r = list(r)
+            self.prefetch(r)
         return list(six.moves.filter(self.filter, six.moves.map(self.mapper, r)))
 
 class GMGTableBase(object):
@@ -29,7 +29,7 @@ from sqlalchemy import (MetaData, Table, Column, Boolean, SmallInteger,
                         ForeignKey, Date, Index)
 from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.sql import and_
+from sqlalchemy.sql import and_, func, select
 from sqlalchemy.schema import UniqueConstraint
 
 from mediagoblin import oauth
@@ -2140,3 +2140,83 @@ def consolidate_notification(db):
     cn_table.drop()
 
     db.commit()
+
+
+@RegisterMigration(44, MIGRATIONS)
+def add_media_entry_content_hash(db):
+    """Add the indexed content_hash column to MediaEntry"""
+    metadata = MetaData(bind=db.bind)
+    media_entry_table = inspect_table(metadata, "core__media_entries")
+
+    col = Column('content_hash', Unicode)
+    col.create(media_entry_table)
+
+    Index('ix_core__media_entries_content_hash',
+          media_entry_table.c.content_hash).create(db.bind)
+
+    db.commit()
+
+
+@RegisterMigration(45, MIGRATIONS)
+def add_denormalised_counters(db):
+    """
+    Add comment counts to MediaEntry and unseen notification counts to
+    User, and fill them (and Collection's item counts) in
+    """
+    metadata = MetaData(bind=db.bind)
+    media_entry_table = inspect_table(metadata, "core__media_entries")
+    user_table = inspect_table(metadata, "core__users")
+    collection_table = inspect_table(metadata, "core__collections")
+    collection_items_table = inspect_table(metadata, "core__collection_items")
+    comment_links_table = inspect_table(metadata, "core__comment_links")
+    gmr_table = inspect_table(metadata, "core__generic_model_reference")
+    notification_table = inspect_table(metadata, "core__notifications")
+
+    col = Column('num_comments', Integer, default=0)
+    col.create(media_entry_table)
+
+    col = Column('num_unseen_notifications', Integer, default=0)
+    col.create(user_table)
+
+    num_comments = select([func.count(comment_links_table.c.id)]).where(and_(
+        comment_links_table.c.target_id == gmr_table.c.id,
+        gmr_table.c.model_type == u"core__media_entries",
+        gmr_table.c.obj_pk == media_entry_table.c.id)).as_scalar()
+    db.execute(media_entry_table.update().values(num_comments=num_comments))
+
+    num_items = select([func.count(collection_items_table.c.id)]).where(
+        collection_items_table.c.collection == collection_table.c.id
+    ).as_scalar()
+    db.execute(collection_table.update().values(num_items=num_items))
+
+    num_unseen = select([func.count(notification_table.c.id)]).where(and_(
+        notification_table.c.user_id == user_table.c.id,
+        notification_table.c.seen == False)).as_scalar()
+    db.execute(user_table.update().values(num_unseen_notifications=num_unseen))
+
+    db.commit()
+
+
+@RegisterMigration(46, MIGRATIONS)
+def add_rendered_markdown(db):
+    """
+    Add columns keeping the rendered Markdown of user bios, media and
+    collection descriptions, comments and collection item notes.
+
+    They are filled in when the objects get saved, or by running
+    "gmg rendermarkdown".
+    """
+    metadata = MetaData(bind=db.bind)
+
+    for table_name in ["core__users", "core__media_entries",
+                       "core__media_comments", "core__collections",
+                       "core__collection_items"]:
+        table = inspect_table(metadata, table_name)
+
+        col = Column('rendered_html', UnicodeText)
+        col.create(table)
+
+        col = Column('rendered_stamp', Unicode)
+        col.create(table)
+
+    db.commit()
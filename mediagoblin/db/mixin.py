@@ -37,7 +37,7 @@ from werkzeug.utils import cached_property
 from mediagoblin.media_types import FileTypeNotSupported
 from mediagoblin.tools import common, licenses
 from mediagoblin.tools.pluginapi import hook_handle
-from mediagoblin.tools.text import cleaned_markdown_conversion
+from mediagoblin.tools.text import cleaned_markdown_conversion, markdown_stamp
 from mediagoblin.tools.url import slugify
 from mediagoblin.tools.translate import pass_to_ugettext as _
 
@@ -76,12 +76,6 @@ class CommentingMixin(object):
 
         return link.target()
 
-    def soft_delete(self, *args, **kwargs):
-        link = self.get_comment_link()
-        if link is not None:
-            link.delete()
-        super(CommentingMixin, self).soft_delete(*args, **kwargs)
-
 class GeneratePublicIDMixin(object):
     """
     Mixin that ensures that a the public_id field is populated.
@@ -118,12 +112,49 @@ class GeneratePublicIDMixin(object):
             self.save()
         return self.public_id
 
-class UserMixin(object):
+class RenderedMarkdownMixin(object):
+    """
+    Keeps the rendered HTML of the Markdown field named markdown_field in
+    the rendered_html column, with its markdown_stamp in rendered_stamp.
+
+    Renderings are brought up to date whenever the object gets flushed
+    (see render_markdown), or in bulk with "gmg rendermarkdown".  Until
+    then, outdated ones are rendered on access and kept with the object.
+    """
+    markdown_field = None
+
+    def render_markdown(self):
+        """Update rendered_html if it doesn't match the Markdown field"""
+        text = getattr(self, self.markdown_field)
+        stamp = markdown_stamp(text)
+        if self.rendered_stamp != stamp:
+            self.rendered_html = self._render_markdown(text, stamp)
+            self.rendered_stamp = stamp
+
+    def _render_markdown(self, text, stamp):
+        rendered = self.__dict__.get('_rendered_markdown')
+        if rendered is None or rendered[0] != stamp:
+            rendered = stamp, cleaned_markdown_conversion(text)
+            self.__dict__['_rendered_markdown'] = rendered
+        return rendered[1]
+
+    @property
+    def rendered_markdown(self):
+        text = getattr(self, self.markdown_field)
+        stamp = markdown_stamp(text)
+        if self.rendered_stamp == stamp:
+            return self.rendered_html
+        # Don't change the object, reading it shouldn't make it dirty
+        return self._render_markdown(text, stamp)
+
+
+class UserMixin(RenderedMarkdownMixin):
     object_type = "person"
+    markdown_field = 'bio'
 
     @property
     def bio_html(self):
-        return cleaned_markdown_conversion(self.bio)
+        return self.rendered_markdown
 
     def url_for_self(self, urlgen, **kwargs):
         """Generate a URL for this User's home page."""
@@ -205,7 +236,10 @@ class GenerateSlugMixin(object):
         self.slug = slug
 
 
-class MediaEntryMixin(GenerateSlugMixin, GeneratePublicIDMixin):
+class MediaEntryMixin(GenerateSlugMixin, GeneratePublicIDMixin,
+                      RenderedMarkdownMixin):
+    markdown_field = 'description'
+
     def check_slug_used(self, slug):
         # import this here due to a cyclic import issue
         # (db.models -> db.mixin -> db.util -> db.models)
@@ -224,7 +258,7 @@ class MediaEntryMixin(GenerateSlugMixin, GeneratePublicIDMixin):
         Rendered version of the description, run through
         Markdown and cleaned with our cleaning tool.
         """
-        return cleaned_markdown_conversion(self.description)
+        return self.rendered_markdown
 
     def get_display_media(self):
         """Find the best media for display.
@@ -384,7 +418,8 @@ class MediaEntryMixin(GenerateSlugMixin, GeneratePublicIDMixin):
         return exif_short
 
 
-class TextCommentMixin(GeneratePublicIDMixin):
+class TextCommentMixin(GeneratePublicIDMixin, RenderedMarkdownMixin):
+    markdown_field = 'content'
     object_type = "comment"
 
     @property
@@ -393,7 +428,7 @@ class TextCommentMixin(GeneratePublicIDMixin):
         the actual html-rendered version of the comment displayed.
         Run through Markdown and the HTML cleaner.
         """
-        return cleaned_markdown_conversion(self.content)
+        return self.rendered_markdown
 
     def __unicode__(self):
         return u'<{klass} #{id} {actor} "{comment}">'.format(
@@ -409,7 +444,9 @@ class TextCommentMixin(GeneratePublicIDMixin):
             actor=self.get_actor,
             comment=self.content)
 
-class CollectionMixin(GenerateSlugMixin, GeneratePublicIDMixin):
+class CollectionMixin(GenerateSlugMixin, GeneratePublicIDMixin,
+                      RenderedMarkdownMixin):
+    markdown_field = 'description'
     object_type = "collection"
 
     def check_slug_used(self, slug):
@@ -425,7 +462,7 @@ class CollectionMixin(GenerateSlugMixin, GeneratePublicIDMixin):
         Rendered version of the description, run through
         Markdown and cleaned with our cleaning tool.
         """
-        return cleaned_markdown_conversion(self.description)
+        return self.rendered_markdown
 
     @property
     def slug_or_id(self):
@@ -461,21 +498,24 @@ class CollectionMixin(GenerateSlugMixin, GeneratePublicIDMixin):
         if content is not None:
             item.note = content
 
-        self.num_items = self.num_items + 1
-        
-        # Save both!
+        self.num_items = type(self).num_items + 1
+
+        # Save all of them! (A MediaEntry's sidebar lists its collections)
+        obj.save(commit=False)
         self.save(commit=commit)
         item.save(commit=commit)
         return item 
 
-class CollectionItemMixin(object):
+class CollectionItemMixin(RenderedMarkdownMixin):
+    markdown_field = 'note'
+
     @property
     def note_html(self):
         """
         the actual html-rendered version of the note displayed.
         Run through Markdown and the HTML cleaner.
         """
-        return cleaned_markdown_conversion(self.note)
+        return self.rendered_markdown
 
 class ActivityMixin(GeneratePublicIDMixin):
     object_type = "activity"
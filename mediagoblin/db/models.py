@@ -25,11 +25,12 @@ import datetime
 
 from sqlalchemy import Column, Integer, Unicode, UnicodeText, DateTime, \
         Boolean, ForeignKey, UniqueConstraint, PrimaryKeyConstraint, \
-        SmallInteger, Date, types
+        SmallInteger, Date, types, event
 from sqlalchemy.orm import relationship, backref, with_polymorphic, validates, \
-        class_mapper
+        class_mapper, Session
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.collections import attribute_mapped_collection
-from sqlalchemy.sql import and_
+from sqlalchemy.sql import and_, select
 from sqlalchemy.sql.expression import desc
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.util import memoized_property
@@ -39,7 +40,7 @@ from mediagoblin.db.extratypes import (PathTupleWithSlashes, JSONEncoded,
 from mediagoblin.db.base import Base, DictReadAttrProxy, FakeCursor
 from mediagoblin.db.mixin import UserMixin, MediaEntryMixin, \
         CollectionMixin, CollectionItemMixin, ActivityMixin, TextCommentMixin, \
-        CommentingMixin
+        CommentingMixin, RenderedMarkdownMixin
 from mediagoblin.tools.files import delete_media_files
 from mediagoblin.tools.common import import_component
 from mediagoblin.tools.routing import extract_url_arguments
@@ -74,9 +75,74 @@ class GenericModelReference(Base):
         if self.model_type is None or self.obj_pk is None:
             return None
 
+        # resolve_all() may have looked it up already
+        resolved = self.__dict__.get('_resolved')
+        if resolved is not None and resolved[0] == (self.model_type,
+                                                    self.obj_pk):
+            return resolved[1]
+
         model = self._get_model_from_type(self.model_type)
         return model.query.filter_by(id=self.obj_pk).first()
 
+    @classmethod
+    def resolve_all(cls, references):
+        """
+        Look up the objects of many references at once.
+
+        The references are grouped by model_type and the objects of each
+        model are fetched with a single IN query, rather than one query
+        per reference.  Each reference remembers its object, so calling
+        get_object() on it afterwards doesn't query again.
+
+        Returns the objects in the order of references, with None for
+        references whose object doesn't exist (anymore).
+        """
+        references = [ref for ref in references if ref is not None]
+        pks_by_type = {}
+        for ref in references:
+            if ref.model_type is not None and ref.obj_pk is not None:
+                pks_by_type.setdefault(ref.model_type, set()).add(ref.obj_pk)
+
+        objects = {}
+        for model_type, pks in six.iteritems(pks_by_type):
+            model = cls._get_model_from_type(model_type)
+            query = model.query
+            if class_mapper(model).polymorphic_map:
+                # Users are LocalUsers or RemoteUsers, load them completely
+                query = query.with_polymorphic('*')
+            for obj in query.filter(model.id.in_(pks)):
+                objects[(model_type, obj.id)] = obj
+
+        resolved = []
+        for ref in references:
+            key = (ref.model_type, ref.obj_pk)
+            ref.__dict__['_resolved'] = (key, objects.get(key))
+            resolved.append(objects.get(key))
+        return resolved
+
+    @classmethod
+    def load_for(cls, instances, id_attr, helper_attr):
+        """
+        Load the references of many instances with one query.
+
+        id_attr names the instances' foreign key column to this table
+        and helper_attr the relationship it backs.  Returns the
+        references, in the order of instances (None where unset).
+        """
+        ids = set(getattr(instance, id_attr) for instance in instances)
+        ids.discard(None)
+        references = {}
+        if ids:
+            references = dict(
+                (ref.id, ref) for ref in cls.query.filter(cls.id.in_(ids)))
+
+        for instance in instances:
+            if helper_attr not in instance.__dict__:
+                set_committed_value(
+                    instance, helper_attr,
+                    references.get(getattr(instance, id_attr)))
+        return [getattr(instance, helper_attr) for instance in instances]
+
     def set_object(self, obj):
         model = obj.__class__
 
@@ -104,21 +170,21 @@ class GenericModelReference(Base):
         self.obj_pk = getattr(obj, pk_column.key)
         self.model_type = obj.__tablename__
 
-    def _get_model_from_type(self, model_type):
+    @classmethod
+    def _get_model_from_type(cls, model_type):
         """ Gets a model from a tablename (model type) """
-        if getattr(type(self), "_TYPE_MAP", None) is None:
+        if getattr(cls, "_TYPE_MAP", None) is None:
             # We want to build on the class (not the instance) a map of all the
             # models by the table name (type) for easy lookup, this is done on
             # the class so it can be shared between all instances
 
             # to prevent circular imports do import here
             registry = dict(Base._decl_class_registry).values()
-            self._TYPE_MAP = dict(
+            cls._TYPE_MAP = dict(
                 ((m.__tablename__, m) for m in registry if hasattr(m, "__tablename__"))
             )
-            setattr(type(self), "_TYPE_MAP",  self._TYPE_MAP)
 
-        return self.__class__._TYPE_MAP[model_type]
+        return cls._TYPE_MAP[model_type]
 
     @classmethod
     def find_for_obj(cls, obj):
@@ -238,6 +304,8 @@ class User(Base, UserMixin):
     url = Column(Unicode)
     bio = Column(UnicodeText)
     name = Column(Unicode)
+    rendered_html = Column(UnicodeText)
+    rendered_stamp = Column(Unicode)
 
     # This is required for the polymorphic inheritance
     type = Column(Unicode)
@@ -247,6 +315,10 @@ class User(Base, UserMixin):
 
     location = Column(Integer, ForeignKey("core__locations.id"))
 
+    # Kept up to date by mediagoblin.notifications, so the notification
+    # badge on every page doesn't need to count them.
+    num_unseen_notifications = Column(Integer, default=0)
+
     # Lazy getters
     get_location = relationship("Location", lazy="joined")
 
@@ -307,14 +379,26 @@ class User(Base, UserMixin):
                                 even if the user hasn't been given the
                                 privilege. (defaults to True)
         """
-        priv = Privilege.query.filter_by(privilege_name=privilege).one()
-        if priv in self.all_privileges:
+        privileges = self.privilege_names
+        if privilege in privileges:
             return True
-        elif allow_admin and self.has_privilege(u'admin', allow_admin=False):
+        elif allow_admin and u'admin' in privileges:
             return True
 
         return False
 
+    @property
+    def privilege_names(self):
+        """
+        The names of all privileges this user holds.
+
+        This is built from the all_privileges collection, which is only
+        loaded once (until the session commits), so checking privileges
+        over and over doesn't cost any queries.
+        """
+        return frozenset(
+            privilege.privilege_name for privilege in self.all_privileges)
+
     def is_banned(self):
         """
         Checks if this user is banned.
@@ -322,7 +406,7 @@ class User(Base, UserMixin):
             :returns                True if self is banned
             :returns                False if self is not
         """
-        return UserBan.query.get(self.id) is not None
+        return self.ban is not None
 
     def serialize(self, request):
         published = UTC.localize(self.created)
@@ -524,11 +608,16 @@ class MediaEntry(Base, MediaEntryMixin, CommentingMixin):
     title = Column(Unicode, nullable=False)
     slug = Column(Unicode)
     description = Column(UnicodeText) # ??
+    rendered_html = Column(UnicodeText)
+    rendered_stamp = Column(Unicode)
     media_type = Column(Unicode, nullable=False)
     state = Column(Unicode, default=u'unprocessed', nullable=False)
         # or use sqlalchemy.types.Enum?
     license = Column(Unicode)
     file_size = Column(Integer, default=0)
+    # md5 hex digest of the originally uploaded file
+    content_hash = Column(Unicode, index=True)
+    num_comments = Column(Integer, default=0)
     location = Column(Integer, ForeignKey("core__locations.id"))
     get_location = relationship("Location", lazy="joined")
 
@@ -583,6 +672,13 @@ class MediaEntry(Base, MediaEntryMixin, CommentingMixin):
     ## TODO
     # fail_error
 
+    def save(self, set_updated=True, *args, **kwargs):
+        # A new updated time also makes the cached template fragments
+        # of this entry (see mediagoblin.tools.fragment_cache) stale
+        if set_updated:
+            self.updated = datetime.datetime.utcnow()
+        super(MediaEntry, self).save(*args, **kwargs)
+
     @property
     def collections(self):
         """ Get any collections that this MediaEntry is in """
@@ -595,6 +691,61 @@ class MediaEntry(Base, MediaEntryMixin, CommentingMixin):
             )
         ))
 
+    @classmethod
+    def load_gallery_data(cls, entries, media_data=False):
+        """
+        Batch load what galleries and feeds show of these entries.
+
+        The media files (for thumb_url) and actors (for url_for_self,
+        including the LocalUser/RemoteUser columns) of all entries are
+        each fetched with one query, instead of lazily one entry at a
+        time.  With media_data=True, the media type specific data is
+        loaded as well, with one query per media type.
+
+        Returns the entries as a list.
+        """
+        entries = list(entries)
+        if not entries:
+            return entries
+        entry_ids = [entry.id for entry in entries]
+
+        media_files = dict((entry_id, []) for entry_id in entry_ids)
+        for media_file in MediaFile.query.filter(
+                MediaFile.media_entry.in_(entry_ids)):
+            media_files[media_file.media_entry].append(media_file)
+
+        actors = dict(
+            (actor.id, actor) for actor in
+            User.query.with_polymorphic('*').filter(
+                User.id.in_(set(entry.actor for entry in entries))))
+
+        for entry in entries:
+            if 'media_files_helper' not in entry.__dict__:
+                set_committed_value(
+                    entry, 'media_files_helper', media_files[entry.id])
+            if 'get_actor' not in entry.__dict__:
+                set_committed_value(
+                    entry, 'get_actor', actors.get(entry.actor))
+
+        if media_data:
+            by_type = {}
+            for entry in entries:
+                by_type.setdefault(entry.media_type, []).append(entry)
+            for media_type, typed_entries in six.iteritems(by_type):
+                data_model = import_component(
+                    media_type + '.models:DATA_MODEL')
+                backref_name = typed_entries[0].media_data_ref
+                data = dict(
+                    (row.media_entry, row) for row in
+                    data_model.query.filter(data_model.media_entry.in_(
+                        [entry.id for entry in typed_entries])))
+                for entry in typed_entries:
+                    if backref_name not in entry.__dict__:
+                        set_committed_value(
+                            entry, backref_name, data.get(entry.id))
+
+        return entries
+
     def get_comments(self, ascending=False):
         query = Comment.query.join(Comment.target_helper).filter(and_(
             GenericModelReference.obj_pk == self.id,
@@ -602,11 +753,24 @@ class MediaEntry(Base, MediaEntryMixin, CommentingMixin):
         ))
 
         if ascending:
-            query = query.order_by(Comment.added.asc())
+            query = query.order_by(Comment.added.asc(), Comment.id.asc())
         else:
-            qury = query.order_by(Comment.added.desc())
-        
-        return FakeCursor(query, lambda c:c.comment())
+            query = query.order_by(Comment.added.desc(), Comment.id.desc())
+
+        return FakeCursor(query, lambda c:c.comment(),
+                          id_criterion=self._comment_link_criterion,
+                          prefetch=Comment.load_comments)
+
+    @staticmethod
+    def _comment_link_criterion(comment_id):
+        """Criterion selecting the Comment link for a TextComment id"""
+        gmr = GenericModelReference.query.filter_by(
+            model_type=TextComment.__tablename__,
+            obj_pk=comment_id
+        ).first()
+        if gmr is None:
+            return Comment.comment_id == None
+        return Comment.comment_id == gmr.id
  
     def url_to_prev(self, urlgen):
         """get the next 'newer' entry by this user"""
@@ -976,6 +1140,30 @@ class Comment(Base):
     comment = association_proxy("comment_helper", "get_object",
                                 creator=GenericModelReference.find_or_new)
 
+    @staticmethod
+    def load_comments(links):
+        """
+        Resolve the comments of these Comment links in one go.
+
+        The references and the actors of the comments take one query
+        each, the comments themselves one query per comment model.
+        """
+        comments = GenericModelReference.resolve_all(
+            GenericModelReference.load_for(links, 'comment_id',
+                                           'comment_helper'))
+        comments = [c for c in comments
+                    if c is not None and 'get_actor' not in c.__dict__
+                    and getattr(c, 'actor', None) is not None]
+        if not comments:
+            return
+
+        actors = dict(
+            (actor.id, actor) for actor in
+            User.query.with_polymorphic('*').filter(
+                User.id.in_(set(c.actor for c in comments))))
+        for comment in comments:
+            set_committed_value(comment, 'get_actor', actors.get(comment.actor))
+
     # When it was added
     added = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     
@@ -993,6 +1181,8 @@ class TextComment(Base, TextCommentMixin, CommentingMixin):
     created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     updated = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     content = Column(UnicodeText, nullable=False)
+    rendered_html = Column(UnicodeText)
+    rendered_stamp = Column(Unicode)
     location = Column(Integer, ForeignKey("core__locations.id"))
     get_location = relationship("Location", lazy="joined")
 
@@ -1005,6 +1195,17 @@ class TextComment(Base, TextCommentMixin, CommentingMixin):
                                               cascade="all, delete-orphan"))
     deletion_mode = Base.SOFT_DELETE
 
+    def soft_delete(self, *args, **kwargs):
+        # Base comes first in the MRO, so this can't live in
+        # CommentingMixin
+        link = self.get_comment_link()
+        if link is not None:
+            target = link.target()
+            if isinstance(target, MediaEntry):
+                target.num_comments = MediaEntry.num_comments - 1
+            link.delete()
+        return super(TextComment, self).soft_delete(*args, **kwargs)
+
     def serialize(self, request):
         """ Unserialize to python dictionary for API """
         target = self.get_reply_to()
@@ -1070,6 +1271,7 @@ class TextComment(Base, TextCommentMixin, CommentingMixin):
             link = Comment()
             link.target = media
             link.comment = self
+            media.num_comments = MediaEntry.num_comments + 1
             link.save()
         
         return True
@@ -1097,6 +1299,8 @@ class Collection(Base, CollectionMixin, CommentingMixin):
                      index=True)
     updated = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     description = Column(UnicodeText)
+    rendered_html = Column(UnicodeText)
+    rendered_stamp = Column(Unicode)
     actor = Column(Integer, ForeignKey(User.id), nullable=False)
     num_items = Column(Integer, default=0)
 
@@ -1129,6 +1333,20 @@ class Collection(Base, CollectionMixin, CommentingMixin):
     COMMENT_TYPE = "core-comments"
     USER_DEFINED_TYPE = "core-user-defined"
 
+    def touch_media_entries(self):
+        """
+        Set the updated time of the media entries in this collection,
+        so their cached template fragments showing the collection are
+        rendered again.
+        """
+        entry_ids = select([GenericModelReference.obj_pk]).where(and_(
+            GenericModelReference.id == CollectionItem.object_id,
+            GenericModelReference.model_type == MediaEntry.__tablename__,
+            CollectionItem.collection == self.id))
+        MediaEntry.query.filter(MediaEntry.id.in_(entry_ids)).update(
+            {MediaEntry.updated: datetime.datetime.utcnow()},
+            synchronize_session=False)
+
     def get_collection_items(self, ascending=False):
         #TODO, is this still needed with self.collection_items being available?
         order_col = CollectionItem.position
@@ -1149,7 +1367,7 @@ class Collection(Base, CollectionMixin, CommentingMixin):
         # Get all serialized output in a list
         items = [i.serialize(request) for i in self.get_collection_items()]
         return {
-            "totalItems": self.items,
+            "totalItems": self.num_items,
             "url": self.url_for_self(request.urlgen, qualified=True),
             "items": items,
         }
@@ -1162,6 +1380,8 @@ class CollectionItem(Base, CollectionItemMixin):
 
     collection = Column(Integer, ForeignKey(Collection.id), nullable=False)
     note = Column(UnicodeText, nullable=True)
+    rendered_html = Column(UnicodeText)
+    rendered_stamp = Column(Unicode)
     added = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     position = Column(Integer)
     # Cascade: CollectionItems are owned by their Collection. So do the full thing.
@@ -1207,6 +1427,23 @@ class CollectionItem(Base, CollectionItemMixin):
     def serialize(self, request):
         return self.get_object().serialize(request)
 
+    @staticmethod
+    def load_objects(items):
+        """
+        Resolve the objects of these collection items in one go, with
+        one query for their references and one per object model, and
+        load the gallery data of the media entries among them.
+
+        Returns the items as a list.
+        """
+        items = list(items)
+        objects = GenericModelReference.resolve_all(
+            GenericModelReference.load_for(items, 'object_id',
+                                           'object_helper'))
+        MediaEntry.load_gallery_data(
+            obj for obj in objects if isinstance(obj, MediaEntry))
+        return items
+
 
 class ProcessingMetaData(Base):
     __tablename__ = 'core__processing_metadata'
@@ -1390,6 +1627,10 @@ class UserBan(Base):
     expiration_date = Column(Date)
     reason = Column(UnicodeText, nullable=False)
 
+    banned_user = relationship(User,
+        backref=backref("ban", uselist=False,
+                        cascade="all, delete-orphan"))
+
 
 class Privilege(Base):
     """
@@ -1539,6 +1780,54 @@ class Activity(Base, ActivityMixin):
             self.updated = datetime.datetime.now()
         super(Activity, self).save(*args, **kwargs)
 
+    @classmethod
+    def load_feed_data(cls, activities):
+        """
+        Batch load what serializing these activities needs.
+
+        The object references, target references, actors and generators
+        of all activities are each fetched with one query, then the objects
+        and targets with one query per model (see
+        GenericModelReference.resolve_all).  Media entries among them
+        get their gallery data loaded too.
+
+        Returns the activities as a list.
+        """
+        activities = list(activities)
+        if not activities:
+            return activities
+
+        references = GenericModelReference.load_for(
+            activities, 'object_id', 'object_helper')
+        references.extend(GenericModelReference.load_for(
+            activities, 'target_id', 'target_helper'))
+
+        actors = dict(
+            (actor.id, actor) for actor in
+            User.query.with_polymorphic('*').filter(
+                User.id.in_(set(a.actor for a in activities))))
+
+        generator_ids = set(a.generator for a in activities
+                            if a.generator is not None)
+        generators = {}
+        if generator_ids:
+            generators = dict(
+                (generator.id, generator) for generator in
+                Generator.query.filter(Generator.id.in_(generator_ids)))
+
+        for activity in activities:
+            for key, value in (
+                    ('get_actor', actors.get(activity.actor)),
+                    ('get_generator', generators.get(activity.generator))):
+                if key not in activity.__dict__:
+                    set_committed_value(activity, key, value)
+
+        objects = GenericModelReference.resolve_all(references)
+        MediaEntry.load_gallery_data(
+            obj for obj in objects if isinstance(obj, MediaEntry))
+
+        return activities
+
 class Graveyard(Base):
     """ Where models come to die """
     __tablename__ = "core__graveyard"
@@ -1579,6 +1868,14 @@ MODELS = [
     UserBan, Privilege, PrivilegeUserAssociation, RequestToken, AccessToken,
     NonceTimestamp, Activity, Generator, Location, GenericModelReference, Graveyard]
 
+
+@event.listens_for(Session, 'before_flush')
+def render_markdown_before_flush(session, flush_context, instances):
+    """Store the rendered Markdown fields of everything getting saved"""
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, RenderedMarkdownMixin):
+            obj.render_markdown()
+
 """
  Foundations are the default rows that are created immediately after the tables
  are initialized. Each entry to  this dictionary should be in the format of:
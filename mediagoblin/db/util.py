@@ -14,10 +14,17 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
 import sys
 
+import six
+
 from mediagoblin import mg_globals as mgg
-from mediagoblin.db.models import MediaEntry, Tag, MediaTag, Collection
+from sqlalchemy import and_, func, select
+
+from mediagoblin.db.models import MediaEntry, Tag, MediaTag, Collection, \
+        CollectionItem, Comment, GenericModelReference, Notification, User, \
+        TextComment
 from mediagoblin.gmg_commands.dbupdate import gather_database_data
 
 from mediagoblin.tools.transition import DISABLE_GLOBALS
@@ -44,6 +51,94 @@ def check_media_slug_used(uploader_id, slug, ignore_m_id):
     return does_exist
 
 
+def media_entries_for_content_hash(content_hashes, uploader_id=None):
+    """
+    Query the media entries whose original file had one of the given
+    md5 hex digests, optionally only those of one uploader.
+    """
+    query = MediaEntry.query.filter(
+        MediaEntry.content_hash.in_(
+            [six.text_type(h).lower() for h in content_hashes]))
+    if uploader_id is not None:
+        query = query.filter_by(actor=uploader_id)
+    return query
+
+
+def rebuild_counters(commit=True):
+    """
+    Recount the denormalised counters: the comments of every media
+    entry, the items of every collection and the unseen notifications
+    of every user.
+    """
+    num_comments = select([func.count(Comment.id)]).where(and_(
+        Comment.target_id == GenericModelReference.id,
+        GenericModelReference.model_type == MediaEntry.__tablename__,
+        GenericModelReference.obj_pk == MediaEntry.id)).as_scalar()
+    Session.execute(MediaEntry.__table__.update().values(
+        num_comments=num_comments))
+
+    num_items = select([func.count(CollectionItem.id)]).where(
+        CollectionItem.collection == Collection.id).as_scalar()
+    Session.execute(Collection.__table__.update().values(
+        num_items=num_items))
+
+    num_unseen_notifications = select([func.count(Notification.id)]).where(
+        and_(Notification.user_id == User.id,
+             Notification.seen == False)).as_scalar()
+    Session.execute(User.__table__.update().values(
+        num_unseen_notifications=num_unseen_notifications))
+
+    if commit:
+        Session.commit()
+
+
+def render_all_markdown(force=False, batch_size=500):
+    """
+    Bring the stored renderings of all Markdown fields (see
+    RenderedMarkdownMixin) up to date, committing after every batch_size
+    objects.  With force, everything gets rendered again.
+
+    Returns the number of objects rendered.
+    """
+    rendered = 0
+    for model in [User, MediaEntry, TextComment, Collection, CollectionItem]:
+        last_id = 0
+        while True:
+            batch = model.query.filter(model.id > last_id).order_by(
+                model.id).limit(batch_size).all()
+            if not batch:
+                break
+
+            for obj in batch:
+                old_stamp = obj.rendered_stamp
+                if force:
+                    obj.rendered_stamp = None
+                obj.render_markdown()
+                if force or obj.rendered_stamp != old_stamp:
+                    rendered += 1
+
+            last_id = batch[-1].id
+            Session.commit()
+
+    return rendered
+
+
+def newest_and_count(query, *date_columns):
+    """
+    Return the newest value of date_columns among the rows of query,
+    and the number of rows, with a single query.  These make good
+    conditional GET validators for pages listing query's rows (see
+    mediagoblin.decorators.conditional_get).
+
+    query shouldn't be ordered or limited.
+    """
+    row = query.with_entities(
+        func.count(), *[func.max(column) for column in date_columns]).one()
+    dates = [date for date in row[1:] if date is not None]
+    newest = max(dates) if dates else datetime.datetime(1970, 1, 1)
+    return newest, row[0]
+
+
 def media_entries_for_tag_slug(dummy_db, tag_slug):
     return MediaEntry.query \
         .join(MediaEntry.tags_helper) \
@@ -14,21 +14,25 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 from functools import wraps
 
 from werkzeug.exceptions import Forbidden, NotFound
+from werkzeug.http import is_resource_modified
+from werkzeug.wrappers import Response
 from oauthlib.oauth1 import ResourceEndpoint
 
 from six.moves.urllib.parse import urljoin
 
 from mediagoblin import mg_globals as mgg
-from mediagoblin import messages
+from mediagoblin import messages, __version__
 from mediagoblin.db.models import MediaEntry, LocalUser, TextComment, \
                                   AccessToken, Comment
 from mediagoblin.tools.response import (
     redirect, render_404,
     render_user_banned, json_response)
 from mediagoblin.tools.translate import pass_to_ugettext as _
+from mediagoblin.tools.pagination import decode_marker, InvalidMarker
 
 from mediagoblin.oauth.tools.request import decode_authorization_header
 from mediagoblin.oauth.oauth import GMGRequestValidator
@@ -172,6 +176,89 @@ def uses_pagination(controller):
     return wrapper
 
 
+def uses_keyset_pagination(controller):
+    """
+    Check request GET 'marker' and 'dir' keys for wrong values and pass
+    them on to the controller decoded, for use with KeysetPagination
+    """
+    @wraps(controller)
+    def wrapper(request, *args, **kwargs):
+        marker = request.GET.get('marker')
+        direction = request.GET.get('dir', u'next')
+        if direction not in (u'next', u'prev'):
+            return render_404(request)
+
+        if marker:
+            try:
+                marker = decode_marker(marker)
+            except InvalidMarker:
+                return render_404(request)
+        else:
+            marker = None
+
+        return controller(request, marker=marker, direction=direction,
+                          *args, **kwargs)
+
+    return wrapper
+
+
+def conditional_get(get_validators, public=False):
+    """
+    Answer conditional GET requests with "304 Not Modified", without
+    running the controller, when what it shows didn't change.
+
+    get_validators is called like the controller and returns a
+    (last_modified, values) tuple: the newest created/updated time of
+    what the response shows, and a tuple of anything else it depends on
+    (like counts), from which the ETag is made.  It may return None to
+    skip this for a request.
+
+    Pages for logged in users (and with pending messages) show more
+    than that, so those are always rendered, unless public says the
+    response doesn't depend on who asks (like the API's).  The
+    validators are kept as request.conditional_validators.
+
+    Clients are told to revalidate every time (Cache-Control: no-cache)
+    rather than guess how long they may keep the response.
+    """
+    def decorator(controller):
+        @wraps(controller)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or (not public and (
+                    request.user or request.session.get('messages'))):
+                return controller(request, *args, **kwargs)
+
+            validators = get_validators(request, *args, **kwargs)
+            # For cached_feed, so they aren't queried twice
+            request.conditional_validators = validators
+            if validators is None:
+                return controller(request, *args, **kwargs)
+
+            last_modified, values = validators
+            etag = hashlib.md5(repr(
+                (__version__, request.locale, last_modified.isoformat())
+                + tuple(values)).encode('utf-8')).hexdigest()
+
+            if not is_resource_modified(request.environ, etag=etag,
+                                        last_modified=last_modified):
+                response = Response(status=304)
+            else:
+                response = controller(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                # Like AtomFeed.get_response()'s, which has no ETag support
+                response = Response.force_type(response, request.environ)
+
+            response.set_etag(etag)
+            response.cache_control.no_cache = True
+            response.last_modified = last_modified
+            return response
+
+        return wrapper
+
+    return decorator
+
+
 def get_user_media_entry(controller):
     """
     Pass in a MediaEntry based off of a url component
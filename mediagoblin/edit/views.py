@@ -371,6 +371,7 @@ def edit_collection(request, collection):
             collection.description = six.text_type(form.description.data)
             collection.slug = six.text_type(form.slug.data)
 
+            collection.touch_media_entries()
             collection.save()
 
             return redirect_obj(request, collection)
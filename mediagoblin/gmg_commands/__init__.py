@@ -76,6 +76,22 @@ SUBCOMMAND_MAP = {
         'setup': 'mediagoblin.gmg_commands.batchaddmedia:parser_setup',
         'func': 'mediagoblin.gmg_commands.batchaddmedia:batchaddmedia',
         'help': 'Add many media entries at once'},
+    'rebuildcounters': {
+        'setup': 'mediagoblin.gmg_commands.counters:parser_setup',
+        'func': 'mediagoblin.gmg_commands.counters:rebuildcounters',
+        'help': 'Recount comments, collection items and notifications'},
+    'rendermarkdown': {
+        'setup': 'mediagoblin.gmg_commands.rendermarkdown:parser_setup',
+        'func': 'mediagoblin.gmg_commands.rendermarkdown:rendermarkdown',
+        'help': 'Render and store the HTML of all Markdown texts'},
+    'startupprofile': {
+        'setup': 'mediagoblin.gmg_commands.startupprofile:parser_setup',
+        'func': 'mediagoblin.gmg_commands.startupprofile:startupprofile',
+        'help': 'Report the time spent starting up the application'},
+    'warmuptemplates': {
+        'setup': 'mediagoblin.gmg_commands.templates:parser_setup',
+        'func': 'mediagoblin.gmg_commands.templates:warmuptemplates',
+        'help': 'Compile all templates (into the bytecode cache)'},
     # 'theme': {
     #     'setup': 'mediagoblin.gmg_commands.theme:theme_parser_setup',
     #     'func': 'mediagoblin.gmg_commands.theme:theme',
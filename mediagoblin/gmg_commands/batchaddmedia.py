@@ -18,7 +18,10 @@ from __future__ import print_function
 
 import codecs
 import csv
+import io
+import multiprocessing
 import os
+import threading
 
 import requests
 import six
@@ -53,59 +56,78 @@ u"""Path to the csv file containing metadata information."""))
         '--celery',
         action='store_true',
         help=_(u"Don't process eagerly, pass off to celery"))
+    subparser.add_argument(
+        '--jobs', '-j',
+        type=int, default=1,
+        help=_(u"Number of media files to fetch and process in parallel"))
+    subparser.add_argument(
+        '--journal',
+        help=_(u"File recording the rows submitted so far, so a rerun "
+               u"skips them (defaults to the metadata path + '.journal')"))
 
 
-def batchaddmedia(args):
-    # Run eagerly unless explicetly set not to
-    if not args.celery:
-        os.environ['CELERY_ALWAYS_EAGER'] = 'true'
-
-    app = commands_util.setup_app(args)
+def maybe_unicodeify(some_string):
+    # this is kinda terrible
+    if some_string is None:
+        return None
+    else:
+        return six.text_type(some_string)
 
-    files_uploaded, files_attempted = 0, 0
 
-    # get the user
-    user = app.db.LocalUser.query.filter(
-        LocalUser.username==args.username.lower()
-    ).first()
-    if user is None:
-        print(_(u"Sorry, no user by username '{username}' exists".format(
-                    username=args.username)))
-        return
-
-    upload_limit, max_file_size = get_upload_file_limits(user)
-    temp_files = []
+class BatchIngester(object):
+    """
+    Submits the rows of a metadata csv file for one user.
 
-    if os.path.isfile(args.metadata_path):
-        metadata_path = args.metadata_path
+    Each process doing the ingestion has one of these, holding its own
+    app (and so database connection) and a pooled HTTP session which
+    keeps connections to remote media servers alive between rows.
+    """
+    def __init__(self, app, user, metadata_dir):
+        self.app = app
+        self.user = user
+        self.metadata_dir = metadata_dir
+        self.upload_limit, self.max_file_size = get_upload_file_limits(user)
+        self.http = requests.Session()
 
-    else:
-        error = _(u'File at {path} not found, use -h flag for help'.format(
-                    path=args.metadata_path))
-        print(error)
-        return
+    def open_media(self, original_location):
+        """
+        Open the media file at original_location, or return None with
+        a printed failure message.
+        """
+        url = urlparse(original_location)
+        filename = url.path.split()[-1]
 
-    abs_metadata_filename = os.path.abspath(metadata_path)
-    abs_metadata_dir = os.path.dirname(abs_metadata_filename)
-    upload_limit, max_file_size = get_upload_file_limits(user)
+        if url.scheme in ('http', 'https'):
+            try:
+                res = self.http.get(url.geturl(), stream=True)
+                res.raise_for_status()
+            except requests.RequestException as exc:
+                return filename, None, _(u"""\
+FAIL: Remote file {filename} could not be fetched: {error}
+{filename} will not be uploaded.""".format(filename=filename, error=exc))
+            # Let requests undo any transfer encoding while we read
+            res.raw.decode_content = True
+            return filename, res.raw, None
 
-    def maybe_unicodeify(some_string):
-        # this is kinda terrible
-        if some_string is None:
-            return None
+        path = url.path
+        if os.path.isabs(path):
+            file_abs_path = os.path.abspath(path)
         else:
-            return six.text_type(some_string)
-
-    with codecs.open(
-            abs_metadata_filename, 'r', encoding='utf-8') as all_metadata:
-        contents = all_metadata.read()
-        media_metadata = parse_csv_file(contents)
+            file_path = os.path.join(self.metadata_dir, path)
+            file_abs_path = os.path.abspath(file_path)
+        try:
+            return filename, open(file_abs_path, 'rb'), None
+        except IOError:
+            return filename, None, _(u"""\
+FAIL: Local file {filename} could not be accessed.
+{filename} will not be uploaded.""".format(filename=filename))
 
-    for media_id, file_metadata in media_metadata.iteritems():
-        files_attempted += 1
-        # In case the metadata was not uploaded initialize an empty dictionary.
-        json_ld_metadata = compact_and_validate({})
+    def ingest(self, media_id, file_metadata):
+        """
+        Submit one row of the metadata file.
 
+        Returns a (media_id, succeeded, message) tuple.
+        """
         # Get all metadata entries starting with 'media' as variables and then
         # delete them because those are for internal use only.
         original_location = file_metadata['location']
@@ -125,34 +147,16 @@ Metadata was not uploaded.""".format(
                 media_id=media_id,
                 error_path=exc.path[0],
                 error_msg=exc.message))
-            print(error)
-            continue
+            return media_id, False, error
 
-        url = urlparse(original_location)
-        filename = url.path.split()[-1]
+        filename, media_file, error = self.open_media(original_location)
+        if media_file is None:
+            return media_id, False, error
 
-        if url.scheme == 'http':
-            res = requests.get(url.geturl(), stream=True)
-            media_file = res.raw
-
-        elif url.scheme == '':
-            path = url.path
-            if os.path.isabs(path):
-                file_abs_path = os.path.abspath(path)
-            else:
-                file_path = os.path.join(abs_metadata_dir, path)
-                file_abs_path = os.path.abspath(file_path)
-            try:
-                media_file = file(file_abs_path, 'r')
-            except IOError:
-                print(_(u"""\
-FAIL: Local file {filename} could not be accessed.
-{filename} will not be uploaded.""".format(filename=filename)))
-                continue
         try:
             submit_media(
-                mg_app=app,
-                user=user,
+                mg_app=self.app,
+                user=self.user,
                 submitted_file=media_file,
                 filename=filename,
                 title=maybe_unicodeify(title),
@@ -160,28 +164,189 @@ FAIL: Local file {filename} could not be accessed.
                 license=maybe_unicodeify(license),
                 metadata=json_ld_metadata,
                 tags_string=u"",
-                upload_limit=upload_limit, max_file_size=max_file_size)
-            print(_(u"""Successfully submitted {filename}!
+                upload_limit=self.upload_limit,
+                max_file_size=self.max_file_size)
+            return media_id, True, _(u"""Successfully submitted {filename}!
 Be sure to look at the Media Processing Panel on your website to be sure it
-uploaded successfully.""".format(filename=filename)))
-            files_uploaded += 1
+uploaded successfully.""".format(filename=filename))
         except FileUploadLimit:
-            print(_(
-u"FAIL: This file is larger than the upload limits for this site."))
+            return media_id, False, _(
+u"FAIL: This file is larger than the upload limits for this site.")
         except UserUploadLimit:
-            print(_(
-"FAIL: This file will put this user past their upload limits."))
+            return media_id, False, _(
+"FAIL: This file will put this user past their upload limits.")
         except UserPastUploadLimit:
-            print(_("FAIL: This user is already past their upload limits."))
+            return media_id, False, _(
+"FAIL: This user is already past their upload limits.")
+        finally:
+            media_file.close()
+
+
+def get_user(app, username):
+    return app.db.LocalUser.query.filter(
+        LocalUser.username==username.lower()
+    ).first()
+
+
+# The BatchIngester of a worker process, see _init_worker
+_worker_ingester = None
+
+
+def _init_worker(args, metadata_dir):
+    global _worker_ingester
+    app = commands_util.setup_app(args)
+    _worker_ingester = BatchIngester(
+        app, get_user(app, args.username), metadata_dir)
+
+
+def _ingest_in_worker(row):
+    media_id, file_metadata = row
+    try:
+        return _worker_ingester.ingest(media_id, file_metadata)
+    except Exception as exc:
+        # Report it like any other failure rather than losing the row,
+        # the pool would otherwise never hand back a result for it.
+        _worker_ingester.app.db.reset_after_request()
+        return media_id, False, _(u"FAIL: {media_id}: {error!r}".format(
+            media_id=media_id, error=exc))
+
+
+def read_journal(journal_path):
+    """Return the set of media ids recorded in the journal file"""
+    if not os.path.exists(journal_path):
+        return set()
+    with io.open(journal_path, 'r', encoding='utf-8') as journal:
+        return set(line.rstrip(u'\n') for line in journal if line.strip())
+
+
+def write_journal(journal, media_id):
+    """Record a submitted media id, making sure it hits the disk"""
+    journal.write(six.text_type(media_id) + u'\n')
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def batchaddmedia(args):
+    # Run eagerly unless explicetly set not to
+    if not args.celery:
+        os.environ['CELERY_ALWAYS_EAGER'] = 'true'
+
+    app = commands_util.setup_app(args)
+
+    # get the user
+    user = get_user(app, args.username)
+    if user is None:
+        print(_(u"Sorry, no user by username '{username}' exists".format(
+                    username=args.username)))
+        return
+
+    if os.path.isfile(args.metadata_path):
+        metadata_path = args.metadata_path
+
+    else:
+        error = _(u'File at {path} not found, use -h flag for help'.format(
+                    path=args.metadata_path))
+        print(error)
+        return
+
+    abs_metadata_filename = os.path.abspath(metadata_path)
+    abs_metadata_dir = os.path.dirname(abs_metadata_filename)
+
+    journal_path = args.journal or abs_metadata_filename + '.journal'
+    already_submitted = read_journal(journal_path)
+    if already_submitted:
+        print(_(u"Skipping {count} files already submitted according to "
+                u"{journal}".format(count=len(already_submitted),
+                                    journal=journal_path)))
+
+    def pending_rows(all_metadata):
+        for media_id, file_metadata in iter_csv_rows(all_metadata):
+            if six.text_type(media_id) in already_submitted:
+                continue
+            yield media_id, file_metadata
+
+    with open_csv_file(abs_metadata_filename) as all_metadata, \
+            io.open(journal_path, 'a', encoding='utf-8') as journal:
+
+        def report(result):
+            media_id, succeeded, message = result
+            print(message)
+            if succeeded:
+                write_journal(journal, media_id)
+            return succeeded
+
+        rows = pending_rows(all_metadata)
+        if args.jobs > 1:
+            # The workers set up their own app; don't hand them our
+            # database connections.
+            app.db.engine.dispose()
+            results = _run_in_pool(args, rows, abs_metadata_dir, report)
+        else:
+            ingester = BatchIngester(app, user, abs_metadata_dir)
+            results = [report(ingester.ingest(media_id, file_metadata))
+                       for media_id, file_metadata in rows]
+
+    files_attempted = len(results)
+    files_uploaded = results.count(True)
     print(_(
 "{files_uploaded} out of {files_attempted} files successfully submitted".format(
         files_uploaded=files_uploaded,
         files_attempted=files_attempted)))
 
 
+def _run_in_pool(args, rows, metadata_dir, report):
+    """
+    Ingest rows with a pool of args.jobs worker processes.
+
+    Only a few rows per worker are read ahead of the ones being worked
+    on, so even huge metadata files never sit in memory completely.
+    report is called with each result, one at a time.
+    """
+    pool = multiprocessing.Pool(
+        args.jobs, _init_worker, (args, metadata_dir))
+    slots = threading.Semaphore(args.jobs * 2)
+    stopped = threading.Event()
+    results = []
+
+    def throttled_rows():
+        # Runs in the pool's task feeding thread, which would otherwise
+        # read through all of the rows right away.
+        for row in rows:
+            slots.acquire()
+            if stopped.is_set():
+                return
+            yield row
+
+    try:
+        for result in pool.imap_unordered(_ingest_in_worker,
+                                          throttled_rows()):
+            slots.release()
+            results.append(report(result))
+        pool.close()
+    except BaseException:
+        stopped.set()
+        slots.release()
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return results
+
+
+def open_csv_file(filename):
+    """Open a metadata csv file for use with iter_csv_rows"""
+    if six.PY2:
+        return codecs.open(filename, 'r', encoding='utf-8')
+    return io.open(filename, 'r', encoding='utf-8', newline='')
+
+
 def unicode_csv_reader(unicode_csv_data, dialect=csv.excel, **kwargs):
+    if six.PY3:
+        for row in csv.reader(unicode_csv_data, dialect=dialect, **kwargs):
+            yield row
+        return
     # csv.py doesn't do Unicode; encode temporarily as UTF-8:
-    # TODO: this probably won't be necessary in Python 3
     csv_reader = csv.reader(utf_8_encoder(unicode_csv_data),
                             dialect=dialect, **kwargs)
     for row in csv_reader:
@@ -192,24 +357,28 @@ def utf_8_encoder(unicode_csv_data):
     for line in unicode_csv_data:
         yield line.encode('utf-8')
 
+def iter_csv_rows(unicode_csv_data):
+    """
+    Iterate over the rows of a metadata csv file one at a time,
+    yielding (media_id, row dictionary) tuples.  The media_id is the
+    row's 'id' value if provided, otherwise its index.
+    """
+    reader = unicode_csv_reader(unicode_csv_data)
+    try:
+        key = next(reader)
+    except StopIteration:
+        return
+
+    for index, values in enumerate(reader):
+        if not any(value.strip() for value in values): continue
+        line_dict = dict(zip(key, values))
+        media_id = line_dict.get('id') or index
+        yield media_id, line_dict
+
 def parse_csv_file(file_contents):
     """
     The helper function which converts the csv file into a dictionary where each
     item's key is the provided value 'id' and each item's value is another
     dictionary.
     """
-    list_of_contents = file_contents.split('\n')
-    key, lines = (list_of_contents[0].split(','),
-                  list_of_contents[1:])
-    objects_dict = {}
-
-    # Build a dictionary
-    for index, line in enumerate(lines):
-        if line.isspace() or line == u'': continue
-        values = unicode_csv_reader([line]).next()
-        line_dict = dict([(key[i], val)
-            for i, val in enumerate(values)])
-        media_id = line_dict.get('id') or index
-        objects_dict[media_id] = (line_dict)
-
-    return objects_dict
+    return dict(iter_csv_rows(file_contents.splitlines(True)))
@@ -0,0 +1,32 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+from mediagoblin.db.util import rebuild_counters
+from mediagoblin.gmg_commands import util as commands_util
+
+
+def parser_setup(subparser):
+    subparser.description = """\
+Recount the comments of media entries, the items of collections and the
+unseen notifications of users, in case the stored counts went wrong."""
+
+
+def rebuildcounters(args):
+    commands_util.setup_app(args)
+    rebuild_counters()
+    print('Done.')
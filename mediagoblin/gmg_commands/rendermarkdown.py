@@ -0,0 +1,36 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+from mediagoblin.db.util import render_all_markdown
+from mediagoblin.gmg_commands import util as commands_util
+
+
+def parser_setup(subparser):
+    subparser.description = """\
+Render the Markdown of user bios, media and collection descriptions,
+comments and collection item notes, and store the HTML.  Only outdated
+renderings are redone, unless --force is given."""
+    subparser.add_argument(
+        '--force', action='store_true',
+        help="Render everything again, even if it looks up to date")
+
+
+def rendermarkdown(args):
+    commands_util.setup_app(args)
+    rendered = render_all_markdown(force=args.force)
+    print('Rendered {0} objects.'.format(rendered))
@@ -17,18 +17,52 @@
 from __future__ import print_function
 
 import argparse
+import collections
+import datetime
 import os
+import time
+
+import celery
 
 from mediagoblin import mg_globals
+from mediagoblin.db.base import Session
 from mediagoblin.db.models import MediaEntry
 from mediagoblin.gmg_commands import util as commands_util
 from mediagoblin.submit.lib import run_process_media
 from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
 from mediagoblin.tools.pluginapi import hook_handle
 from mediagoblin.processing import (
-    ProcessorDoesNotExist, ProcessorNotEligible,
+    ProcessorDoesNotExist, ProcessorNotEligible, mark_entry_failed,
     get_entry_and_processing_manager, get_processing_manager_for_type,
     ProcessingManagerDoesNotExist)
+from mediagoblin.processing.task import ProcessMedia
+
+
+def add_bulk_arguments(parser):
+    """
+    Add the arguments controlling batching and throttling to a bulk
+    reprocessing subcommand
+    """
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=500,
+        help="How many media entries to fetch and queue at once")
+
+    parser.add_argument(
+        '--max-in-flight',
+        type=int,
+        default=2000,
+        help="Maximum number of queued tasks not finished yet, "
+             "0 for no limit")
+
+    parser.add_argument(
+        '--start-after',
+        type=int,
+        default=0,
+        metavar='MEDIA_ID',
+        help="Only reprocess media with a higher id, to resume an "
+             "interrupted run")
 
 
 def reprocess_parser_setup(subparser):
@@ -95,13 +129,17 @@ def reprocess_parser_setup(subparser):
         type=int,
         metavar=('max_width', 'max_height'))
 
+    add_bulk_arguments(thumbs)
+
     #################
     # initial command
     #################
-    subparsers.add_parser(
+    initial_parser = subparsers.add_parser(
         'initial',
         help='Reprocess all failed media')
 
+    add_bulk_arguments(initial_parser)
+
     ##################
     # bulk_run command
     ##################
@@ -120,6 +158,8 @@ def reprocess_parser_setup(subparser):
         help='The state of the media you would like to process. Defaults to' \
              " 'processed'")
 
+    add_bulk_arguments(bulk_run_parser)
+
     bulk_run_parser.add_argument(
         'reprocess_command',
         help='The reprocess command you intend to run')
@@ -209,6 +249,144 @@ def run(args, media_id=None):
         print('No such processing manager for {0}'.format(entry.media_type))
 
 
+def _format_eta(seconds):
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+def bulk_reprocess(args, query, reprocess_action, make_request=None):
+    """
+    Queue the reprocess_action for every media entry matching query.
+
+    Entries are walked in batches of args.batch_size in ascending id
+    order, so no cursor stays open for the whole run, and each batch is
+    dispatched as one celery group.  Before a batch is queued, we wait
+    until fewer than args.max_in_flight tasks are unfinished.
+
+    make_request(processor_class) builds the reprocess_info for a media
+    type; it is called once per media type.
+
+    Progress is printed after every batch, together with the id to pass
+    to --start-after to resume from.
+    """
+    max_in_flight = args.max_in_flight
+    if max_in_flight and celery.current_app.conf.get('CELERY_IGNORE_RESULT'):
+        print('Task results are ignored, so the number of tasks in flight '
+              'can\'t be limited.')
+        max_in_flight = 0
+
+    query = query.filter(MediaEntry.id > args.start_after)
+    total = query.count()
+
+    # media_type -> (processor_class, reprocess_info), or None if that
+    # media type can't be reprocessed this way
+    prepared = {}
+
+    # (media id, task result) pairs of the queued tasks, in id order
+    in_flight = collections.deque()
+    done_upto = args.start_after
+
+    examined, queued, finished = 0, 0, 0
+    last_id = args.start_after
+    started = time.time()
+
+    def reap():
+        # Tasks mostly finish in the order they were queued, so only the
+        # oldest ones are polled.  Everything queued before the first
+        # task still running is done.
+        finished_now = 0
+        while in_flight and in_flight[0][1].ready():
+            in_flight.popleft()
+            finished_now += 1
+        return finished_now
+
+    def prepare(entry):
+        if entry.media_type not in prepared:
+            try:
+                manager = get_processing_manager_for_type(entry.media_type)
+                processor_class = manager.get_processor(reprocess_action)
+            except ProcessingManagerDoesNotExist:
+                print('No such processing manager for {0}'.format(
+                    entry.media_type))
+                prepared[entry.media_type] = None
+            except ProcessorDoesNotExist:
+                print('No such processor "%s" for media type "%s"' % (
+                    reprocess_action, entry.media_type))
+                prepared[entry.media_type] = None
+            else:
+                reprocess_request = None
+                if make_request is not None:
+                    reprocess_request = make_request(processor_class)
+                prepared[entry.media_type] = (
+                    processor_class, reprocess_request)
+        return prepared[entry.media_type]
+
+    try:
+        while True:
+            batch = query.filter(MediaEntry.id > last_id).order_by(
+                MediaEntry.id).limit(args.batch_size).all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+            examined += len(batch)
+
+            signatures, media_ids = [], []
+            for entry in batch:
+                processor = prepare(entry)
+                if processor is None:
+                    continue
+                processor_class, reprocess_request = processor
+                if not processor_class.media_is_eligible(entry):
+                    print('Processor "%s" exists but media "%s" is not '
+                          'eligible' % (reprocess_action, entry.id))
+                    continue
+                signatures.append(ProcessMedia().subtask(
+                    (entry.id, None, reprocess_action, reprocess_request),
+                    task_id=entry.queued_task_id))
+                media_ids.append(entry.id)
+
+            # Don't keep the whole table in the session
+            Session.remove()
+
+            while (max_in_flight and in_flight
+                   and len(in_flight) + len(signatures) > max_in_flight):
+                time.sleep(1)
+                finished += reap()
+
+            if signatures:
+                try:
+                    group_result = celery.group(signatures).apply_async()
+                except Exception as exc:
+                    # Like run_process_media, record the failure here, as
+                    # it won't be on the celery end in "lazy" or eager
+                    # with exceptions propagated modes.  An interrupt
+                    # still leaves the batch to resume with.
+                    for media_id in media_ids:
+                        mark_entry_failed(media_id, exc)
+                    raise
+                in_flight.extend(zip(media_ids, group_result.results))
+                queued += len(signatures)
+
+            finished += reap()
+            if in_flight:
+                done_upto = in_flight[0][0] - 1
+            else:
+                done_upto = last_id
+
+            elapsed = time.time() - started
+            eta = elapsed / examined * max(total - examined, 0)
+            print('Examined {0}/{1} entries ({2:.1f}%), queued {3}, '
+                  'finished {4}, ETA {5}; resume with --start-after {6}'.format(
+                      examined, total, 100.0 * examined / max(total, 1),
+                      queued, finished, _format_eta(eta), done_upto))
+
+    except KeyboardInterrupt:
+        print('Interrupted; resume with --start-after {0}'.format(done_upto))
+        return
+
+    print('Queued {0} of {1} entries in {2}'.format(
+        queued, total, _format_eta(time.time() - started)))
+
+
 def bulk_run(args):
     """
     Bulk reprocessing of a given media_type
@@ -216,8 +394,12 @@ def bulk_run(args):
     query = MediaEntry.query.filter_by(media_type=args.type,
                                        state=args.state)
 
-    for entry in query:
-        run(args, entry.id)
+    def make_request(processor_class):
+        reprocess_parser = processor_class.generate_parser()
+        reprocess_args = reprocess_parser.parse_args(args.reprocess_args)
+        return processor_class.args_to_request(reprocess_args)
+
+    bulk_reprocess(args, query, args.reprocess_command, make_request)
 
 
 def thumbs(args):
@@ -226,44 +408,22 @@ def thumbs(args):
     """
     query = MediaEntry.query.filter_by(state='processed')
 
-    for entry in query:
-        try:
-            media_entry, manager = get_entry_and_processing_manager(entry.id)
+    def make_request(processor_class):
+        reprocess_parser = processor_class.generate_parser()
 
-            # TODO: (maybe?) This could probably be handled entirely by the
-            # processor class...
-            try:
-                processor_class = manager.get_processor(
-                    'resize', media_entry)
-            except ProcessorDoesNotExist:
-                print('No such processor "%s" for media with id "%s"' % (
-                    'resize', media_entry.id))
-                return
-            except ProcessorNotEligible:
-                print('Processor "%s" exists but media "%s" is not eligible' % (
-                    'resize', media_entry.id))
-                return
-
-            reprocess_parser = processor_class.generate_parser()
-
-            # prepare filetype and size to be passed into reprocess_parser
-            if args.size:
-                extra_args = 'thumb --{0} {1} {2}'.format(
-                    processor_class.thumb_size,
-                    args.size[0],
-                    args.size[1])
-            else:
-                extra_args = 'thumb'
+        # prepare filetype and size to be passed into reprocess_parser
+        if args.size:
+            extra_args = 'thumb --{0} {1} {2}'.format(
+                processor_class.thumb_size,
+                args.size[0],
+                args.size[1])
+        else:
+            extra_args = 'thumb'
 
-            reprocess_args = reprocess_parser.parse_args(extra_args.split())
-            reprocess_request = processor_class.args_to_request(reprocess_args)
-            run_process_media(
-                media_entry,
-                reprocess_action='resize',
-                reprocess_info=reprocess_request)
+        reprocess_args = reprocess_parser.parse_args(extra_args.split())
+        return processor_class.args_to_request(reprocess_args)
 
-        except ProcessingManagerDoesNotExist:
-            print('No such processing manager for {0}'.format(entry.media_type))
+    bulk_reprocess(args, query, 'resize', make_request)
 
 
 def initial(args):
@@ -272,14 +432,7 @@ def initial(args):
     """
     query = MediaEntry.query.filter_by(state='failed')
 
-    for entry in query:
-        try:
-            media_entry, manager = get_entry_and_processing_manager(entry.id)
-            run_process_media(
-                media_entry,
-                reprocess_action='initial')
-        except ProcessingManagerDoesNotExist:
-            print('No such processing manager for {0}'.format(entry.media_type))
+    bulk_reprocess(args, query, 'initial')
 
 
 def reprocess(args):
@@ -0,0 +1,77 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import cProfile
+import pstats
+import sys
+import time
+
+from mediagoblin.gmg_commands import util as commands_util
+from mediagoblin.tools import template
+from mediagoblin.tools.routing import import_controllers
+
+
+def parser_setup(subparser):
+    subparser.description = """\
+Start up the application like a server would and report the time spent
+in each phase of the startup.  Controller imports and template warmup
+are measured too, even when they're not configured to happen on
+startup."""
+    subparser.add_argument(
+        '--functions', type=int, default=0, metavar='N',
+        help="Also list the N functions taking the most time")
+
+
+def startupprofile(args):
+    profile = cProfile.Profile() if args.functions else None
+    if profile:
+        profile.enable()
+
+    start = time.time()
+    app = commands_util.setup_app(args)
+    timings = list(app.startup_timings)
+
+    if not app.app_config['eager_imports']:
+        phase_start = time.time()
+        import_controllers(app.url_map)
+        timings.append(('controller imports (not on startup)',
+                        time.time() - phase_start))
+
+    if not app.global_config.get('jinja2', {}).get('warmup_locales'):
+        phase_start = time.time()
+        template.warmup_templates(
+            app, app.template_loader, template.DEFAULT_WARMUP_LOCALES)
+        timings.append(('template warmup (not on startup)',
+                        time.time() - phase_start))
+
+    total = time.time() - start
+    if profile:
+        profile.disable()
+
+    width = max(len(phase) for phase, seconds in timings)
+    for phase, seconds in timings:
+        print('{0:<{width}}  {1:8.3f}s'.format(phase, seconds, width=width))
+    print('{0:<{width}}  {1:8.3f}s'.format(
+        'other', total - sum(seconds for phase, seconds in timings),
+        width=width))
+    print('{0:<{width}}  {1:8.3f}s'.format('total', total, width=width))
+
+    if profile:
+        print()
+        stats = pstats.Stats(profile, stream=sys.stdout)
+        stats.sort_stats('cumulative').print_stats(args.functions)
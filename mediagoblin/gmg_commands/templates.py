@@ -0,0 +1,52 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import sys
+
+from mediagoblin.gmg_commands import util as commands_util
+from mediagoblin.tools import template
+
+
+def parser_setup(subparser):
+    subparser.description = """\
+Compile all core, theme and plugin templates.  With a bytecode_cache set
+in the [jinja2] section, the compiled templates are stored there for the
+server processes to use."""
+    subparser.add_argument(
+        '--locale', action='append', dest='locales',
+        help='Locale to set up the templates for (default: en_US), '
+             'may be given more than once')
+
+
+def warmuptemplates(args):
+    app = commands_util.setup_app(args)
+
+    jinja2_config = app.global_config.get('jinja2', {})
+    if template.get_bytecode_cache(jinja2_config) is None:
+        print('No bytecode_cache is configured, the compiled templates '
+              'will not be kept.')
+
+    failed = template.warmup_templates(
+        app, app.template_loader, args.locales or template.DEFAULT_WARMUP_LOCALES)
+    timings = template.TEMPLATE_TIMINGS
+    print('Compiled {0} templates in {1:.2f}s.'.format(
+        timings.compiled, timings.compile_time))
+
+    if failed:
+        print('{0} templates failed to compile.'.format(failed))
+        sys.exit(1)
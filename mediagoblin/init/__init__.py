@@ -27,6 +27,7 @@ from mediagoblin.db.open import setup_connection_and_db_from_config, \
 from mediagoblin.tools.pluginapi import hook_runall
 from mediagoblin.tools.workbench import WorkbenchManager
 from mediagoblin.storage import storage_system_from_config
+from mediagoblin.tools.fragment_cache import fragment_cache_from_config
 
 from mediagoblin.tools.transition import DISABLE_GLOBALS
 
@@ -153,6 +154,16 @@ def setup_storage():
     return public_store, queue_store
 
 
+def setup_fragment_cache():
+    return fragment_cache_from_config(
+        mg_globals.global_config.get('fragment_cache', {}))
+
+
+def setup_feed_cache():
+    return fragment_cache_from_config(
+        mg_globals.global_config.get('feed_cache', {}))
+
+
 def setup_workbench():
     app_config = mg_globals.app_config
 
@@ -16,10 +16,11 @@
 
 from mediagoblin import mg_globals
 from mediagoblin.db.models import MediaEntry
-from mediagoblin.db.util import media_entries_for_tag_slug
-from mediagoblin.tools.pagination import Pagination
+from mediagoblin.db.util import media_entries_for_tag_slug, newest_and_count
+from mediagoblin.tools.pagination import KeysetPagination
 from mediagoblin.tools.response import render_to_response
-from mediagoblin.decorators import uses_pagination
+from mediagoblin.decorators import uses_keyset_pagination, conditional_get
+from mediagoblin.tools.feed_cache import cached_feed
 
 from werkzeug.contrib.atom import AtomFeed
 
@@ -40,16 +41,17 @@ def _get_tag_name_from_entries(media_entries, tag_slug):
     return tag_name
 
 
-@uses_pagination
-def tag_listing(request, page):
+@uses_keyset_pagination
+def tag_listing(request, marker, direction):
     """'Gallery'/listing for this tag slug"""
     tag_slug = request.matchdict[u'tag']
 
     cursor = media_entries_for_tag_slug(request.db, tag_slug)
-    cursor = cursor.order_by(MediaEntry.created.desc())
 
-    pagination = Pagination(page, cursor)
-    media_entries = pagination()
+    pagination = KeysetPagination(
+        cursor, MediaEntry, marker, direction,
+        count_cache_key=(u'tag', tag_slug))
+    media_entries = MediaEntry.load_gallery_data(pagination())
 
     tag_name = _get_tag_name_from_entries(media_entries, tag_slug)
 
@@ -65,19 +67,33 @@ def tag_listing(request, page):
 ATOM_DEFAULT_NR_OF_UPDATED_ITEMS = 15
 
 
+def _feed_entries(request):
+    tag_slug = request.matchdict.get(u'tag')
+    if tag_slug:
+        return media_entries_for_tag_slug(request.db, tag_slug)
+    return MediaEntry.query.filter_by(state=u'processed')
+
+
+def atom_feed_validators(request):
+    newest, count = newest_and_count(
+        _feed_entries(request), MediaEntry.created, MediaEntry.updated)
+    return newest, (request.matchdict.get(u'tag'), count)
+
+
+@conditional_get(atom_feed_validators)
+@cached_feed(atom_feed_validators)
 def atom_feed(request):
     """
     generates the atom feed with the tag images
     """
     tag_slug = request.matchdict.get(u'tag')
     feed_title = "MediaGoblin Feed"
+    cursor = _feed_entries(request)
     if tag_slug:
-        cursor = media_entries_for_tag_slug(request.db, tag_slug)
         link = request.urlgen('mediagoblin.listings.tags_listing',
                               qualified=True, tag=tag_slug )
         feed_title += "for tag '%s'" % tag_slug
     else: # all recent item feed
-        cursor = MediaEntry.query.filter_by(state=u'processed')
         link = request.urlgen('index', qualified=True)
         feed_title += "for all recent items"
 
@@ -101,7 +117,7 @@ def atom_feed(request):
         id=link,
         links=atomlinks)
 
-    for entry in cursor:
+    for entry in MediaEntry.load_gallery_data(cursor):
         feed.add(entry.get('title'),
             entry.description_html,
             id=entry.url_for_self(request.urlgen,qualified=True),
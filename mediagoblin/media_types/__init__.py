@@ -14,11 +14,17 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import io
 import os
 import logging
 import shutil
 import tempfile
+from contextlib import contextmanager
 
+import six
+from werkzeug.datastructures import FileStorage
+
+from mediagoblin.media_types.tools import PROBE_CACHE
 from mediagoblin.tools.pluginapi import hook_handle
 from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
 
@@ -141,12 +147,61 @@ def sniff_media(media_file, filename):
     Iterate through the enabled media types and find those suited
     for a certain file.
     '''
-    # copy the contents to a .name-enabled temporary file for further checks
-    # TODO: there are cases when copying is not required
-    tmp_media_file = tempfile.NamedTemporaryFile()
-    shutil.copyfileobj(media_file, tmp_media_file)
-    media_file.seek(0)
-    tmp_media_file.seek(0)
+    with local_media_file(media_file) as local_file:
+        media_type, media_manager, probe = sniff_media_and_probe(
+            local_file, filename)
+    return media_type, media_manager
+
+
+def local_file_path(media_file):
+    '''
+    Return the path of the file on disk media_file reads, or None if it
+    is only a stream.
+    '''
+    if isinstance(media_file, FileStorage):
+        # Its name is the name of the form field
+        media_file = media_file.stream
+    path = getattr(media_file, 'name', None)
+    if isinstance(path, six.string_types) and os.path.isfile(path):
+        return path
+    return None
+
+
+@contextmanager
+def local_media_file(media_file):
+    '''
+    Give a file with the contents of media_file and a .name on disk, as
+    sniffers (and GStreamer) need one.
+
+    Files already on disk are opened again rather than copied, only
+    streams get spooled to a temporary file (removed afterwards).
+    Either way the result can be read from the start, independent of
+    media_file.
+    '''
+    path = local_file_path(media_file)
+    if path is not None:
+        local_file = io.open(path, 'rb')
+    else:
+        local_file = tempfile.NamedTemporaryFile()
+        shutil.copyfileobj(media_file, local_file)
+        local_file.seek(0)
+    with local_file:
+        yield local_file
+
+
+def sniff_media_and_probe(local_file, filename):
+    '''
+    Like sniff_media, but for a file with a .name on disk (see
+    local_media_file).  Also returns the serialised discover() result of
+    the file if the sniffers discovered it (or None), to pass on to the
+    processing (see ProbeCache).
+    '''
+    media_type, media_manager = _sniff_media(local_file, filename)
+    local_file.seek(0)
+    return media_type, media_manager, PROBE_CACHE.dumps(local_file.name)
+
+
+def _sniff_media(tmp_media_file, filename):
     try:
         return type_match_handler(tmp_media_file, filename)
     except TypeNotFound as e:
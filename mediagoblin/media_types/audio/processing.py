@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import functools
 import logging
 import os
 
@@ -25,7 +26,7 @@ from mediagoblin.processing import (
     BadMediaFail, FilenameBuilder,
     ProgressCallback, MediaProcessor, ProcessingManager,
     request_from_args, get_process_filename,
-    store_public, copy_original)
+    store_public)
 
 from mediagoblin.media_types.audio.transcoders import (
     AudioTranscoder, AudioThumbnailer)
@@ -70,11 +71,15 @@ class CommonAudioProcessor(MediaProcessor):
         self.transcoder = AudioTranscoder()
         self.thumbnailer = AudioThumbnailer()
 
+    def copy_original_step(self):
+        if not self.audio_config['keep_original']:
+            return None
+        return functools.partial(
+            self.store_public, u'original', self.process_filename,
+            self.name_builder.fill('{basename}{ext}'))
+
     def copy_original(self):
-        if self.audio_config['keep_original']:
-            copy_original(
-                self.entry, self.process_filename,
-                self.name_builder.fill('{basename}{ext}'))
+        self.run_steps(self.copy_original_step())
 
     def _keep_best(self):
         """
@@ -254,8 +259,12 @@ class InitialProcessor(CommonAudioProcessor):
                 medium_width=None):
         self.common_setup()
 
-        self.transcode(quality=quality)
-        self.copy_original()
+        # Both the transcoding and the spectrogram run a GLib main loop,
+        # which can't happen in two threads at once, so only copying the
+        # original goes along with them.
+        self.run_steps(
+            functools.partial(self.transcode, quality=quality),
+            self.copy_original_step())
 
         self.create_spectrogram(max_width=medium_width, fft_size=fft_size)
         self.generate_thumb(size=thumb_size)
@@ -34,6 +34,14 @@ except ImportError:
     print("WARNING: audiolab is not installed so wav2png will not work")
 
 
+# Number of floats (columns * fft_size) processed per batch by the
+# vectorized renderer, which bounds its memory use
+SPECTROGRAM_BATCH_SIZE = 2 ** 22
+
+# Number of samples read at once when streaming through a whole file
+STREAM_BLOCK_SIZE = 2 ** 16
+
+
 class AudioProcessingException(Exception):
     pass
 
@@ -54,6 +62,10 @@ class SpectrogramImage(object):
          ]
 
         self.palette = interpolate_colors(colors)
+        # The same palette as an RGBA lookup table for numpy indexing
+        self.palette_array = numpy.empty((len(self.palette), 4), numpy.uint8)
+        self.palette_array[:, :3] = numpy.clip(self.palette, 0, 255)
+        self.palette_array[:, 3] = 255
 
         # Generate lookup table for y-coordinate from fft-bin
         self.y_to_bin = []
@@ -77,28 +89,39 @@ class SpectrogramImage(object):
 
                 self.y_to_bin.append((int(fft_bin), alpha * 255))
 
+        self.bins = numpy.array([index for index, alpha in self.y_to_bin],
+                                numpy.intp)
+        self.alphas = numpy.array([alpha for index, alpha in self.y_to_bin],
+                                  numpy.float64)
+
         # this is a bit strange, but using image.load()[x,y] = ... is
-        # a lot slower than using image.putadata and then rotating the image
-        # so we store all the pixels in an array and then create the image when saving
-        self.pixels = []
+        # a lot slower than building the image from a buffer and then
+        # rotating it, so we store one row of pixels per column, starting
+        # out filled with palette[0] (black) for the bins the FFT can't fill.
+        self.pixels = numpy.empty(
+                (self.image_width, self.image_height, 4), numpy.uint8)
+        self.pixels[:] = self.palette_array[0]
+
+    def draw_spectra(self, x, spectra):
+        """
+        Draw the columns starting at x from a 2-D array holding one db
+        spectrum per row
+        """
+        # for all frequencies, look up the palette index of the pixels
+        indices = ((255.0 - self.alphas) * spectra[:, self.bins]
+                   + self.alphas * spectra[:, self.bins + 1])
+        self.pixels[x:x + len(spectra), :len(self.bins)] = \
+                self.palette_array[indices.astype(numpy.intp)]
 
     def draw_spectrum(self, x, spectrum):
-        # for all frequencies, draw the pixels
-        for index, alpha in self.y_to_bin:
-            self.pixels.append(
-                    self.palette[int((255.0 - alpha) * spectrum[index]
-                        + alpha * spectrum[index + 1])])
-
-        # if the FFT is too small to fill up the image, fill with black to the top
-        for y in range(len(self.y_to_bin), self.image_height):
-            self.pixels.append(self.palette[0])
+        self.draw_spectra(x, numpy.asarray(spectrum)[numpy.newaxis])
 
     def save(self, filename, quality=90):
-        self.image = Image.new(
+        self.image = Image.frombuffer(
                 'RGBA',
-                (self.image_height, self.image_width))
+                (self.image_height, self.image_width),
+                self.pixels.tobytes(), 'raw', 'RGBA', 0, 1)
 
-        self.image.putdata(self.pixels)
         self.image.transpose(Image.ROTATE_90).save(
                 filename,
                 quality=quality)
@@ -109,8 +132,16 @@ class AudioProcessor(object):
     The audio processor processes chunks of audio an calculates the spectrac centroid and the peak
     samples in that chunk of audio.
     """
-    def __init__(self, input_filename, fft_size, window_function=numpy.hanning):
-        max_level = get_max_level(input_filename)
+    def __init__(self, input_filename, fft_size, window_function=numpy.hanning,
+                 max_level=None, find_max_level=True):
+        """
+        If max_level is not given it is found by reading through the whole
+        file first, unless find_max_level is False.  In that case the
+        spectra have to be read through stream_db_spectra(), which finds
+        the max level in the same pass.
+        """
+        if max_level is None and find_max_level:
+            max_level = get_max_level(input_filename)
 
         self.audio_file = audiolab.Sndfile(input_filename, 'r')
         self.fft_size = fft_size
@@ -124,10 +155,17 @@ class AudioProcessor(object):
 
         # figure out what the maximum value is for an FFT doing the FFT of a DC signal
         fft = numpy.fft.rfft(numpy.ones(fft_size) * self.window)
-        max_fft = (numpy.abs(fft)).max()
+        self.max_fft = (numpy.abs(fft)).max()
+
+        self.max_level = None
+        self.scale = None
+        if max_level is not None:
+            self.set_max_level(max_level)
 
+    def set_max_level(self, max_level):
+        self.max_level = max_level
         # set the scale to normalized audio and normalized FFT
-        self.scale = 1.0 / max_level / max_fft if max_level > 0 else 1
+        self.scale = 1.0 / max_level / self.max_fft if max_level > 0 else 1
 
     def read(self, start, size, resize_if_less=False):
         """ read size samples starting at start, if resize_if_less is True and less than size
@@ -170,7 +208,7 @@ class AudioProcessor(object):
 
         if resize_if_less and (add_to_start > 0 or add_to_end > 0):
             if add_to_start > 0:
-                samples = numpy.concatenate((numpy.zeros(add_to_start), samples), axis=1)
+                samples = numpy.concatenate((numpy.zeros(add_to_start), samples))
 
             if add_to_end > 0:
                 samples = numpy.resize(samples, size)
@@ -181,7 +219,7 @@ class AudioProcessor(object):
     def spectral_centroid(self, seek_point, spec_range=110.0):
         """ starting at seek_point read fft_size samples, and calculate the spectral centroid """
 
-        samples = self.read(seek_point - self.fft_size/2, self.fft_size, True)
+        samples = self.read(seek_point - self.fft_size // 2, self.fft_size, True)
 
         samples *= self.window
         fft = numpy.fft.rfft(samples)
@@ -198,7 +236,7 @@ class AudioProcessor(object):
         if energy > 1e-60:
             # calculate the spectral centroid
 
-            if self.spectrum_range == None:
+            if self.spectrum_range is None:
                 self.spectrum_range = numpy.arange(length)
 
             spectral_centroid = (spectrum * self.spectrum_range).sum() / (energy * (length - 1)) * self.audio_file.samplerate * 0.5
@@ -209,6 +247,112 @@ class AudioProcessor(object):
         return (spectral_centroid, db_spectrum)
 
 
+    def db_spectra(self, seek_points, spec_range=110.0):
+        """
+        Like spectral_centroid(), but calculate the db spectra for all of
+        seek_points at once and return them as rows of a 2-D array.
+        """
+        half = self.fft_size // 2
+        seek_points = numpy.asarray(seek_points, numpy.intp)
+
+        if len(seek_points) > 1 and \
+                numpy.diff(seek_points).max() <= self.fft_size:
+            # The windows overlap or touch, so read them all as one block
+            # and cut the frames out of that
+            start = seek_points[0] - half
+            block = self.read(
+                start, seek_points[-1] - start + half, True)
+            frames = block[(seek_points - seek_points[0])[:, numpy.newaxis]
+                           + numpy.arange(self.fft_size)]
+        else:
+            # The windows are far apart, don't read what's in between
+            frames = numpy.empty((len(seek_points), self.fft_size))
+            for i, seek_point in enumerate(seek_points):
+                frames[i] = self.read(seek_point - half, self.fft_size, True)
+
+        frames *= self.window
+        spectra = self.scale * numpy.abs(numpy.fft.rfft(frames, axis=1))
+
+        # scale the db spectrum from [- spec_range db ... 0 db] > [0..1]
+        return ((20 * (numpy.log10(spectra + 1e-60))).clip(-spec_range, 0.0)
+                + spec_range) / spec_range
+
+    def stream_db_spectra(self, seek_points, spec_range=110.0,
+                          progress_callback=None):
+        """
+        Calculate the db spectra for all of seek_points, like db_spectra(),
+        in a single sequential pass through the file that also finds the
+        max level, so the file is decoded only once.
+        """
+        half = self.fft_size // 2
+        seek_points = numpy.asarray(seek_points, numpy.intp)
+        spectra = numpy.empty((len(seek_points), half + 1))
+        nframes = self.audio_file.nframes
+
+        # buffer holds the signal starting at buffer_start, where the
+        # signal is padded with half a window of zeros at the beginning so
+        # window i starts at seek_points[i]
+        buffer = numpy.zeros(half)
+        buffer_start = 0
+        max_level = 0
+        read = 0
+        i = 0
+
+        self.audio_file.seek(0)
+        while i < len(seek_points):
+            to_read = min(STREAM_BLOCK_SIZE, nframes - read)
+            samples = None
+            if to_read > 0:
+                try:
+                    samples = self.audio_file.read_frames(to_read)
+                except RuntimeError:
+                    # this can happen with a broken header
+                    pass
+
+            if samples is None:
+                # Out of samples, pad the remaining windows with zeros
+                read = nframes
+                samples = numpy.zeros(self.fft_size)
+            else:
+                read += to_read
+                # convert to mono by selecting left channel only
+                if self.audio_file.channels > 1:
+                    samples = samples[:,0]
+                if len(samples):
+                    max_level = max(max_level, numpy.abs(samples).max())
+
+            buffer = numpy.concatenate((buffer, samples))
+
+            # Cut out all windows that are complete by now
+            end = buffer_start + len(buffer)
+            first = i
+            while i < len(seek_points) and \
+                    seek_points[i] + self.fft_size <= end:
+                i += 1
+
+            if i > first:
+                offsets = seek_points[first:i] - buffer_start
+                frames = buffer[offsets[:, numpy.newaxis]
+                                + numpy.arange(self.fft_size)]
+                frames *= self.window
+                spectra[first:i] = numpy.abs(numpy.fft.rfft(frames, axis=1))
+
+                if progress_callback:
+                    progress_callback((i * 100) / len(seek_points))
+
+            # Forget everything before the next window
+            if i < len(seek_points):
+                drop = min(seek_points[i] - buffer_start, len(buffer))
+                buffer = buffer[drop:]
+                buffer_start += drop
+
+        self.set_max_level(max_level)
+        spectra = self.scale * spectra
+
+        # scale the db spectrum from [- spec_range db ... 0 db] > [0..1]
+        return ((20 * (numpy.log10(spectra + 1e-60))).clip(-spec_range, 0.0)
+                + spec_range) / spec_range
+
     def peaks(self, start_seek, end_seek):
         """ read all samples between start_seek and end_seek, then find the minimum and maximum peak
         in that range. Returns that pair in the order they were found. So if min was found first,
@@ -257,13 +401,36 @@ class AudioProcessor(object):
 
 
 def create_spectrogram_image(source_filename, output_filename,
-        image_size, fft_size, progress_callback=None):
+        image_size, fft_size, progress_callback=None, vectorized=True,
+        max_level=None):
+    """
+    Render the spectrogram of source_filename to output_filename.
+
+    Unless the max level of the audio is passed in, the vectorized
+    renderer finds it while reading the spectra, decoding the file once.
+    """
+    spectrogram = SpectrogramImage(image_size, fft_size)
+
+    if vectorized:
+        processor = AudioProcessor(source_filename, fft_size, numpy.hamming,
+                                   max_level, find_max_level=False)
+        samples_per_pixel = processor.audio_file.nframes / float(image_size[0])
+
+        if max_level is None:
+            seek_points = (numpy.arange(image_size[0])
+                           * samples_per_pixel).astype(numpy.intp)
+            spectrogram.draw_spectra(0, processor.stream_db_spectra(
+                seek_points, progress_callback=progress_callback))
+        else:
+            _draw_spectrogram_batched(processor, spectrogram,
+                                      samples_per_pixel, image_size[0],
+                                      progress_callback)
+        spectrogram.save(output_filename)
+        return processor.max_level
 
     processor = AudioProcessor(source_filename, fft_size, numpy.hamming)
     samples_per_pixel = processor.audio_file.nframes / float(image_size[0])
 
-    spectrogram = SpectrogramImage(image_size, fft_size)
-
     for x in range(image_size[0]):
         if progress_callback and x % (image_size[0] / 10) == 0:
             progress_callback((x * 100) / image_size[0])
@@ -279,6 +446,27 @@ def create_spectrogram_image(source_filename, output_filename,
         progress_callback(100)
 
     spectrogram.save(output_filename)
+    return processor.max_level
+
+
+def _draw_spectrogram_batched(processor, spectrogram, samples_per_pixel,
+                              width, progress_callback=None):
+    """
+    Draw all columns of spectrogram, calculating the spectra of as many
+    columns at once as fit into SPECTROGRAM_BATCH_SIZE.
+    """
+    seek_points = (numpy.arange(width) * samples_per_pixel).astype(numpy.intp)
+    batch = max(1, SPECTROGRAM_BATCH_SIZE // processor.fft_size)
+
+    for x in range(0, width, batch):
+        if progress_callback:
+            progress_callback((x * 100) / width)
+
+        spectra = processor.db_spectra(seek_points[x:x + batch])
+        spectrogram.draw_spectra(x, spectra)
+
+    if progress_callback:
+        progress_callback(100)
 
 
 def interpolate_colors(colors, flat=False, num_colors=256):
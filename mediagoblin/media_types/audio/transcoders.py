@@ -20,7 +20,8 @@ try:
 except ImportError:
     import Image
 
-from mediagoblin.media_types.audio import audioprocessing
+from mediagoblin.media_types.audio.spectrogram import (AudioProcessor,
+    SpectrogramImage)
 
 _log = logging.getLogger(__name__)
 
@@ -57,30 +58,23 @@ class AudioThumbnailer(object):
         height = int(kw.get('height', float(width) * 0.3))
         fft_size = kw.get('fft_size', 2048)
         callback = kw.get('progress_callback')
-        processor = audioprocessing.AudioProcessor(
+        # Find the max level while reading the spectra, so the file is
+        # only decoded once
+        processor = AudioProcessor(
             src,
             fft_size,
-            numpy.hanning)
+            numpy.hanning,
+            find_max_level=False)
 
         samples_per_pixel = processor.audio_file.nframes / float(width)
+        seek_points = (numpy.arange(width) * samples_per_pixel).astype(int)
 
-        spectrogram = audioprocessing.SpectrogramImage(width, height, fft_size)
+        db_spectra = processor.stream_db_spectra(
+            seek_points, progress_callback=callback)
 
-        for x in range(width):
-            if callback and x % (width / 10) == 0:
-                callback((x * 100) / width)
-
-            seek_point = int(x * samples_per_pixel)
-
-            (spectral_centroid, db_spectrum) = processor.spectral_centroid(
-                seek_point)
-
-            spectrogram.draw_spectrum(x, db_spectrum)
-
-        if callback:
-            callback(100)
-
-        spectrogram.save(dst)
+        spectrogram = SpectrogramImage((width, height), fft_size)
+        spectrogram.draw_spectra(0, db_spectra)
+        spectrogram.save(dst, quality=80)
 
     def thumbnail_spectrogram(self, src, dst, thumb_size):
         '''
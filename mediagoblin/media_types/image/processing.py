@@ -23,6 +23,7 @@ except ImportError:
 import os
 import logging
 import argparse
+import functools
 
 import six
 
@@ -32,7 +33,7 @@ from mediagoblin.processing import (
     BadMediaFail, FilenameBuilder,
     MediaProcessor, ProcessingManager,
     request_from_args, get_process_filename,
-    store_public, copy_original)
+    store_public, serial_steps)
 from mediagoblin.tools.exif import exif_fix_image_orientation, \
     extract_exif, clean_exif, get_gps_data, get_useful, \
     exif_image_needs_rotation
@@ -66,38 +67,72 @@ def resize_image(entry, resized, keyname, target_name, new_size,
     """
     resized = exif_fix_image_orientation(resized, exif_tags)  # Fix orientation
 
-    try:
-        resize_filter = PIL_FILTERS[filter.upper()]
-    except KeyError:
-        raise Exception('Filter "{0}" not found, choose one of {1}'.format(
-            six.text_type(filter),
-            u', '.join(PIL_FILTERS.keys())))
+    resized.thumbnail(new_size, _get_resize_filter(filter))
 
-    resized.thumbnail(new_size, resize_filter)
+    store_resized_image(entry, resized, keyname, target_name, new_size,
+                        workdir, quality, filter)
 
-    # Copy the new file to the conversion subdir, then remotely.
+
+def save_resized_image(resized, target_name, workdir, quality):
+    """
+    Save an already resized image as target_name in workdir and return
+    its path.
+    """
     tmp_resized_filename = os.path.join(workdir, target_name)
     with open(tmp_resized_filename, 'wb') as resized_file:
         resized.save(resized_file, quality=quality)
+    return tmp_resized_filename
+
+
+def resized_image_info(new_size, quality, filter):
+    """The file metadata of a resized image"""
+    return {'width': new_size[0],
+            'height': new_size[1],
+            'quality': quality,
+            'filter': filter}
+
+
+def store_resized_image(entry, resized, keyname, target_name, new_size,
+                        workdir, quality, filter):
+    """
+    Save an already resized image to the public store under keyname and
+    record its size, quality and filter in the file metadata.
+    """
+    # Copy the new file to the conversion subdir, then remotely.
+    tmp_resized_filename = save_resized_image(
+        resized, target_name, workdir, quality)
     store_public(entry, keyname, tmp_resized_filename, target_name)
 
     # store the thumb/medium info
-    image_info = {'width': new_size[0],
-                  'height': new_size[1],
-                  'quality': quality,
-                  'filter': filter}
+    entry.set_file_metadata(
+        keyname, **resized_image_info(new_size, quality, filter))
+
+
+def _get_resize_filter(filter):
+    try:
+        return PIL_FILTERS[filter.upper()]
+    except KeyError:
+        raise Exception('Filter "{0}" not found, choose one of {1}'.format(
+            six.text_type(filter),
+            u', '.join(PIL_FILTERS.keys())))
 
-    entry.set_file_metadata(keyname, **image_info)
+
+def _get_default_size(keyname, new_size=None):
+    """
+    Return new_size, or the configured size for keyname if it's not given
+    """
+    if not new_size:
+        max_width = mgg.global_config['media:' + keyname]['max_width']
+        max_height = mgg.global_config['media:' + keyname]['max_height']
+        new_size = (max_width, max_height)
+    return tuple(new_size)
 
 
 def resize_tool(entry,
                 force, keyname, orig_file, target_name,
                 conversions_subdir, exif_tags, quality, filter, new_size=None):
     # Use the default size if new_size was not given
-    if not new_size:
-        max_width = mgg.global_config['media:' + keyname]['max_width']
-        max_height = mgg.global_config['media:' + keyname]['max_height']
-        new_size = (max_width, max_height)
+    new_size = _get_default_size(keyname, new_size)
 
     # If thumb or medium is already the same quality and size, then don't
     # reprocess
@@ -151,6 +186,103 @@ def _skip_resizing(entry, keyname, size, quality, filter):
     return skip
 
 
+def _fit_size(size, box):
+    """
+    Return the size Image.thumbnail() shrinks an image of size to, to
+    make it fit into box
+    """
+    x, y = size
+    if x > box[0]:
+        y = max(int(y * box[0] / float(x)), 1)
+        x = box[0]
+    if y > box[1]:
+        x = max(int(x * box[1] / float(y)), 1)
+        y = box[1]
+    return x, y
+
+
+class RenditionPlanner(object):
+    """
+    Decode an image once and derive all of its renditions from it.
+
+    The original is opened a single time, rotated according to its EXIF
+    orientation once, and every rendition is then produced from the
+    smallest already generated image that is still big enough.  Rendering
+    the largest rendition first thus makes the renditions cascade, e.g.
+    original -> medium -> thumb.
+
+    If prepare() is told up front which boxes are going to be rendered,
+    JPEG draft mode lets the decoder itself downscale the original, which
+    saves most of the decoding time and memory for very large photos.
+    """
+    def __init__(self, filename, exif_tags):
+        self.filename = filename
+        self.exif_tags = exif_tags
+
+        try:
+            self._image = Image.open(filename)
+        except IOError:
+            raise BadMediaFail()
+
+        # The size of the original as stored, before any rotation
+        self.original_size = self._image.size
+        self.needs_rotation = exif_image_needs_rotation(exif_tags)
+
+        self._decoded = False
+        self._sources = []
+
+    def prepare(self, boxes):
+        """
+        Let the decoder downscale the original to the smallest size which
+        still serves all boxes.  Has no effect once decoding happened.
+        """
+        if self._decoded or not boxes:
+            return
+
+        # Use a square so the result is big enough no matter how the
+        # image gets rotated afterwards
+        largest = max(max(box) for box in boxes)
+        self._image.draft(self._image.mode, (largest, largest))
+
+    def needs_resizing(self, box):
+        """
+        Whether the original is bigger than box or has to be rotated
+        """
+        return self.original_size[0] > box[0] \
+            or self.original_size[1] > box[1] \
+            or self.needs_rotation
+
+    def _get_base_image(self):
+        if not self._decoded:
+            try:
+                self._image.load()
+            except IOError:
+                raise BadMediaFail()
+            self._image = exif_fix_image_orientation(
+                self._image, self.exif_tags)
+            self._sources.append(self._image)
+            self._decoded = True
+
+        return self._image
+
+    def render(self, box, filter):
+        """
+        Return a new image fitting into box, derived from the smallest
+        image rendered so far that is at least as large as the result.
+        """
+        target = _fit_size(self._get_base_image().size, box)
+        source = min(
+            (im for im in self._sources
+             if im.size[0] >= target[0] and im.size[1] >= target[1]),
+            key=lambda im: im.size[0] * im.size[1])
+
+        # Resize to the size fitted to the base image, so rounding in
+        # earlier renditions doesn't carry over
+        resized = source.resize(target, _get_resize_filter(filter))
+        self._sources.append(resized)
+        return resized
+
+
 SUPPORTED_FILETYPES = ['png', 'gif', 'jpg', 'jpeg', 'tiff']
 
 
@@ -197,33 +329,73 @@ class CommonImageProcessor(MediaProcessor):
         # Exif extraction
         self.exif_tags = extract_exif(self.process_filename)
 
-    def generate_medium_if_applicable(self, size=None, quality=None,
-                                      filter=None):
-        if not quality:
-            quality = self.image_config['quality']
-        if not filter:
-            filter = self.image_config['resize_filter']
+        # Opened lazily, since subclasses may still swap process_filename
+        self._renditions = None
 
-        resize_tool(self.entry, False, 'medium', self.process_filename,
-                    self.name_builder.fill('{basename}.medium{ext}'),
-                    self.conversions_subdir, self.exif_tags, quality,
-                    filter, size)
+    @property
+    def renditions(self):
+        """The RenditionPlanner for the file being processed"""
+        if self._renditions is None:
+            self._renditions = RenditionPlanner(
+                self.process_filename, self.exif_tags)
+        return self._renditions
 
-    def generate_thumb(self, size=None, quality=None, filter=None):
+    def _rendition_step(self, keyname, force, target_name, size,
+                        quality, filter):
+        """
+        Return the processing step generating the keyname rendition, or
+        None if it is up to date already.
+        """
         if not quality:
             quality = self.image_config['quality']
         if not filter:
             filter = self.image_config['resize_filter']
+        size = _get_default_size(keyname, size)
+
+        # If thumb or medium is already the same quality and size, then
+        # don't reprocess
+        if _skip_resizing(self.entry, keyname, size, quality, filter):
+            _log.info('{0} of same size and quality already in use, skipping '
+                      'resizing of media {1}.'.format(keyname, self.entry.id))
+            return None
+
+        def generate():
+            # Only create the file if the original exceeds the size, needs
+            # rotation, or if forced.
+            if force or self.renditions.needs_resizing(size):
+                resized = self.renditions.render(size, filter)
+                self.store_public(
+                    six.text_type(keyname),
+                    save_resized_image(resized, target_name,
+                                       self.conversions_subdir, quality),
+                    target_name,
+                    resized_image_info(size, quality, filter))
+        return generate
+
+    def medium_step(self, size=None, quality=None, filter=None):
+        return self._rendition_step(
+            'medium', False, self.name_builder.fill('{basename}.medium{ext}'),
+            size, quality, filter)
+
+    def thumb_step(self, size=None, quality=None, filter=None):
+        return self._rendition_step(
+            'thumb', True, self.name_builder.fill('{basename}.thumbnail{ext}'),
+            size, quality, filter)
+
+    def copy_original_step(self):
+        return functools.partial(
+            self.store_public, u'original', self.process_filename,
+            self.name_builder.fill('{basename}{ext}'))
 
-        resize_tool(self.entry, True, 'thumb', self.process_filename,
-                    self.name_builder.fill('{basename}.thumbnail{ext}'),
-                    self.conversions_subdir, self.exif_tags, quality,
-                    filter, size)
+    def generate_medium_if_applicable(self, size=None, quality=None,
+                                      filter=None):
+        self.run_steps(self.medium_step(size, quality, filter))
+
+    def generate_thumb(self, size=None, quality=None, filter=None):
+        self.run_steps(self.thumb_step(size, quality, filter))
 
     def copy_original(self):
-        copy_original(
-            self.entry, self.process_filename,
-            self.name_builder.fill('{basename}{ext}'))
+        self.run_steps(self.copy_original_step())
 
     def extract_metadata(self, file):
         """ Extract all the metadata from the image and store """
@@ -239,15 +411,11 @@ class CommonImageProcessor(MediaProcessor):
         if len(exif_all):
             self.entry.media_data_init(exif_all=exif_all)
 
-        # Extract file metadata
-        try:
-            im = Image.open(self.process_filename)
-        except IOError:
-            raise BadMediaFail()
-
+        # Extract file metadata, the header has been read already
+        width, height = self.renditions.original_size
         metadata = {
-            "width": im.size[0],
-            "height": im.size[1],
+            "width": width,
+            "height": height,
         }
 
         self.entry.set_file_metadata(file, **metadata)
@@ -313,10 +481,17 @@ class InitialProcessor(CommonImageProcessor):
 
     def process(self, size=None, thumb_size=None, quality=None, filter=None):
         self.common_setup()
-        self.generate_medium_if_applicable(size=size, filter=filter,
-                                           quality=quality)
-        self.generate_thumb(size=thumb_size, filter=filter, quality=quality)
-        self.copy_original()
+        # Decode just big enough for the largest rendition we're producing
+        self.renditions.prepare([_get_default_size('medium', size),
+                                 _get_default_size('thumb', thumb_size)])
+        # The thumbnail is made from the medium sized image, but copying
+        # the original can happen meanwhile
+        self.run_steps(
+            serial_steps(
+                self.medium_step(size=size, filter=filter, quality=quality),
+                self.thumb_step(size=thumb_size, filter=filter,
+                                quality=quality)),
+            self.copy_original_step())
         self.extract_metadata('original')
         self.delete_queue_file()
 
@@ -379,6 +554,7 @@ class Resizer(CommonImageProcessor):
 
     def process(self, file, size=None, filter=None, quality=None):
         self.common_setup()
+        self.renditions.prepare([_get_default_size(file, size)])
         if file == 'medium':
             self.generate_medium_if_applicable(size=size, filter=filter,
                                               quality=quality)
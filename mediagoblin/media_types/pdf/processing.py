@@ -16,6 +16,7 @@
 import argparse
 import os
 import logging
+import functools
 import dateutil.parser
 from subprocess import PIPE, Popen
 
@@ -24,7 +25,7 @@ from mediagoblin.processing import (
     FilenameBuilder, BadMediaFail,
     MediaProcessor, ProcessingManager,
     request_from_args, get_process_filename,
-    store_public, copy_original)
+    store_public)
 from mediagoblin.tools.translate import fake_ugettext_passthrough as _
 
 _log = logging.getLogger(__name__)
@@ -281,37 +282,53 @@ class CommonPdfProcessor(MediaProcessor):
 
         return skip
 
-    def copy_original(self):
-        copy_original(
-            self.entry, self.process_filename,
+    def copy_original_step(self):
+        return functools.partial(
+            self.store_public, u'original', self.process_filename,
             self.name_builder.fill('{basename}{ext}'))
 
-    def generate_thumb(self, thumb_size=None):
+    def copy_original(self):
+        self.run_steps(self.copy_original_step())
+
+    def _render_step(self, keyname, name, size, file_metadata):
+        """
+        Return the processing step rendering the first page to fit into
+        size as the keyname file {basename}.<name>.png
+        """
+        # Note: pdftocairo adds '.png', so don't include an ext
+        filename = os.path.join(self.workbench.dir,
+                                self.name_builder.fill(
+                                    '{basename}.' + name))
+
+        def render():
+            executable = where('pdftocairo')
+            args = [executable, '-scale-to', str(min(size)),
+                    '-singlefile', '-png', self.pdf_filename, filename]
+
+            _log.debug('calling {0}'.format(repr(' '.join(args))))
+            Popen(executable=executable, args=args).wait()
+
+            # since pdftocairo added '.png', we need to include it with the
+            # filename
+            self.store_public(
+                keyname, filename + '.png',
+                self.name_builder.fill('{basename}.' + name + '.png'),
+                file_metadata)
+        return render
+
+    def thumb_step(self, thumb_size=None):
         if not thumb_size:
             thumb_size = (mgg.global_config['media:thumb']['max_width'],
                           mgg.global_config['media:thumb']['max_height'])
 
         if self._skip_processing('thumb', thumb_size=thumb_size):
-            return
-
-        # Note: pdftocairo adds '.png', so don't include an ext
-        thumb_filename = os.path.join(self.workbench.dir,
-                                      self.name_builder.fill(
-                                          '{basename}.thumbnail'))
+            return None
 
-        executable = where('pdftocairo')
-        args = [executable, '-scale-to', str(min(thumb_size)),
-                '-singlefile', '-png', self.pdf_filename, thumb_filename]
+        return self._render_step(
+            'thumb', 'thumbnail', thumb_size, {'thumb_size': thumb_size})
 
-        _log.debug('calling {0}'.format(repr(' '.join(args))))
-        Popen(executable=executable, args=args).wait()
-
-        # since pdftocairo added '.png', we need to include it with the
-        # filename
-        store_public(self.entry, 'thumb', thumb_filename + '.png',
-                     self.name_builder.fill('{basename}.thumbnail.png'))
-
-        self.entry.set_file_metadata('thumb', thumb_size=thumb_size)
+    def generate_thumb(self, thumb_size=None):
+        self.run_steps(self.thumb_step(thumb_size))
 
     def _generate_pdf(self):
         """
@@ -339,31 +356,18 @@ class CommonPdfProcessor(MediaProcessor):
         pdf_info_dict = pdf_info(self.pdf_filename)
         self.entry.media_data_init(**pdf_info_dict)
 
-    def generate_medium(self, size=None):
+    def medium_step(self, size=None):
         if not size:
             size = (mgg.global_config['media:medium']['max_width'],
                     mgg.global_config['media:medium']['max_height'])
 
         if self._skip_processing('medium', size=size):
-            return
-
-        # Note: pdftocairo adds '.png', so don't include an ext
-        filename = os.path.join(self.workbench.dir,
-                                self.name_builder.fill('{basename}.medium'))
-
-        executable = where('pdftocairo')
-        args = [executable, '-scale-to', str(min(size)),
-                '-singlefile', '-png', self.pdf_filename, filename]
+            return None
 
-        _log.debug('calling {0}'.format(repr(' '.join(args))))
-        Popen(executable=executable, args=args).wait()
+        return self._render_step('medium', 'medium', size, {'size': size})
 
-        # since pdftocairo added '.png', we need to include it with the
-        # filename
-        store_public(self.entry, 'medium', filename + '.png',
-                     self.name_builder.fill('{basename}.medium.png'))
-
-        self.entry.set_file_metadata('medium', size=size)
+    def generate_medium(self, size=None):
+        self.run_steps(self.medium_step(size))
 
 
 class InitialProcessor(CommonPdfProcessor):
@@ -411,9 +415,10 @@ class InitialProcessor(CommonPdfProcessor):
     def process(self, size=None, thumb_size=None):
         self.common_setup()
         self.extract_pdf_info()
-        self.copy_original()
-        self.generate_medium(size=size)
-        self.generate_thumb(thumb_size=thumb_size)
+        self.run_steps(
+            self.medium_step(size=size),
+            self.thumb_step(thumb_size=thumb_size),
+            self.copy_original_step())
         self.delete_queue_file()
 
 
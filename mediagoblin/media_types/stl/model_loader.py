@@ -15,7 +15,17 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import struct
+import numpy
+
+
+# Number of triangles (binary) or lines (text) handled per chunk
+CHUNK_SIZE = 2 ** 16
+
+# Layout of a single triangle record in a binary stl file
+STL_TRIANGLE = numpy.dtype([
+    ('normal', '<f4', (3,)),
+    ('verts', '<f4', (3, 3)),
+    ('attribute', '<u2')])
 
 
 class ThreeDeeParseError(Exception):
@@ -27,10 +37,17 @@ class ThreeDee(object):
     3D model parser base class.  Derrived classes are used for basic
     analysis of 3D models, and are not intended to be used for 3D
     rendering.
+
+    Vertices are never kept around; subclasses stream them in chunks
+    to add_verts(), which only keeps track of the bounds and sum.
     """
 
     def __init__(self, fileob):
-        self.verts = []
+        self.count = 0
+        self._sum = numpy.zeros(3)
+        self._min = None
+        self._max = None
+
         self.average = [0, 0, 0]
         self.min = [None, None, None]
         self.max = [None, None, None]
@@ -39,29 +56,36 @@ class ThreeDee(object):
         self.height = 0 # z axis
 
         self.load(fileob)
-        if not len(self.verts):
+        if not self.count:
             raise ThreeDeeParseError("Empty model.")
 
-        for vector in self.verts:
-            for i in range(3):
-                num = vector[i]
-                self.average[i] += num
-                if not self.min[i]:
-                    self.min[i] = num
-                    self.max[i] = num
-                else:
-                    if self.min[i] > num:
-                        self.min[i] = num
-                    if self.max[i] < num:
-                        self.max[i] = num
-
-        for i in range(3):
-            self.average[i]/=len(self.verts)
+        # Plain floats, these end up in the database and in json
+        self.average = [float(n) for n in self._sum / self.count]
+        self.min = [float(n) for n in self._min]
+        self.max = [float(n) for n in self._max]
 
         self.width = abs(self.min[0] - self.max[0])
         self.depth = abs(self.min[1] - self.max[1])
         self.height = abs(self.min[2] - self.max[2])
 
+    def add_verts(self, verts):
+        """
+        Account for an (n, 3) array of vertices
+        """
+        if not len(verts):
+            return
+
+        verts = numpy.asarray(verts, numpy.float64)
+        chunk_min = verts.min(axis=0)
+        chunk_max = verts.max(axis=0)
+        if self._min is None:
+            self._min, self._max = chunk_min, chunk_max
+        else:
+            self._min = numpy.minimum(self._min, chunk_min)
+            self._max = numpy.maximum(self._max, chunk_max)
+
+        self._sum += verts.sum(axis=0)
+        self.count += len(verts)
 
     def load(self, fileob):
         """Override this method in your subclass."""
@@ -72,33 +96,61 @@ class ObjModel(ThreeDee):
     """
     Parser for textureless wavefront obj files.  File format
     reference: http://en.wikipedia.org/wiki/Wavefront_.obj_file
+
+    Only geometric vertices ("v" in obj, "vertex" in ascii stl) are
+    taken into account, normals and texture coordinates are skipped.
     """
+    VERTEX_KEYWORDS = (b"v", b"vertex")
+
+    def _add_coords(self, coords):
+        try:
+            verts = numpy.array(coords, numpy.float64).reshape(-1, 3)
+        except ValueError:
+            raise ThreeDeeParseError("Malformed vertex.")
+        self.add_verts(verts)
 
-    def __vector(self, line, expected=3):
-        nums = map(float, line.strip().split(" ")[1:])
-        return tuple(nums[:expected])
-    
     def load(self, fileob):
+        fileob.seek(0)
+        coords = []
+        lines = 0
         for line in fileob:
-            line = line.strip()
-            if line[0] == "v":
-                self.verts.append(self.__vector(line))
-            
+            parts = line.split()
+            if parts and parts[0] in self.VERTEX_KEYWORDS:
+                if len(parts) < 4:
+                    raise ThreeDeeParseError("Malformed vertex.")
+                coords.extend(parts[1:4])
+
+            lines += 1
+            if lines == CHUNK_SIZE:
+                self._add_coords(coords)
+                coords = []
+                lines = 0
+
+        self._add_coords(coords)
+
 
 class BinaryStlModel(ThreeDee):
     """
-    Parser for ascii-encoded stl files.  File format reference:
+    Parser for binary stl files.  File format reference:
     http://en.wikipedia.org/wiki/STL_%28file_format%29#Binary_STL
     """
 
     def load(self, fileob):
         fileob.seek(80) # skip the header
-        count = struct.unpack("<I", fileob.read(4))[0]
-        for i in range(count):
-            fileob.read(12) # skip the normal vector
-            for v in range(3):
-                self.verts.append(struct.unpack("<3f", fileob.read(12)))
-            fileob.read(2) # skip the attribute bytes
+        header = fileob.read(4)
+        if len(header) != 4:
+            raise ThreeDeeParseError("Truncated header.")
+        count = int(numpy.frombuffer(header, '<u4')[0])
+
+        while count:
+            chunk = min(count, CHUNK_SIZE)
+            data = fileob.read(chunk * STL_TRIANGLE.itemsize)
+            if len(data) != chunk * STL_TRIANGLE.itemsize:
+                raise ThreeDeeParseError("Truncated model.")
+
+            triangles = numpy.frombuffer(data, STL_TRIANGLE)
+            self.add_verts(triangles['verts'].reshape(-1, 3))
+            count -= chunk
 
 
 def auto_detect(fileob, hint):
@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import functools
 import os
 import json
 import logging
@@ -25,8 +26,7 @@ from mediagoblin import mg_globals as mgg
 from mediagoblin.processing import (
     FilenameBuilder, MediaProcessor,
     ProcessingManager, request_from_args,
-    get_process_filename, store_public,
-    copy_original)
+    get_process_filename)
 
 from mediagoblin.media_types.stl import model_loader
 
@@ -113,12 +113,23 @@ class CommonStlProcessor(MediaProcessor):
         greatest.sort()
         self.greatest = greatest[-1]
 
-    def copy_original(self):
-        copy_original(
-            self.entry, self.process_filename,
+    def copy_original_step(self):
+        return functools.partial(
+            self.store_public, u'original', self.process_filename,
             self.name_builder.fill('{basename}{ext}'))
 
-    def _snap(self, keyname, name, camera, size, project="ORTHO"):
+    def copy_original(self):
+        self.run_steps(self.copy_original_step())
+
+    def _snap_step(self, keyname, name, camera, size, file_metadata,
+                   project="ORTHO"):
+        """
+        Return the processing step rendering the keyname picture, or
+        None if it is up to date already.
+        """
+        if self._skip_processing(keyname, **file_metadata):
+            return None
+
         filename = self.name_builder.fill(name)
         workbench_path = self.workbench.joinpath(filename)
         shot = {
@@ -133,13 +144,17 @@ class CommonStlProcessor(MediaProcessor):
             "height": size[1],
             "out_file": workbench_path,
             }
-        blender_render(shot)
 
-        # make sure the image rendered to the workbench path
-        assert os.path.exists(workbench_path)
+        def snap():
+            blender_render(shot)
+
+            # make sure the image rendered to the workbench path
+            assert os.path.exists(workbench_path)
 
-        # copy it up!
-        store_public(self.entry, keyname, workbench_path, filename)
+            # copy it up!
+            self.store_public(keyname, workbench_path, filename,
+                              file_metadata)
+        return snap
 
     def _skip_processing(self, keyname, **kwargs):
         file_metadata = self.entry.get_file_metadata(keyname)
@@ -157,90 +172,82 @@ class CommonStlProcessor(MediaProcessor):
 
         return skip
 
-    def generate_thumb(self, thumb_size=None):
+    def _medium_size(self, size=None):
+        return size or (mgg.global_config['media:medium']['max_width'],
+                        mgg.global_config['media:medium']['max_height'])
+
+    def thumb_step(self, thumb_size=None):
         if not thumb_size:
             thumb_size = (mgg.global_config['media:thumb']['max_width'],
                           mgg.global_config['media:thumb']['max_height'])
 
-        if self._skip_processing('thumb', thumb_size=thumb_size):
-            return
-
-        self._snap(
+        return self._snap_step(
             "thumb",
             "{basename}.thumb.jpg",
             [0, self.greatest*-1.5, self.greatest],
             thumb_size,
+            {'thumb_size': thumb_size},
             project="PERSP")
 
-        self.entry.set_file_metadata('thumb', thumb_size=thumb_size)
-
-    def generate_perspective(self, size=None):
-        if not size:
-            size = (mgg.global_config['media:medium']['max_width'],
-                    mgg.global_config['media:medium']['max_height'])
-
-        if self._skip_processing('perspective', size=size):
-            return
-
-        self._snap(
+    def perspective_step(self, size=None):
+        size = self._medium_size(size)
+        return self._snap_step(
             "perspective",
             "{basename}.perspective.jpg",
             [0, self.greatest*-1.5, self.greatest],
             size,
+            {'size': size},
             project="PERSP")
 
-        self.entry.set_file_metadata('perspective', size=size)
-
-    def generate_topview(self, size=None):
-        if not size:
-            size = (mgg.global_config['media:medium']['max_width'],
-                    mgg.global_config['media:medium']['max_height'])
-
-        if self._skip_processing('top', size=size):
-            return
-
-        self._snap(
+    def topview_step(self, size=None):
+        size = self._medium_size(size)
+        return self._snap_step(
             "top",
             "{basename}.top.jpg",
             [self.model.average[0], self.model.average[1],
              self.greatest*2],
-            size)
-
-        self.entry.set_file_metadata('top', size=size)
-
-    def generate_frontview(self, size=None):
-        if not size:
-            size = (mgg.global_config['media:medium']['max_width'],
-                    mgg.global_config['media:medium']['max_height'])
-
-        if self._skip_processing('front', size=size):
-            return
+            size,
+            {'size': size})
 
-        self._snap(
+    def frontview_step(self, size=None):
+        size = self._medium_size(size)
+        return self._snap_step(
             "front",
             "{basename}.front.jpg",
             [self.model.average[0], self.greatest*-2,
              self.model.average[2]],
-            size)
-
-        self.entry.set_file_metadata('front', size=size)
-
-    def generate_sideview(self, size=None):
-        if not size:
-            size = (mgg.global_config['media:medium']['max_width'],
-                    mgg.global_config['media:medium']['max_height'])
-
-        if self._skip_processing('side', size=size):
-            return
+            size,
+            {'size': size})
 
-        self._snap(
+    def sideview_step(self, size=None):
+        size = self._medium_size(size)
+        return self._snap_step(
             "side",
             "{basename}.side.jpg",
             [self.greatest*-2, self.model.average[1],
              self.model.average[2]],
-            size)
+            size,
+            {'size': size})
+
+    def medium_steps(self, size=None):
+        """The steps rendering all the medium sized pictures"""
+        return [self.perspective_step(size), self.topview_step(size),
+                self.frontview_step(size), self.sideview_step(size)]
 
-        self.entry.set_file_metadata('side', size=size)
+    def generate_thumb(self, thumb_size=None):
+        self.run_steps(self.thumb_step(thumb_size))
+
+    def generate_perspective(self, size=None):
+        self.run_steps(self.perspective_step(size))
+
+    def generate_topview(self, size=None):
+        self.run_steps(self.topview_step(size))
+
+    def generate_frontview(self, size=None):
+        self.run_steps(self.frontview_step(size))
+
+    def generate_sideview(self, size=None):
+        self.run_steps(self.sideview_step(size))
 
     def store_dimensions(self):
         """
@@ -302,13 +309,12 @@ class InitialProcessor(CommonStlProcessor):
 
     def process(self, size=None, thumb_size=None):
         self.common_setup()
-        self.generate_thumb(thumb_size=thumb_size)
-        self.generate_perspective(size=size)
-        self.generate_topview(size=size)
-        self.generate_frontview(size=size)
-        self.generate_sideview(size=size)
+        # Every picture is a Blender run of its own
+        self.run_steps(
+            self.thumb_step(thumb_size),
+            self.copy_original_step(),
+            *self.medium_steps(size))
         self.store_dimensions()
-        self.copy_original()
         self.delete_queue_file()
 
 
@@ -355,10 +361,7 @@ class Resizer(CommonStlProcessor):
     def process(self, file, size=None):
         self.common_setup()
         if file == 'medium':
-            self.generate_perspective(size=size)
-            self.generate_topview(size=size)
-            self.generate_frontview(size=size)
-            self.generate_sideview(size=size)
+            self.run_steps(*self.medium_steps(size))
         elif file == 'thumb':
             self.generate_thumb(thumb_size=size)
 
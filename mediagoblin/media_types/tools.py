@@ -14,6 +14,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
+import os
+import threading
+from collections import OrderedDict
 
 from mediagoblin import mg_globals
 
@@ -27,10 +30,7 @@ def media_type_warning():
                      ' to plugins to continue using them.')
 
 
-def discover(src):
-    '''
-    Discover properties about a media file
-    '''
+def _discover(src):
     # GStreamer might be not installed, so it should not be initialized on
     # import, or an exception will be raised.
     import gi
@@ -42,3 +42,93 @@ def discover(src):
     uri = 'file://{0}'.format(src)
     discoverer = GstPbutils.Discoverer.new(60 * Gst.SECOND)
     return discoverer.discover_uri(uri)
+
+
+class ProbeCache(object):
+    """
+    Remembers the results of discover(), so sniffing and processing a
+    file discovers it only once.
+
+    Results are kept by the file's path, size and modification time,
+    the max_entries most recent ones.  Processing works on a copy of the
+    sniffed file, often in another process: dumps() serialises a result
+    to pass it there and loads() sets it up for the copy.
+    """
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._probes = OrderedDict()
+        self._lock = threading.Lock()
+        # How often files were actually discovered
+        self.discoveries = 0
+
+    def _key(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return os.path.realpath(path), stat.st_size, stat.st_mtime
+
+    def get(self, path):
+        key = self._key(path)
+        with self._lock:
+            return self._probes.get(key)
+
+    def set(self, path, info):
+        key = self._key(path)
+        if key is None:
+            return
+        with self._lock:
+            self._probes.pop(key, None)
+            self._probes[key] = info
+            while len(self._probes) > self.max_entries:
+                self._probes.popitem(last=False)
+
+    def discover(self, path):
+        info = self.get(path)
+        if info is None:
+            info = _discover(path)
+            self.discoveries += 1
+            self.set(path, info)
+        return info
+
+    def dumps(self, path):
+        """
+        Serialise the result for path to a string, or return None if
+        there's none (or GStreamer is too old to serialise it).
+        """
+        info = self.get(path)
+        if info is None:
+            return None
+
+        from gi.repository import GstPbutils
+        try:
+            variant = info.to_variant(GstPbutils.DiscovererSerializeFlags.ALL)
+        except AttributeError:
+            # Needs GStreamer 1.6
+            return None
+        return variant.print_(True)
+
+    def loads(self, path, probe):
+        """Use the serialised result probe (see dumps) for path"""
+        from gi.repository import GLib, GstPbutils
+        try:
+            variant = GLib.Variant.parse(None, probe, None, None)
+            info = GstPbutils.DiscovererInfo.from_variant(variant)
+        except Exception as exc:
+            _log.warning('Could not load a serialised discover result: '
+                         '{0}'.format(exc))
+            return
+        self.set(path, info)
+
+
+PROBE_CACHE = ProbeCache()
+
+
+def discover(src):
+    '''
+    Discover properties about a media file
+
+    The results are kept in PROBE_CACHE, so discovering the same file
+    again is cheap.
+    '''
+    return PROBE_CACHE.discover(src)
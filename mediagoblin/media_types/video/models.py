@@ -22,6 +22,7 @@ from sqlalchemy import (
 from sqlalchemy.orm import relationship, backref
 from mediagoblin.db.extratypes import JSONEncoded
 from mediagoblin.media_types import video
+from mediagoblin.media_types.video.util import is_rendition_keyname
 
 
 BACKREF_NAME = "video__media_data"
@@ -91,6 +92,36 @@ class VideoData(Base):
         else:
             return video.VideoMediaManager.default_webm_type
 
+    def rendition_sources(self):
+        """
+        The extra renditions of the video as (filepath, media query) pairs,
+        in the order of the <source> elements to put before the one of the
+        medium sized video.
+
+        Smaller renditions are meant for screens narrower than they are
+        wide, bigger ones for screens at least as wide as they are.
+        """
+        entry = self.get_media_entry
+        smaller = []
+        bigger = []
+        for keyname, media_file in entry.media_files_helper.items():
+            if not is_rendition_keyname(keyname):
+                continue
+            width = (media_file.file_metadata or {}).get('width')
+            if not width or not self.width or width == self.width:
+                continue
+            if width < self.width:
+                smaller.append(
+                    (width, media_file.file_path,
+                     '(max-width: {0}px)'.format(width)))
+            else:
+                bigger.append(
+                    (width, media_file.file_path,
+                     '(min-width: {0}px)'.format(width)))
+
+        return [(filepath, media) for width, filepath, media
+                in sorted(smaller) + sorted(bigger, reverse=True)]
+
 
 DATA_MODEL = VideoData
 MODELS = [VideoData]
@@ -18,6 +18,7 @@ import argparse
 import os.path
 import logging
 import datetime
+import functools
 
 import six
 
@@ -32,7 +33,7 @@ from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
 from mediagoblin.media_types import MissingComponents
 
 from . import transcoders
-from .util import skip_transcode
+from .util import skip_transcode, rendition_keyname, is_rendition_keyname
 
 _log = logging.getLogger(__name__)
 _log.setLevel(logging.DEBUG)
@@ -173,9 +174,14 @@ class CommonVideoProcessor(MediaProcessor):
         # Pull down and set up the processing file
         self.process_filename = get_process_filename(
             self.entry, self.workbench, self.acceptable_files)
+        self.use_probe(self.process_filename)
         self.name_builder = FilenameBuilder(self.process_filename)
 
-        self.transcoder = transcoders.VideoTranscoder()
+        if self.video_config['transcode_segments'] > 1:
+            self.transcoder = transcoders.SegmentedVideoTranscoder(
+                self.video_config['transcode_segments'])
+        else:
+            self.transcoder = transcoders.VideoTranscoder()
         self.did_transcode = False
 
     def copy_original(self):
@@ -214,6 +220,9 @@ class CommonVideoProcessor(MediaProcessor):
             elif kwargs.get('vorbis_quality') != \
                     file_metadata.get('vorbis_quality'):
                 skip = False
+            elif kwargs.get('rendition_heights') != \
+                    file_metadata.get('rendition_heights', []):
+                skip = False
         elif keyname == 'thumb':
             if kwargs.get('thumb_size') != file_metadata.get('thumb_size'):
                 skip = False
@@ -238,10 +247,13 @@ class CommonVideoProcessor(MediaProcessor):
         if not vorbis_quality:
             vorbis_quality = self.video_config['vorbis_quality']
 
+        rendition_heights = sorted(self.video_config['rendition_heights'])
+
         file_metadata = {'medium_size': medium_size,
                          'vp8_threads': vp8_threads,
                          'vp8_quality': vp8_quality,
-                         'vorbis_quality': vorbis_quality}
+                         'vorbis_quality': vorbis_quality,
+                         'rendition_heights': rendition_heights}
 
         if self._skip_processing('webm_video', **file_metadata):
             return
@@ -270,13 +282,26 @@ class CommonVideoProcessor(MediaProcessor):
                self.entry.media_files.get('webm_video'):
                 self.entry.media_files['webm_video'].delete()
 
+            # The original is played as it is, without any renditions
+            self._delete_renditions()
+
         else:
+            # Never scale renditions up
+            renditions = [
+                (height, os.path.join(
+                    self.workbench.dir,
+                    self.name_builder.fill(
+                        '{basename}.%dp.webm' % height)))
+                for height in rendition_heights
+                if height <= min(orig_dst_dimensions)]
+
             self.transcoder.transcode(self.process_filename, tmp_dst,
                                       vp8_quality=vp8_quality,
                                       vp8_threads=vp8_threads,
                                       vorbis_quality=vorbis_quality,
                                       progress_callback=progress_callback,
-                                      dimensions=tuple(medium_size))
+                                      dimensions=tuple(medium_size),
+                                      renditions=renditions)
             if self.transcoder.dst_data:
                 video_info = self.transcoder.dst_data.get_video_streams()[0]
                 dst_dimensions = (video_info.get_width(),
@@ -291,6 +316,9 @@ class CommonVideoProcessor(MediaProcessor):
 
                 self.entry.set_file_metadata('webm_video', **file_metadata)
 
+                self._delete_renditions(
+                    keep=self._store_renditions(renditions, file_metadata))
+
                 self.did_transcode = True
             else:
                 dst_dimensions = orig_dst_dimensions
@@ -300,7 +328,11 @@ class CommonVideoProcessor(MediaProcessor):
             width=dst_dimensions[0],
             height=dst_dimensions[1])
 
-    def generate_thumb(self, thumb_size=None):
+    def thumb_step(self, thumb_size=None):
+        """
+        Return the processing step capturing the thumbnail, or None if
+        it is up to date already.
+        """
         # Temporary file for the video thumbnail (cleaned up with workbench)
         tmp_thumb = os.path.join(self.workbench.dir,
                                  self.name_builder.fill(
@@ -310,25 +342,68 @@ class CommonVideoProcessor(MediaProcessor):
             thumb_size = (mgg.global_config['media:thumb']['max_width'],)
 
         if self._skip_processing('thumb', thumb_size=thumb_size):
-            return
-
-        # We will only use the width so that the correct scale is kept
-        transcoders.capture_thumb(
-            self.process_filename,
-            tmp_thumb,
-            thumb_size[0])
-
-        # Checking if the thumbnail was correctly created.  If it was not,
-        # then just give up.
-        if not os.path.exists (tmp_thumb):
-            return
-
-        # Push the thumbnail to public storage
-        _log.debug('Saving thumbnail...')
-        store_public(self.entry, 'thumb', tmp_thumb,
-                     self.name_builder.fill('{basename}.thumbnail.jpg'))
+            return None
+
+        def generate():
+            # We will only use the width so that the correct scale is kept
+            transcoders.capture_thumb(
+                self.process_filename,
+                tmp_thumb,
+                thumb_size[0])
+
+            # Checking if the thumbnail was correctly created.  If it was
+            # not, then just give up.
+            if not os.path.exists (tmp_thumb):
+                return
+
+            # Push the thumbnail to public storage
+            _log.debug('Saving thumbnail...')
+            self.store_public(
+                'thumb', tmp_thumb,
+                self.name_builder.fill('{basename}.thumbnail.jpg'),
+                {'thumb_size': thumb_size})
+        return generate
+
+    def _store_renditions(self, renditions, file_metadata):
+        '''
+        Push the renditions the transcoder produced to public storage,
+        and return their keynames
+        '''
+        stored = []
+        for height, tmp_rendition in renditions:
+            data = self.transcoder.rendition_data.get(tmp_rendition)
+            if data is None:
+                _log.warning('Rendition {0}p failed'.format(height))
+                continue
+
+            keyname = rendition_keyname(height)
+            video_info = data.get_video_streams()[0]
+            _log.debug('Saving {0}...'.format(keyname))
+            store_public(self.entry, keyname, tmp_rendition,
+                         self.name_builder.fill(
+                             '{basename}.%dp.webm' % height))
+            self.entry.set_file_metadata(
+                keyname,
+                width=video_info.get_width(),
+                height=video_info.get_height(),
+                vp8_quality=file_metadata['vp8_quality'],
+                vorbis_quality=file_metadata['vorbis_quality'])
+            stored.append(keyname)
+        return stored
+
+    def _delete_renditions(self, keep=()):
+        '''
+        Delete the renditions of the entry but those keyed keep, like the
+        ones of heights no longer configured or which failed this time
+        '''
+        for keyname in list(self.entry.media_files):
+            if is_rendition_keyname(keyname) and keyname not in keep:
+                _log.debug('Deleting {0}...'.format(keyname))
+                mgg.public_store.delete_file(self.entry.media_files[keyname])
+                del self.entry.media_files[keyname]
 
-        self.entry.set_file_metadata('thumb', thumb_size=thumb_size)
+    def generate_thumb(self, thumb_size=None):
+        self.run_steps(self.thumb_step(thumb_size=thumb_size))
 
 class InitialProcessor(CommonVideoProcessor):
     """
@@ -389,11 +464,16 @@ class InitialProcessor(CommonVideoProcessor):
                 vorbis_quality=None, thumb_size=None):
         self.common_setup()
 
-        self.transcode(medium_size=medium_size, vp8_quality=vp8_quality,
-                       vp8_threads=vp8_threads, vorbis_quality=vorbis_quality)
+        # Capture the thumbnail while transcoding, whether the original
+        # is kept depends on the transcoding though
+        self.run_steps(
+            functools.partial(
+                self.transcode, medium_size=medium_size,
+                vp8_quality=vp8_quality, vp8_threads=vp8_threads,
+                vorbis_quality=vorbis_quality),
+            self.thumb_step(thumb_size=thumb_size))
 
         self.copy_original()
-        self.generate_thumb(thumb_size=thumb_size)
         self.delete_queue_file()
 
 
@@ -16,10 +16,13 @@
 
 from __future__ import division, print_function
 
+import glob
 import os
+import shutil
 import sys
 import logging
 import multiprocessing
+import tempfile
 
 from mediagoblin.media_types.tools import discover
 from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
@@ -148,16 +151,33 @@ class VideoTranscoder(object):
     Transcodes the SRC video file to a VP8 WebM video file at DST
 
      - Produces a WebM vp8 and vorbis video file.
+     - Optionally produces more of them in other sizes (renditions) from
+       the same decoded video.
     '''
-    def __init__(self):
+    def __init__(self, loop=None):
         _log.info('Initializing VideoTranscoder...')
         self.progress_percentage = None
-        self.loop = GObject.MainLoop()
+        self.loop = loop or GObject.MainLoop()
+        self._done_callback = None
 
     def transcode(self, src, dst, **kwargs):
         '''
         Transcode a video file into a 'medium'-sized version.
         '''
+        self.start(src, dst, **kwargs)
+        _log.debug('Initializing MainLoop()')
+        self.loop.run()
+
+    def start(self, src, dst, done_callback=None, **kwargs):
+        '''
+        Start transcoding in the main loop of this transcoder, without
+        running the loop.
+
+        Once finished, done_callback is called with the transcoder, whose
+        dst_data is None if transcoding failed.  Without a done_callback
+        the main loop is stopped instead.
+        '''
+        self._done_callback = done_callback
         self.source_path = src
         self.destination_path = dst
 
@@ -182,18 +202,20 @@ class VideoTranscoder(object):
 
         self._progress_callback = kwargs.get('progress_callback') or None
 
+        # Extra renditions as (short side, destination path) pairs
+        self.renditions = kwargs.get('renditions') or []
+        self.rendition_data = {}
+
         if not type(self.destination_dimensions) == tuple:
             raise Exception('dimensions must be tuple: (width, height)')
 
         self._setup_pipeline()
+        self._setup_renditions()
         self.data = discover(self.source_path)
         self._link_elements()
         self.__setup_videoscale_capsfilter()
         self.pipeline.set_state(Gst.State.PLAYING)
         _log.info('Transcoding...')
-        _log.debug('Initializing MainLoop()')
-        self.loop.run()
-
 
     def _setup_pipeline(self):
         _log.debug('Setting up transcoding pipeline')
@@ -269,6 +291,74 @@ class VideoTranscoder(object):
         self.progressreport.set_property('silent', True)
         self.pipeline.add(self.progressreport)
 
+    def _setup_renditions(self):
+        '''
+        Add the elements encoding the renditions.  The decoded video and
+        the encoded audio get split between them and the medium sized
+        video with tees.
+        '''
+        self.rendition_branches = []
+        if not self.renditions:
+            return
+
+        self.videotee = Gst.ElementFactory.make('tee', 'videotee')
+        self.pipeline.add(self.videotee)
+        self.audiotee = Gst.ElementFactory.make('tee', 'audiotee')
+        self.pipeline.add(self.audiotee)
+
+        for short_side, destination in self.renditions:
+            branch = {'short_side': short_side}
+            for name, factory in (('videoqueue', 'queue'),
+                                  ('videoscale', 'videoscale'),
+                                  ('capsfilter', 'capsfilter'),
+                                  ('vp8enc', 'vp8enc'),
+                                  ('audioqueue', 'queue'),
+                                  ('webmmux', 'webmmux'),
+                                  ('filesink', 'filesink')):
+                branch[name] = Gst.ElementFactory.make(factory, None)
+                self.pipeline.add(branch[name])
+            branch['vp8enc'].set_property('threads', self.vp8_threads)
+            branch['filesink'].set_property('location', destination)
+            self.rendition_branches.append(branch)
+
+        # And one branch for the medium sized video
+        self.medium_videoqueue = Gst.ElementFactory.make('queue', None)
+        self.pipeline.add(self.medium_videoqueue)
+        self.medium_audioqueue = Gst.ElementFactory.make('queue', None)
+        self.pipeline.add(self.medium_audioqueue)
+
+    def _link_renditions(self, with_audio):
+        video_info = self.data.get_video_streams()[0]
+        portrait = video_info.get_height() > video_info.get_width()
+
+        self.videoconvert.link(self.videotee)
+        self.videotee.link(self.medium_videoqueue)
+        self.medium_videoqueue.link(self.videoscale)
+        if with_audio:
+            self.vorbisenc.link(self.audiotee)
+            self.audiotee.link(self.medium_audioqueue)
+            self.medium_audioqueue.link(self.webmmux)
+
+        for branch in self.rendition_branches:
+            caps_struct = Gst.Structure.new_empty('video/x-raw')
+            caps_struct.set_value('pixel-aspect-ratio', Gst.Fraction(1, 1))
+            caps_struct.set_value('framerate', Gst.Fraction(30, 1))
+            caps_struct.set_value('width' if portrait else 'height',
+                                  branch['short_side'])
+            caps = Gst.Caps.new_empty()
+            caps.append_structure(caps_struct)
+            branch['capsfilter'].set_property('caps', caps)
+
+            self.videotee.link(branch['videoqueue'])
+            branch['videoqueue'].link(branch['videoscale'])
+            branch['videoscale'].link(branch['capsfilter'])
+            branch['capsfilter'].link(branch['vp8enc'])
+            branch['vp8enc'].link(branch['webmmux'])
+            if with_audio:
+                self.audiotee.link(branch['audioqueue'])
+                branch['audioqueue'].link(branch['webmmux'])
+            branch['webmmux'].link(branch['filesink'])
+
     def _link_elements(self):
         '''
         Link all the elements
@@ -284,17 +374,22 @@ class VideoTranscoder(object):
         # link the rest
         self.videoqueue.link(self.videorate)
         self.videorate.link(self.videoconvert)
-        self.videoconvert.link(self.videoscale)
+        if not self.rendition_branches:
+            self.videoconvert.link(self.videoscale)
         self.videoscale.link(self.capsfilter)
         self.capsfilter.link(self.vp8enc)
         self.vp8enc.link(self.webmmux)
 
-        if self.data.get_audio_streams():
+        with_audio = bool(self.data.get_audio_streams())
+        if with_audio:
             self.audioqueue.link(self.audiorate)
             self.audiorate.link(self.audioconvert)
             self.audioconvert.link(self.audiocapsfilter)
             self.audiocapsfilter.link(self.vorbisenc)
-            self.vorbisenc.link(self.webmmux)
+            if not self.rendition_branches:
+                self.vorbisenc.link(self.webmmux)
+        if self.rendition_branches:
+            self._link_renditions(with_audio)
         self.webmmux.link(self.progressreport)
         self.progressreport.link(self.filesink)
 
@@ -344,6 +439,8 @@ class VideoTranscoder(object):
         _log.debug((bus, message, message.type))
         if message.type == Gst.MessageType.EOS:
             self.dst_data = discover(self.destination_path)
+            for short_side, destination in self.renditions:
+                self.rendition_data[destination] = discover(destination)
             self.__stop()
             _log.info('Done')
         elif message.type == Gst.MessageType.ELEMENT:
@@ -377,11 +474,237 @@ class VideoTranscoder(object):
 
         This wrapper makes us able to see if self.loop.quit has been called
         '''
+        if self._done_callback is not None:
+            self._done_callback(self)
+            return
+
         _log.info('Terminating MainLoop')
 
         self.loop.quit()
 
 
+def _wait_for_pipeline(pipeline):
+    '''
+    Play pipeline until it is done, return whether it succeeded
+    '''
+    pipeline.set_state(Gst.State.PLAYING)
+    message = pipeline.get_bus().timed_pop_filtered(
+        Gst.CLOCK_TIME_NONE,
+        Gst.MessageType.ERROR | Gst.MessageType.EOS)
+    pipeline.set_state(Gst.State.NULL)
+
+    if message.type == Gst.MessageType.ERROR:
+        _log.error('Got error: {0}'.format(message.parse_error()))
+        return False
+    return True
+
+
+def _link_stream_pads(pipeline, muxer, pad_templates):
+    '''
+    Return a pad-added callback linking video and audio pads to the
+    request pads of muxer named by pad_templates['video'] and
+    pad_templates['audio'].  Other streams are dropped.
+    '''
+    def pad_added(element, pad):
+        caps = pad.get_current_caps() or pad.query_caps(None)
+        if caps.is_any() or caps.is_empty():
+            # splitmuxsrc names its pads after the kind of stream
+            kind = pad.get_name().split('_')[0]
+        else:
+            kind = caps.get_structure(0).get_name().split('/')[0]
+        template = pad_templates.get(kind)
+        if template is not None:
+            _log.debug('linking {0} stream {1}'.format(kind, pad.get_name()))
+            pad.link(muxer.get_request_pad(template))
+        else:
+            _log.debug('dropping stream {0}'.format(pad.get_name()))
+            fakesink = Gst.ElementFactory.make('fakesink', None)
+            pipeline.add(fakesink)
+            fakesink.sync_state_with_parent()
+            pad.link(fakesink.get_static_pad('sink'))
+    return pad_added
+
+
+def split_video(src, location, segment_duration):
+    '''
+    Split the video file src on keyframes into parts of at least
+    segment_duration nanoseconds, without decoding it.
+
+    The parts are Matroska files named after location, a pattern like
+    "part%05d.mkv".  Returns their paths in order, or None if the file
+    could not be split.
+    '''
+    pipeline = Gst.Pipeline()
+    filesrc = Gst.ElementFactory.make('filesrc', None)
+    parsebin = Gst.ElementFactory.make('parsebin', None)
+    splitmuxsink = Gst.ElementFactory.make('splitmuxsink', None)
+    muxer = Gst.ElementFactory.make('matroskamux', None)
+    if None in (parsebin, splitmuxsink, muxer):
+        _log.warning('parsebin, splitmuxsink or matroskamux missing, '
+                     'not splitting {0}'.format(src))
+        return None
+
+    filesrc.set_property('location', src)
+    splitmuxsink.set_property('location', location)
+    splitmuxsink.set_property('max-size-time', segment_duration)
+    splitmuxsink.set_property('muxer', muxer)
+    for element in (filesrc, parsebin, splitmuxsink):
+        pipeline.add(element)
+    filesrc.link(parsebin)
+    parsebin.connect('pad-added', _link_stream_pads(
+        pipeline, splitmuxsink, {'video': 'video', 'audio': 'audio_%u'}))
+
+    if not _wait_for_pipeline(pipeline):
+        return None
+
+    # The counter in location grows with the parts, so they sort in order
+    parts_glob = location.replace('%05d', '*')
+    return sorted(glob.glob(parts_glob))
+
+
+def join_videos(parts_glob, dst):
+    '''
+    Join the WebM files matching parts_glob, in the order of their names,
+    into the WebM file dst.  Returns whether it succeeded.
+    '''
+    pipeline = Gst.Pipeline()
+    splitmuxsrc = Gst.ElementFactory.make('splitmuxsrc', None)
+    if splitmuxsrc is None:
+        _log.warning('splitmuxsrc missing, can\'t join videos')
+        return False
+
+    webmmux = Gst.ElementFactory.make('webmmux', None)
+    filesink = Gst.ElementFactory.make('filesink', None)
+    splitmuxsrc.set_property('location', parts_glob)
+    filesink.set_property('location', dst)
+    for element in (splitmuxsrc, webmmux, filesink):
+        pipeline.add(element)
+    webmmux.link(filesink)
+    splitmuxsrc.connect('pad-added', _link_stream_pads(
+        pipeline, webmmux, {'video': 'video_%u', 'audio': 'audio_%u'}))
+
+    return _wait_for_pipeline(pipeline)
+
+
+class SegmentedVideoTranscoder(object):
+    '''
+    Video transcoder working on segments of the video at the same time
+
+    Does what VideoTranscoder does, but splits SRC on keyframes into
+    ``segments`` parts of about the same duration first.  Every part gets
+    a transcoding pipeline of its own, all of them running at the same
+    time in one main loop (GStreamer does the actual work in threads of
+    the pipelines), and the transcoded parts are joined into DST.
+
+    Videos shorter than min_segment_duration times two, or which can't be
+    split, are transcoded by a single VideoTranscoder.
+    '''
+    # Shorter parts aren't worth their extra pipeline
+    min_segment_duration = 30 * Gst.SECOND
+
+    def __init__(self, segments):
+        _log.info('Initializing SegmentedVideoTranscoder...')
+        self.segments = segments
+        self.progress_percentage = None
+        self.dst_data = None
+        self.rendition_data = {}
+
+    def transcode(self, src, dst, **kwargs):
+        '''
+        Transcode a video file into a 'medium'-sized version.
+        '''
+        duration = discover(src).get_duration()
+        segment_duration = max(duration // max(self.segments, 1),
+                               self.min_segment_duration)
+
+        parts = None
+        workdir = tempfile.mkdtemp(dir=os.path.dirname(dst) or None)
+        try:
+            if duration >= 2 * segment_duration:
+                parts = split_video(
+                    src, os.path.join(workdir, 'part%05d.mkv'),
+                    segment_duration)
+
+            if not parts or len(parts) < 2:
+                _log.info('Transcoding {0} in one piece'.format(src))
+                transcoder = VideoTranscoder()
+                transcoder.transcode(src, dst, **kwargs)
+                self.dst_data = transcoder.dst_data
+                self.rendition_data = transcoder.rendition_data
+                return
+
+            _log.info('Transcoding {0} in {1} segments'.format(
+                src, len(parts)))
+            renditions = kwargs.pop('renditions', None) or []
+            transcoded = self._transcode_parts(parts, renditions, **kwargs)
+            if transcoded and join_videos(
+                    os.path.join(workdir, 'part*.webm'), dst):
+                self.dst_data = discover(dst)
+            else:
+                self.dst_data = None
+                return
+
+            # The parts of the renditions are named r<index>-part...
+            for index, (short_side, destination) in enumerate(renditions):
+                if join_videos(os.path.join(workdir, 'r%d-part*.webm' % index),
+                               destination):
+                    self.rendition_data[destination] = discover(destination)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def _transcode_parts(self, parts, renditions, **kwargs):
+        '''
+        Transcode all parts to WebM files next to them at the same time,
+        return whether all of them succeeded.
+        '''
+        loop = GObject.MainLoop()
+        progress_callback = kwargs.pop('progress_callback', None)
+        durations = [discover(part).get_duration() for part in parts]
+        part_progress = [0] * len(parts)
+        pending = set(range(len(parts)))
+        failed = []
+
+        # Share the encoder threads between the parts
+        vp8_threads = kwargs.get('vp8_threads') or CPU_COUNT
+        kwargs['vp8_threads'] = max(1, vp8_threads // len(parts))
+
+        def on_progress(index, percent):
+            part_progress[index] = percent
+            total = sum(progress * duration for progress, duration
+                        in zip(part_progress, durations))
+            percent = int(total // (sum(durations) or 1))
+            if percent != self.progress_percentage:
+                self.progress_percentage = percent
+                if progress_callback:
+                    progress_callback(percent)
+
+        def on_done(index, transcoder):
+            if transcoder.dst_data is None:
+                failed.append(index)
+            pending.discard(index)
+            if not pending:
+                loop.quit()
+
+        for index, part in enumerate(parts):
+            directory, name = os.path.split(os.path.splitext(part)[0])
+            part_renditions = [
+                (short_side,
+                 os.path.join(directory, 'r%d-%s.webm' % (number, name)))
+                for number, (short_side, destination)
+                in enumerate(renditions)]
+            transcoder = VideoTranscoder(loop)
+            transcoder.start(
+                part, os.path.join(directory, name + '.webm'),
+                renditions=part_renditions,
+                done_callback=lambda t, index=index: on_done(index, t),
+                progress_callback=(
+                    lambda percent, index=index: on_progress(index, percent)),
+                **kwargs)
+
+        loop.run()
+        return not failed
+
+
 if __name__ == '__main__':
     os.nice(19)
     from optparse import OptionParser
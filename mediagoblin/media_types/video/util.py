@@ -63,3 +63,16 @@ def skip_transcode(metadata, size):
                 return False
 
     return True
+
+
+def rendition_keyname(short_side):
+    '''
+    The media_files key of the rendition of a video whose shorter side
+    is short_side pixels long, like webm_720p
+    '''
+    return u'webm_{0}p'.format(short_side)
+
+
+def is_rendition_keyname(keyname):
+    return keyname.startswith(u'webm_') and keyname.endswith(u'p') \
+        and keyname[len(u'webm_'):-1].isdigit()
@@ -16,7 +16,7 @@
 
 
 from mediagoblin.db.models import (MediaEntry, User, Report, Privilege,
-                                   UserBan, LocalUser)
+                                   LocalUser)
 from mediagoblin.decorators import (require_admin_or_moderator_login,
                                     active_user_from_url, user_has_privilege,
                                     allow_reporting)
@@ -87,7 +87,7 @@ def moderation_users_detail(request):
     closed_reports = user.reports_filed_on.filter(
         Report.resolved!=None).all()
     privileges = Privilege.query
-    user_banned = UserBan.query.get(user.id)
+    user_banned = user.ban
     ban_form = moderation_forms.BanForm()
 
     return render_to_response(
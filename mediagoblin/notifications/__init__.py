@@ -41,6 +41,10 @@ def trigger_notification(comment, media_entry, request):
             user_id=subscription.user_id,
         )
         cn.obj = comment
+        # Counted in the same transaction, and by the database so
+        # concurrent comments can't lose an update
+        subscription.user.num_unseen_notifications = \
+            User.num_unseen_notifications + 1
         cn.save()
 
         if subscription.send_email:
@@ -55,8 +59,10 @@ def trigger_notification(comment, media_entry, request):
 
 
 def mark_notification_seen(notification):
-    if notification:
+    if notification and not notification.seen:
         notification.seen = True
+        notification.user.num_unseen_notifications = \
+            User.num_unseen_notifications - 1
         notification.save()
 
 
@@ -128,8 +134,8 @@ NOTIFICATION_FETCH_LIMIT = 100
 
 def get_notifications(user_id, only_unseen=True):
     query = Notification.query.filter_by(user_id=user_id)
-    wants_notifications = User.query.filter_by(id=user_id).first()\
-        .wants_notifications
+    # Usually request.user, which get() finds without a query
+    wants_notifications = User.query.get(user_id).wants_notifications
 
     # If the user does not want notifications, don't return any
     if not wants_notifications:
@@ -145,17 +151,21 @@ def get_notifications(user_id, only_unseen=True):
 
 
 def get_notification_count(user_id, only_unseen=True):
-    query = Notification.query.filter_by(user_id=user_id)
-    wants_notifications = User.query.filter_by(id=user_id).first()\
-        .wants_notifications
+    """
+    Count the user's (unseen) notifications, None if the user doesn't
+    want notifications.
 
-    if only_unseen:
-        query = query.filter_by(seen=False)
+    This is shown on every page, so the unseen ones aren't counted but
+    read from the user's num_unseen_notifications.
+    """
+    # Usually request.user, which get() finds without a query
+    user = User.query.get(user_id)
 
     # If the user doesn't want notifications, don't show any
-    if not wants_notifications:
-        count = None
-    else:
-        count = query.count()
+    if not user.wants_notifications:
+        return None
+
+    if only_unseen:
+        return user.num_unseen_notifications or 0
 
-    return count
+    return Notification.query.filter_by(user_id=user_id).count()
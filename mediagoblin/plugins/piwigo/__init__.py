@@ -16,9 +16,10 @@
 
 import logging
 
+from mediagoblin import mg_globals
 from mediagoblin.tools import pluginapi
 from mediagoblin.tools.session import SessionManager
-from .tools import PWGSession
+from .tools import PWGSession, delete_stale_chunks
 
 _log = logging.getLogger(__name__)
 
@@ -37,6 +38,11 @@ def setup_plugin():
     PWGSession.session_manager = SessionManager("pwg_id", "plugins.piwigo")
 
 
+def collect_garbage(cutoff):
+    delete_stale_chunks(mg_globals.queue_store, cutoff)
+
+
 hooks = {
-    'setup': setup_plugin
+    'setup': setup_plugin,
+    'collect_garbage': collect_garbage,
 }
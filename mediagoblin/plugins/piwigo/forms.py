@@ -40,5 +40,7 @@ class AddForm(wtforms.Form):
          _md5_validator])
     file_sum = wtforms.StringField(None, [_md5_validator])
     name = wtforms.StringField()
+    original_filename = wtforms.StringField()
+    comment = wtforms.StringField()
     date_creation = wtforms.StringField()
     categories = wtforms.StringField()
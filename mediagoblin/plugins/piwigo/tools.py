@@ -15,7 +15,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from collections import namedtuple
+import base64
+import binascii
+import calendar
+import hashlib
 import logging
+import os
+import tempfile
 
 import six
 import lxml.etree as ET
@@ -28,6 +34,11 @@ from mediagoblin.tools.response import Response
 _log = logging.getLogger(__name__)
 
 
+# Size of the pieces read back from the queue store while assembling
+# an upload, so big files never have to be held in memory at once.
+CHUNK_READ_SIZE = 2 ** 16
+
+
 PwgError = namedtuple("PwgError", ["code", "msg"])
 
 
@@ -163,3 +174,130 @@ class PWGSession(object):
         assert self.in_pwg_session
         self.session_manager.save_session_to_cookie(self.request.session,
             self.request, response)
+
+
+class ChunkError(Exception):
+    """
+    Raised when the staged chunks of an upload can't be turned into a
+    complete file.  The chunks are kept, so the client can resend
+    whatever is missing and retry.
+    """
+    pass
+
+
+def _chunk_dir(user, original_sum):
+    return ['piwigo_chunks', six.text_type(user.id), original_sum.lower()]
+
+
+def _chunk_filepath(user, original_sum, position):
+    return _chunk_dir(user, original_sum) + [u'%06d' % position]
+
+
+def decode_chunk(data):
+    """Decode the base64 payload of a pwg.images.addChunk call"""
+    if data is None:
+        raise BadRequest("Parameter data missing")
+    if isinstance(data, six.text_type):
+        data = data.encode('ascii', 'ignore')
+    try:
+        return base64.b64decode(data)
+    except (TypeError, binascii.Error):
+        raise BadRequest("Parameter data is not base64")
+
+
+def store_chunk(queue_store, user, original_sum, position, data):
+    """
+    Stage one chunk of an upload in the queue store.
+
+    Chunks are keyed on the uploading user and the md5 of the original
+    file, so an interrupted upload can be resumed later by sending the
+    missing (or all) chunks again; resent chunks simply replace the
+    staged ones.
+    """
+    with queue_store.get_file(
+            _chunk_filepath(user, original_sum, position), 'wb') as chunk:
+        chunk.write(data)
+
+
+def _staged_positions(queue_store, user, original_sum):
+    # Clients number their chunks either from 0 or from 1.
+    position = 0
+    if not queue_store.file_exists(
+            _chunk_filepath(user, original_sum, position)):
+        position = 1
+    while queue_store.file_exists(
+            _chunk_filepath(user, original_sum, position)):
+        yield position
+        position += 1
+
+
+def assemble_chunks(queue_store, user, original_sum, file_sum):
+    """
+    Concatenate the staged chunks of an upload into a temporary file.
+
+    The data is streamed through in CHUNK_READ_SIZE pieces and hashed on
+    the way, raising ChunkError if nothing was staged or if the result
+    doesn't match file_sum.  Returns the temporary file, rewound.
+    """
+    assembled = tempfile.TemporaryFile()
+    md5 = hashlib.md5()
+    n_chunks = 0
+    for position in _staged_positions(queue_store, user, original_sum):
+        with queue_store.get_file(
+                _chunk_filepath(user, original_sum, position), 'rb') as chunk:
+            while True:
+                data = chunk.read(CHUNK_READ_SIZE)
+                if not data:
+                    break
+                md5.update(data)
+                assembled.write(data)
+        n_chunks += 1
+
+    if not n_chunks:
+        assembled.close()
+        raise ChunkError("No chunks uploaded for %s" % original_sum)
+
+    if md5.hexdigest() != file_sum.lower():
+        assembled.close()
+        raise ChunkError(
+            "md5 of the %d uploaded chunks does not match file_sum %s" % (
+                n_chunks, file_sum))
+
+    assembled.seek(0)
+    return assembled
+
+
+def delete_chunks(queue_store, user, original_sum):
+    """Remove the staged chunks of an upload from the queue store"""
+    queue_store.delete_dir(_chunk_dir(user, original_sum), recursive=True)
+
+
+def delete_stale_chunks(queue_store, cutoff):
+    """
+    Remove the staged chunks of uploads which got no chunk since cutoff
+    (a UTC datetime), as their clients gave up on them.
+
+    This has to look at the files' ages, so it only works on a local
+    queue store.
+    """
+    if not queue_store.local_storage:
+        return
+    chunks_dir = queue_store.get_local_path(['piwigo_chunks'])
+    if not os.path.isdir(chunks_dir):
+        return
+
+    cutoff = calendar.timegm(cutoff.utctimetuple())
+    for user_id in os.listdir(chunks_dir):
+        for original_sum in os.listdir(os.path.join(chunks_dir, user_id)):
+            upload_dir = os.path.join(chunks_dir, user_id, original_sum)
+            # Resent chunks replace their file without touching the
+            # directory, so look at the chunks too
+            last_change = max(
+                os.path.getmtime(os.path.join(upload_dir, name))
+                for name in os.listdir(upload_dir) + ['.'])
+            if last_change < cutoff:
+                _log.info('Deleting the stale chunks of %s', original_sum)
+                queue_store.delete_dir(
+                    ['piwigo_chunks', user_id, original_sum], recursive=True)
+        # Only goes if it's empty now
+        queue_store.delete_dir(['piwigo_chunks', user_id])
@@ -31,10 +31,12 @@ from mediagoblin.submit.lib import \
 
 
 from mediagoblin.user_pages.lib import add_media_to_collection
-from mediagoblin.db.models import Collection
+from mediagoblin.db.models import Collection, MediaEntry
+from mediagoblin.db.util import media_entries_for_content_hash
 
 from .tools import CmdTable, response_xml, check_form, \
-    PWGSession, PwgNamedArray, PwgError
+    PWGSession, PwgNamedArray, PwgError, ChunkError, \
+    decode_chunk, store_chunk, assemble_chunks, delete_chunks
 from .forms import AddSimpleForm, AddForm
 
 
@@ -110,7 +112,26 @@ def pwg_categories_getList(request):
 
 @CmdTable("pwg.images.exist")
 def pwg_images_exist(request):
-    return {}
+    if not request.user:
+        return PwgError(401, 'Access denied')
+
+    md5sums = [s.strip().lower() for s in
+               request.values.get("md5sum_list", "").split(",")]
+    md5sums = [s for s in md5sums if md5sum_matcher.match(s)]
+
+    found = {}
+    if md5sums:
+        entries = media_entries_for_content_hash(
+            md5sums, uploader_id=request.user.id).order_by(MediaEntry.id)
+        for entry in entries:
+            found.setdefault(entry.content_hash, entry.id)
+
+    return {
+        'images': PwgNamedArray(
+            [{'md5sum': s, 'id': found.get(s, "")} for s in md5sums],
+            'image',
+            ('md5sum', 'id'))
+        }
 
 
 @CmdTable("pwg.images.addSimple", True)
@@ -128,19 +149,28 @@ def pwg_images_addSimple(request):
     if not check_file_field(request, 'image'):
         raise BadRequest()
 
+    return _submit_pwg_media(
+        request, request.files['image'], request.files['image'].filename,
+        six.text_type(form.name.data), six.text_type(form.comment.data),
+        [form.category.data])
+
+
+def _submit_pwg_media(request, submitted_file, filename, title, description,
+                      collection_ids):
     upload_limit, max_file_size = get_upload_file_limits(request.user)
 
     try:
         entry = submit_media(
             mg_app=request.app, user=request.user,
-            submitted_file=request.files['image'],
-            filename=request.files['image'].filename,
-            title=six.text_type(form.name.data),
-            description=six.text_type(form.comment.data),
+            submitted_file=submitted_file,
+            filename=filename,
+            title=title,
+            description=description,
             upload_limit=upload_limit, max_file_size=max_file_size)
 
-        collection_id = form.category.data
-        if collection_id > 0:
+        for collection_id in collection_ids:
+            if not collection_id or collection_id <= 0:
+                continue
             collection = Collection.query.get(collection_id)
             if collection is not None and collection.actor == request.user.id:
                 add_media_to_collection(collection, entry, "")
@@ -178,18 +208,39 @@ def fetch_md5(request, parm_name, optional_parm=False):
     return val
 
 
+def _parse_categories(categories):
+    """
+    Parse the "categories" parameter of pwg.images.add, which looks
+    like "12;14,3" (a ';' separated list of "id[,rank]").
+    """
+    ids = []
+    for category in (categories or u"").split(u";"):
+        category = category.split(u",")[0].strip()
+        if category.isdigit():
+            ids.append(int(category))
+    return ids
+
+
 @CmdTable("pwg.images.addChunk", True)
 def pwg_images_addChunk(request):
     o_sum = fetch_md5(request, 'original_sum')
     typ = request.form.get('type')
     pos = request.form.get('position')
-    data = request.form.get('data')
 
     # Validate params:
-    pos = int(pos)
+    try:
+        pos = int(pos)
+    except (TypeError, ValueError):
+        raise BadRequest("Parameter position is not a number")
+    if pos < 0:
+        raise BadRequest("Parameter position is negative")
     if not typ in ("file", "thumb"):
         _log.error("type %r not allowed for now", typ)
         return False
+    if not request.user:
+        return PwgError(401, 'Access denied')
+
+    data = decode_chunk(request.form.get('data'))
 
     _log.info("addChunk for %r, type %r, position %d, len: %d",
               o_sum, typ, pos, len(data))
@@ -197,6 +248,7 @@ def pwg_images_addChunk(request):
         _log.info("addChunk: Ignoring thumb, because we create our own")
         return True
 
+    store_chunk(request.app.queue_store, request.user, o_sum, pos, data)
     return True
 
 
@@ -205,8 +257,29 @@ def pwg_images_add(request):
     _log.info("add: %r", request.form)
     form = AddForm(request.form)
     check_form(form)
+    if not request.user:
+        return PwgError(401, 'Access denied')
 
-    return {'image_id': 123456, 'url': ''}
+    o_sum = form.original_sum.data.lower()
+    queue_store = request.app.queue_store
+    try:
+        assembled = assemble_chunks(
+            queue_store, request.user, o_sum, form.file_sum.data)
+    except ChunkError as e:
+        _log.error("add: %s", e)
+        return PwgError(1003, six.text_type(e))
+
+    filename = (form.original_filename.data or form.name.data
+                or o_sum)
+    with assembled:
+        result = _submit_pwg_media(
+            request, assembled, six.text_type(filename),
+            six.text_type(form.name.data or u""),
+            six.text_type(form.comment.data or u""),
+            _parse_categories(form.categories.data))
+
+    delete_chunks(queue_store, request.user, o_sum)
+    return result
 
 
 @csrf_exempt
@@ -24,11 +24,14 @@ except:
 import logging
 import os
 
+from multiprocessing.pool import ThreadPool
+
 import six
 
 from mediagoblin import mg_globals as mgg
 from mediagoblin.db.util import atomic_update
 from mediagoblin.db.models import MediaEntry
+from mediagoblin.media_types.tools import PROBE_CACHE
 from mediagoblin.tools.pluginapi import hook_handle
 from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
 
@@ -129,6 +132,15 @@ class MediaProcessor(object):
         # Should be initialized at time of processing, at least
         self.workbench = None
 
+        # Serialised discover() result of the queued file, if sniffing
+        # it discovered it already (see use_probe)
+        self.probe = None
+
+        # The public files stored by the steps run_steps is running, as
+        # (keyname, filepath, file_metadata) tuples
+        self._staged_files = None
+        self._staged_entry_id = None
+
     def __enter__(self):
         self.workbench = mgg.workbench_manager.create()
         return self
@@ -137,6 +149,83 @@ class MediaProcessor(object):
         self.workbench.destroy()
         self.workbench = None
 
+    def use_probe(self, filename):
+        """
+        Let discover() use the probe of the queued file for filename, the
+        file getting processed.  Only call this for the queued file.
+        """
+        if self.probe and self.entry.queued_media_file:
+            PROBE_CACHE.loads(filename, self.probe)
+
+    def run_steps(self, *steps):
+        """
+        Run independent processing steps at the same time.
+
+        Steps are callables without arguments; None steps are skipped.
+        The first step runs in this thread and may use the entry and the
+        database as usual, e.g. to report progress.  The others run in a
+        pool of threads, so they must only work on files: decide
+        everything depending on the entry before creating them, and
+        store their results with store_public.
+
+        The files stored are recorded on the entry once all steps
+        finished, so it is saved with all of them at once.  If a step
+        fails, they are removed from the public store again and its
+        exception is raised.
+
+        No more than the processing_threads config option steps run at
+        the same time.
+        """
+        steps = [step for step in steps if step is not None]
+        if not steps:
+            return
+
+        self._staged_files = []
+        self._staged_entry_id = self.entry.id
+        try:
+            threads = min(mgg.app_config['processing_threads'] - 1,
+                          len(steps) - 1)
+            if threads > 0:
+                pool = ThreadPool(threads)
+                try:
+                    results = [pool.apply_async(step) for step in steps[1:]]
+                    steps[0]()
+                    for result in results:
+                        result.get()
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                for step in steps:
+                    step()
+        except Exception:
+            for keyname, filepath, file_metadata in self._staged_files:
+                mgg.public_store.delete_file(filepath)
+            raise
+        else:
+            for keyname, filepath, file_metadata in self._staged_files:
+                record_public(self.entry, keyname, filepath, file_metadata)
+        finally:
+            self._staged_files = None
+
+    def store_public(self, keyname, local_file, target_name=None,
+                     file_metadata=None):
+        """
+        Store local_file in the public store as the keyname file of the
+        entry, with the file_metadata given.
+
+        Steps running in run_steps may call this from any thread; the
+        file is recorded on the entry once all steps finished.
+        """
+        if self._staged_files is None:
+            filepath = copy_public(
+                self.entry.id, keyname, local_file, target_name)
+            record_public(self.entry, keyname, filepath, file_metadata)
+        else:
+            filepath = copy_public(
+                self._staged_entry_id, keyname, local_file, target_name)
+            self._staged_files.append((keyname, filepath, file_metadata))
+
     # @with_workbench
     def process(self, **kwargs):
         """
@@ -366,18 +455,31 @@ def get_process_filename(entry, workbench, acceptable_files):
     return filename
 
 
-def store_public(entry, keyname, local_file, target_name=None,
-                 delete_if_exists=True):
+def serial_steps(*steps):
+    """
+    Combine processing steps depending on each other into one step for
+    MediaProcessor.run_steps, running them one after the other.
+    """
+    steps = [step for step in steps if step is not None]
+    if not steps:
+        return None
+
+    def run():
+        for step in steps:
+            step()
+    return run
+
+
+def copy_public(entry_id, keyname, local_file, target_name=None):
+    """
+    Copy local_file to a new path in the public store for the media entry
+    with entry_id and return that path.  Doesn't touch the entry itself.
+    """
     if target_name is None:
         target_name = os.path.basename(local_file)
-    target_filepath = create_pub_filepath(entry, target_name)
+    target_filepath = mgg.public_store.get_unique_filepath(
+        ['media_entries', six.text_type(entry_id), target_name])
 
-    if keyname in entry.media_files:
-        _log.warn("store_public: keyname %r already used for file %r, "
-                  "replacing with %r", keyname,
-                  entry.media_files[keyname], target_filepath)
-        if delete_if_exists:
-            mgg.public_store.delete_file(entry.media_files[keyname])
     try:
         mgg.public_store.copy_local_to_storage(local_file, target_filepath)
     except Exception as e:
@@ -387,8 +489,37 @@ def store_public(entry, keyname, local_file, target_name=None,
     if not mgg.public_store.file_exists(target_filepath):
         raise PublicStoreFail(keyname=keyname)
 
+    return target_filepath
+
+
+def record_public(entry, keyname, target_filepath, file_metadata=None,
+                  delete_if_exists=True):
+    """
+    Make the public file at target_filepath the keyname file of entry,
+    updating its file metadata with file_metadata.
+    """
+    if keyname in entry.media_files:
+        _log.warn("store_public: keyname %r already used for file %r, "
+                  "replacing with %r", keyname,
+                  entry.media_files[keyname], target_filepath)
+        if delete_if_exists:
+            mgg.public_store.delete_file(entry.media_files[keyname])
+
     entry.media_files[keyname] = target_filepath
 
+    if file_metadata:
+        media_file = entry.media_files_helper[keyname]
+        metadata = dict(media_file.file_metadata or {})
+        metadata.update(file_metadata)
+        media_file.file_metadata = metadata
+
+
+def store_public(entry, keyname, local_file, target_name=None,
+                 delete_if_exists=True):
+    target_filepath = copy_public(entry.id, keyname, local_file, target_name)
+    record_public(entry, keyname, target_filepath,
+                  delete_if_exists=delete_if_exists)
+
 
 def copy_original(entry, orig_filename, target_name, keyname=u"original"):
     store_public(entry, keyname, orig_filename, target_name)
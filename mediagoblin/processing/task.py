@@ -82,7 +82,8 @@ class ProcessMedia(celery.Task):
         :param reprocess: A dict containing all of the necessary reprocessing
             info for the media_type.
         """
-        reprocess_info = reprocess_info or {}
+        reprocess_info = dict(reprocess_info or {})
+        probe = reprocess_info.pop('probe', None)
         entry, manager = get_entry_and_processing_manager(media_id)
 
         # Try to process, and handle expected errors.
@@ -90,6 +91,7 @@ class ProcessMedia(celery.Task):
             processor_class = manager.get_processor(reprocess_action, entry)
 
             with processor_class(manager, entry) as processor:
+                processor.probe = probe
                 # Initial state change has to be here because
                 # the entry.state gets recorded on processor_class init
                 entry.state = u'processing'
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import logging
 import uuid
 from os.path import splitext
@@ -28,15 +29,20 @@ from mediagoblin.tools.response import json_response
 from mediagoblin.tools.text import convert_to_tag_list_of_dicts
 from mediagoblin.tools.federation import create_activity, create_generator
 from mediagoblin.db.models import MediaEntry, ProcessingMetaData
+from mediagoblin.db.util import media_entries_for_content_hash
 from mediagoblin.processing import mark_entry_failed
 from mediagoblin.processing.task import ProcessMedia
 from mediagoblin.notifications import add_comment_subscription
-from mediagoblin.media_types import sniff_media
+from mediagoblin.media_types import sniff_media_and_probe, local_media_file
 
 
 _log = logging.getLogger(__name__)
 
 
+# Size of the pieces uploads are copied into the queue store in
+QUEUE_COPY_SIZE = 2 ** 16
+
+
 def check_file_field(request, field_name):
     """Check if a file field meets minimal criteria"""
     retval = (field_name in request.files
@@ -132,20 +138,38 @@ def submit_media(mg_app, user, submitted_file, filename,
     if not all(ord(c) < 128 for c in filename):
         filename = six.text_type(uuid.uuid4()) + splitext(filename)[-1]
 
-    # Sniff the submitted media to determine which
-    # media plugin should handle processing
-    media_type, media_manager = sniff_media(submitted_file, filename)
+    # Sniffing needs the media on disk.  Uploads usually are already,
+    # streams get spooled there once, for both sniffing and queueing.
+    with local_media_file(submitted_file) as media_file:
+        # Sniff the submitted media to determine which
+        # media plugin should handle processing
+        media_type, media_manager, probe = sniff_media_and_probe(
+            media_file, filename)
+
+        # create entry and save in database
+        entry = new_upload_entry(user)
+        entry.media_type = media_type
+        entry.title = (title or six.text_type(splitext(filename)[0]))
+
+        entry.description = description or u""
+
+        entry.license = license or None
 
-    # create entry and save in database
-    entry = new_upload_entry(user)
-    entry.media_type = media_type
-    entry.title = (title or six.text_type(splitext(filename)[0]))
+        entry.media_metadata = metadata or {}
 
-    entry.description = description or u""
+        queue_file = prepare_queue_task(mg_app, entry, filename)
 
-    entry.license = license or None
+        with queue_file:
+            queue_file.write(media_file)
 
-    entry.media_metadata = metadata or {}
+    if mg_globals.app_config.get('link_duplicate_uploads'):
+        duplicate = find_duplicate_entry(user, entry.content_hash)
+        if duplicate is not None:
+            _log.info('Upload of %r is a duplicate of media entry %d, '
+                      'skipping processing', filename, duplicate.id)
+            mg_app.queue_store.delete_file(entry.queued_media_file)
+            mg_app.queue_store.delete_dir(entry.queued_media_file[:-1])
+            return duplicate
 
     # Process the user's folksonomy "tags"
     entry.tags = convert_to_tag_list_of_dicts(tags_string)
@@ -153,11 +177,6 @@ def submit_media(mg_app, user, submitted_file, filename,
     # Generate a slug from the title
     entry.generate_slug()
 
-    queue_file = prepare_queue_task(mg_app, entry, filename)
-
-    with queue_file:
-        queue_file.write(submitted_file)
-
     # Get file size and round to 2 decimal places
     file_size = mg_app.queue_store.get_file_size(
         entry.queued_media_file) / (1024.0 * 1024)
@@ -209,14 +228,70 @@ def submit_media(mg_app, user, submitted_file, filename,
     #
     # (... don't change entry after this point to avoid race
     # conditions with changes to the document via processing code)
-    run_process_media(entry, feed_url)
+    run_process_media(entry, feed_url,
+                      reprocess_info={'probe': probe} if probe else None)
 
     return entry
 
 
+def find_duplicate_entry(user, content_hash):
+    """
+    Find an already processed media entry of this user whose original
+    file has the given content hash, or None.
+    """
+    if not content_hash:
+        return None
+    return media_entries_for_content_hash(
+        [content_hash], uploader_id=user.id).filter(
+            MediaEntry.state == u'processed').order_by(
+                MediaEntry.id).first()
+
+
+class HashingQueueFile(object):
+    """
+    Wrapper around a queue file that hashes the data written to it.
+
+    Once closed, the md5 hex digest of everything written is stored as
+    the content_hash of the media entry.
+    """
+    def __init__(self, queue_file, entry):
+        self.queue_file = queue_file
+        self.entry = entry
+        self.md5 = hashlib.md5()
+
+    def _write(self, data):
+        self.md5.update(data)
+        self.queue_file.write(data)
+
+    def write(self, data):
+        if hasattr(data, 'read'):
+            # Copy file-like objects piece by piece, like the storage
+            # backends would, so big uploads stay out of memory.
+            while True:
+                piece = data.read(QUEUE_COPY_SIZE)
+                if not piece:
+                    break
+                self._write(piece)
+        else:
+            self._write(data)
+
+    def close(self):
+        self.queue_file.close()
+        self.entry.content_hash = six.text_type(self.md5.hexdigest())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 def prepare_queue_task(app, entry, filename):
     """
     Prepare a MediaEntry for the processing queue and get a queue file
+
+    The returned file hashes what is written to it, setting the
+    entry's content_hash once closed.
     """
     # We generate this ourselves so we know what the task id is for
     # retrieval later.
@@ -240,7 +315,7 @@ def prepare_queue_task(app, entry, filename):
     # Add queued filename to the entry
     entry.queued_media_file = queue_filepath
 
-    return queue_file
+    return HashingQueueFile(queue_file, entry)
 
 
 def run_process_media(entry, feed_url=None,
@@ -254,7 +329,9 @@ def run_process_media(entry, feed_url=None,
             user=request.user.username)`
     :param reprocess_action: What particular action should be run.
     :param reprocess_info: A dict containing all of the necessary reprocessing
-        info for the given media_type"""
+        info for the given media_type.  Its 'probe' key can hold the
+        serialised discover() result of the queued file (see
+        mediagoblin.media_types.tools.ProbeCache)"""
     try:
         ProcessMedia().apply_async(
             [entry.id, feed_url, reprocess_action, reprocess_info], {},
@@ -19,6 +19,7 @@ import datetime
 import pytz
 
 from mediagoblin.db.models import MediaEntry
+from mediagoblin.tools.pluginapi import hook_runall
 
 @celery.task()
 def collect_garbage():
@@ -36,3 +37,6 @@ def collect_garbage():
 
     for entry in garbage.all():
         entry.delete()
+
+    # Let plugins clean up after themselves too
+    hook_runall('collect_garbage', cuttoff)
@@ -533,6 +533,8 @@ class TestAPI(object):
         }
 
         comment = self._activity_to_feed(test_app, activity)[1]
+        media = MediaEntry.query.filter_by(public_id=data["object"]["id"]).first()
+        assert media.num_comments == 1
 
         # Now delete the image
         activity = {
@@ -549,6 +551,10 @@ class TestAPI(object):
         assert TextComment.query.filter_by(public_id=comment["object"]["id"]).first() is None
         comment_id = comment["object"]["id"]
 
+        # ... nor gets counted
+        media = MediaEntry.query.get(media.id)
+        assert media.num_comments == 0
+
         # Check we've got a delete activity back
         assert "id" in delete
         assert delete["verb"] == "delete"
@@ -0,0 +1,62 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+
+from mediagoblin.gmg_commands.batchaddmedia import (
+    open_csv_file, iter_csv_rows, parse_csv_file,
+    read_journal, write_journal)
+
+
+CSV_CONTENTS = (
+    u'location,title,id\n'
+    u'"goblin.jpg","A goblin\nnapping \u263a",nap\n'
+    u'\n'
+    u'snore.ogg,Snoring,\n')
+
+
+def test_iter_csv_rows(tmpdir):
+    metadata_path = tmpdir.join('metadata.csv')
+    metadata_path.write_text(CSV_CONTENTS, 'utf-8')
+
+    with open_csv_file(str(metadata_path)) as metadata:
+        rows = iter_csv_rows(metadata)
+        media_id, row = next(rows)
+        assert media_id == u'nap'
+        assert row == {u'location': u'goblin.jpg',
+                       u'title': u'A goblin\nnapping \u263a',
+                       u'id': u'nap'}
+
+        # Rows without an id are identified by their index
+        media_id, row = next(rows)
+        assert media_id == 2
+        assert row[u'location'] == u'snore.ogg'
+
+        assert list(rows) == []
+
+    assert sorted(parse_csv_file(CSV_CONTENTS).keys(),
+                  key=str) == [2, u'nap']
+
+
+def test_journal(tmpdir):
+    journal_path = str(tmpdir.join('metadata.csv.journal'))
+    assert read_journal(journal_path) == set()
+
+    with io.open(journal_path, 'a', encoding='utf-8') as journal:
+        write_journal(journal, u'nap')
+        write_journal(journal, 2)
+
+    assert read_journal(journal_path) == set([u'nap', u'2'])
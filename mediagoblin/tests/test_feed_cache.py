@@ -0,0 +1,74 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+
+from mediagoblin import mg_globals
+from mediagoblin.db.base import Session
+from mediagoblin.db.models import MediaEntry, Collection
+from mediagoblin.tests.tools import (fixture_add_user, fixture_media_entry,
+    fixture_add_collection)
+
+
+def test_user_feed_cache(test_app):
+    mg_globals.app.feed_cache.clear()
+    user = fixture_add_user(u'feedy', privileges=[u'active'])
+    media = fixture_media_entry(title=u'First title', uploader=user.id,
+                                state=u'processed')
+
+    response = test_app.get('/u/feedy/atom/')
+    assert 'First title' in response.unicode_body
+
+    # The feed comes from the cache while the newest time and the count
+    # of the entries stay the same...
+    entry = MediaEntry.query.get(media.id)
+    updated = entry.updated
+    MediaEntry.query.filter_by(id=media.id).update(
+        {'title': u'Second title', 'updated': updated})
+    Session.commit()
+    response = test_app.get('/u/feedy/atom/')
+    assert 'First title' in response.unicode_body
+    assert response.content_type == 'application/atom+xml'
+
+    # ... and is generated again when they change, without anything
+    # telling the cache
+    MediaEntry.query.filter_by(id=media.id).update(
+        {'updated': updated + datetime.timedelta(seconds=1)})
+    Session.commit()
+    response = test_app.get('/u/feedy/atom/')
+    assert 'Second title' in response.unicode_body
+
+    fixture_media_entry(title=u'Third title', uploader=user.id,
+                        state=u'processed')
+    response = test_app.get('/u/feedy/atom/')
+    assert 'Third title' in response.unicode_body
+
+
+def test_collection_feed_cache(test_app):
+    mg_globals.app.feed_cache.clear()
+    user = fixture_add_user(u'collecty', privileges=[u'active'])
+    media = fixture_media_entry(title=u'Collected title', uploader=user.id,
+                                state=u'processed')
+    collection = fixture_add_collection(name=u'feedcollection', user=user)
+    feed_url = '/u/collecty/collection/{0}/atom/'.format(collection.slug)
+
+    response = test_app.get(feed_url)
+    assert 'Collected title' not in response.unicode_body
+
+    Collection.query.get(collection.id).add_to_collection(
+        MediaEntry.query.get(media.id))
+    response = test_app.get(feed_url)
+    assert 'Collected title' in response.unicode_body
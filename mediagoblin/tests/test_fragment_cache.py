@@ -0,0 +1,90 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+
+from mediagoblin import mg_globals
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.tools.fragment_cache import (
+    MemoryFragmentCache, FileFragmentCache, fragment_cache_from_config)
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
+
+
+def test_memory_fragment_cache():
+    cache = MemoryFragmentCache(max_entries='2')
+    cache.set(u'a', u'A')
+    cache.set(u'b', u'B')
+    assert cache.get(u'a') == u'A'
+
+    # b is the least recently used now
+    cache.set(u'c', u'C')
+    assert cache.get(u'b') is None
+    assert cache.get(u'a') == u'A'
+    assert cache.get(u'c') == u'C'
+
+
+def test_file_fragment_cache(tmpdir):
+    base_dir = str(tmpdir.join('fragments'))
+    cache = fragment_cache_from_config({
+        'cache_class':
+            'mediagoblin.tools.fragment_cache:FileFragmentCache',
+        'base_dir': base_dir})
+    assert isinstance(cache, FileFragmentCache)
+
+    cache.set(u'media_license:core__media_entries:1', u'<p>\u263a</p>')
+    assert cache.get(u'media_license:core__media_entries:1') == \
+        u'<p>\u263a</p>'
+    # Other processes see it too
+    assert FileFragmentCache(base_dir).get(
+        u'media_license:core__media_entries:1') == u'<p>\u263a</p>'
+    assert cache.get(u'media_license:core__media_entries:2') is None
+
+    path = cache._path(u'media_license:core__media_entries:1')
+    long_ago = time.time() - cache.max_age - 1
+    os.utime(path, (long_ago, long_ago))
+    cache.prune()
+    assert cache.get(u'media_license:core__media_entries:1') is None
+
+
+def test_no_fragment_cache():
+    assert fragment_cache_from_config({'cache_class': ''}) is None
+
+
+def test_media_sidebar_fragments(test_app):
+    fragment_cache = mg_globals.app.fragment_cache
+    fragment_cache.clear()
+
+    user = fixture_add_user(u'fragmented', privileges=[u'active'])
+    media = fixture_media_entry(uploader=user.id, state=u'processed')
+    media_url = '/u/fragmented/m/{0}/'.format(media.slug)
+
+    response = test_app.get(media_url)
+    assert 'All rights reserved' in response.unicode_body
+    cached = set(fragment_cache._fragments)
+    assert any(key.startswith(u'media_license:') for key in cached)
+
+    # Rendering again uses the cached fragments
+    test_app.get(media_url)
+    assert set(fragment_cache._fragments) == cached
+
+    # Saving the entry makes them stale
+    media = MediaEntry.query.get(media.id)
+    media.license = u'http://creativecommons.org/licenses/by/3.0/'
+    media.save()
+    response = test_app.get(media_url)
+    assert 'All rights reserved' not in response.unicode_body
+    assert 'CC BY 3.0' in response.unicode_body
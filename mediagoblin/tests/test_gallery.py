@@ -0,0 +1,164 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from mediagoblin import mg_globals
+from mediagoblin.db.base import Session
+from mediagoblin.db.models import (MediaEntry, Activity, Collection,
+                                   GenericModelReference)
+from mediagoblin.tests.tools import (fixture_add_user, fixture_media_entry,
+                                     fixture_add_activity, fixture_add_comment,
+                                     fixture_add_collection, QueryCounter)
+
+
+GALLERY_URLS = ['/', '/atom/',
+                '/u/gallery_0/', '/u/gallery_0/gallery/', '/u/gallery_0/atom/']
+
+
+def add_entries(users, per_user):
+    for user in users:
+        for i in range(per_user):
+            fixture_media_entry(uploader=user.id, state=u'processed')
+
+
+def count_gallery_queries(test_app, counter):
+    counts = {}
+    for url in GALLERY_URLS:
+        # Warm up caches (like the pagination count) first
+        test_app.get(url)
+        with counter:
+            test_app.get(url)
+        counts[url] = counter.count
+    return counts
+
+
+def test_gallery_query_count(test_app):
+    counter = QueryCounter(mg_globals.database.engine)
+    users = [fixture_add_user(u'gallery_%d' % i, privileges=[u'active'])
+             for i in range(3)]
+
+    add_entries(users, 1)
+    few_entries = count_gallery_queries(test_app, counter)
+
+    add_entries(users, 6)
+    many_entries = count_gallery_queries(test_app, counter)
+
+    # Showing more entries (by more users) mustn't need more queries
+    assert many_entries == few_entries
+
+
+def test_load_gallery_data(test_app):
+    user = fixture_add_user(u'gallery_user', privileges=[u'active'])
+    add_entries([user], 3)
+
+    counter = QueryCounter(mg_globals.database.engine)
+    entries = MediaEntry.query.filter_by(actor=user.id).all()
+    with counter:
+        entries = MediaEntry.load_gallery_data(entries, media_data=True)
+        loading_queries = counter.count
+
+    with counter:
+        for entry in entries:
+            assert entry.media_files[u'thumb'] == (u'a', u'b', u'c.jpg')
+            assert entry.get_actor.username == u'gallery_user'
+            assert entry.media_data is None
+    assert counter.count == 0
+    # media files, actors and one media type
+    assert loading_queries == 3
+
+
+def test_resolve_all(test_app):
+    user = fixture_add_user(u'resolve_user', privileges=[u'active'])
+    entries = [fixture_media_entry(uploader=user.id, state=u'processed')
+               for i in range(3)]
+    collection = fixture_add_collection(user=user)
+    object_ids = [obj.id for obj in entries + [collection, user]]
+    reference_ids = []
+    for obj in entries + [collection, user]:
+        reference = GenericModelReference.find_or_new(obj)
+        reference.save()
+        reference_ids.append(reference.id)
+    Session.remove()
+
+    references = GenericModelReference.query.filter(
+        GenericModelReference.id.in_(reference_ids)).order_by(
+            GenericModelReference.id).all()
+    counter = QueryCounter(mg_globals.database.engine)
+    with counter:
+        objects = GenericModelReference.resolve_all(references)
+        # One query per model
+        assert counter.count == 3
+        assert [obj.id for obj in objects] == object_ids
+        assert isinstance(objects[-1], type(user))
+        assert objects[-1].username == u'resolve_user'
+        assert [ref.get_object() for ref in references] == objects
+    assert counter.count == 3
+
+
+def test_activity_feed_data(test_app):
+    user = fixture_add_user(u'activity_user', privileges=[u'active'])
+    for i in range(4):
+        entry = fixture_media_entry(uploader=user.id, state=u'processed')
+        fixture_add_activity(entry, actor=user)
+    Session.remove()
+
+    activities = Activity.query.filter_by(actor=user.id).all()
+    counter = QueryCounter(mg_globals.database.engine)
+    with counter:
+        activities = Activity.load_feed_data(activities)
+        loading_queries = counter.count
+
+    with counter:
+        for activity in activities:
+            assert activity.object().get_actor.username == u'activity_user'
+            assert activity.object().media_files[u'thumb']
+            assert activity.target() is None
+            assert activity.get_actor.username == u'activity_user'
+            assert activity.get_generator.name == u'GNU MediaGoblin'
+    assert counter.count == 0
+    # object references, actors, generators, media entries and their
+    # media files and actors
+    assert loading_queries == 6
+
+
+def test_comment_listing_query_count(test_app):
+    user = fixture_add_user(u'comment_user', privileges=[u'active'])
+    entry = fixture_media_entry(uploader=user.id, state=u'processed')
+    for i in range(5):
+        fixture_add_comment(author=user.id, media_entry=entry)
+    Session.remove()
+
+    entry = MediaEntry.query.get(entry.id)
+    counter = QueryCounter(mg_globals.database.engine)
+    with counter:
+        comments = entry.get_comments().slice(0, 10)
+        for comment in comments:
+            assert comment.get_actor.username == u'comment_user'
+    assert len(comments) == 5
+    # links, their references, the comments and their actors
+    assert counter.count == 4
+
+
+def test_collection_page(test_app):
+    user = fixture_add_user(u'collector', privileges=[u'active'])
+    entry = fixture_media_entry(uploader=user.id, state=u'processed')
+    collection = fixture_add_collection(user=user)
+    Collection.query.get(collection.id).add_to_collection(
+        MediaEntry.query.get(entry.id))
+
+    response = test_app.get(
+        '/u/collector/collection/{0}/'.format(collection.slug))
+    assert response.status_int == 200
+    assert '/u/collector/m/{0}/'.format(entry.slug) in response.unicode_body
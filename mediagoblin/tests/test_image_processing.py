@@ -0,0 +1,130 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import multiprocessing
+import os
+import resource
+import time
+
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+
+from mediagoblin.media_types.image.processing import (
+    RenditionPlanner, _fit_size, PIL_FILTERS)
+from mediagoblin.tools.exif import extract_exif, exif_fix_image_orientation
+
+from .resources import GOOD_JPG
+from .tools import benchmark
+
+MEDIUM = (640, 640)
+THUMB = (180, 180)
+
+
+def _make_jpeg(tmpdir, size=(6000, 4000)):
+    filename = os.path.join(str(tmpdir), 'big.jpg')
+    Image.new('RGB', size, (200, 100, 50)).save(filename, quality=90)
+    return filename
+
+
+def test_fit_size():
+    assert _fit_size((1000, 500), (640, 640)) == (640, 320)
+    assert _fit_size((500, 1000), (640, 640)) == (320, 640)
+    assert _fit_size((100, 50), (640, 640)) == (100, 50)
+
+
+def test_rendition_cascade(tmpdir):
+    filename = _make_jpeg(tmpdir)
+    planner = RenditionPlanner(filename, {})
+    assert planner.original_size == (6000, 4000)
+    assert planner.needs_resizing(MEDIUM)
+
+    planner.prepare([MEDIUM, THUMB])
+    medium = planner.render(MEDIUM, 'ANTIALIAS')
+    thumb = planner.render(THUMB, 'ANTIALIAS')
+
+    assert medium.size[0] == 640
+    assert thumb.size == (180, 120)
+    # The original was only decoded at a fraction of its size, and the
+    # thumb was derived from the medium rather than from the original
+    base = planner._sources[0]
+    assert base.size[0] < 6000
+    assert base.size[0] >= 640
+    assert len(planner._sources) == 3
+
+
+def test_rendition_rotation():
+    exif_tags = extract_exif(GOOD_JPG)
+    planner = RenditionPlanner(GOOD_JPG, exif_tags)
+    thumb = planner.render(THUMB, 'ANTIALIAS')
+
+    expected = exif_fix_image_orientation(Image.open(GOOD_JPG), exif_tags)
+    expected.thumbnail(THUMB, PIL_FILTERS['ANTIALIAS'])
+    assert thumb.size == expected.size
+
+
+def _legacy_renditions(filename):
+    # What processing used to do: open and decode the original once per
+    # rendition plus once more for the metadata.
+    for box in (MEDIUM, THUMB):
+        im = exif_fix_image_orientation(Image.open(filename), {})
+        im.thumbnail(box, PIL_FILTERS['ANTIALIAS'])
+    Image.open(filename).size
+
+
+def _planned_renditions(filename):
+    planner = RenditionPlanner(filename, {})
+    planner.prepare([MEDIUM, THUMB])
+    for box in (MEDIUM, THUMB):
+        planner.render(box, 'ANTIALIAS')
+    planner.original_size
+
+
+def _measure(func, filename, queue):
+    start = time.time()
+    func(filename)
+    queue.put((time.time() - start,
+               resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def _run_isolated(func, filename):
+    # Run in a fresh process so peak RSS is not polluted by other runs
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_measure, args=(func, filename, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+@benchmark
+def test_rendition_benchmark(tmpdir):
+    filename = _make_jpeg(tmpdir)
+
+    legacy_time, legacy_rss = _run_isolated(_legacy_renditions, filename)
+    planned_time, planned_rss = _run_isolated(_planned_renditions, filename)
+
+    print('\nrenditions of a 24 megapixel JPEG:')
+    print('  separate decodes: %.3fs wall, %d kB peak RSS' % (
+        legacy_time, legacy_rss))
+    print('  rendition planner: %.3fs wall, %d kB peak RSS' % (
+        planned_time, planned_rss))
+
+    assert planned_rss <= legacy_rss
@@ -14,6 +14,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import io
+import os
 import pytz
 import datetime
 
@@ -21,11 +23,15 @@ from werkzeug.datastructures import FileStorage
 
 from .resources import GOOD_JPG
 from mediagoblin.db.base import Session
-from mediagoblin.media_types import sniff_media
+from mediagoblin.media_types import sniff_media, local_media_file
 from mediagoblin.submit.lib import new_upload_entry
 from mediagoblin.submit.task import collect_garbage
-from mediagoblin.db.models import User, MediaEntry, TextComment, Comment
-from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
+from mediagoblin.db.models import User, MediaEntry, TextComment, Comment, \
+    Collection
+from mediagoblin.db.util import rebuild_counters, render_all_markdown
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry, \
+    fixture_add_comment, fixture_add_collection, \
+    fixture_add_comment_notification
 
 
 def test_404_for_non_existent(test_app):
@@ -138,3 +144,104 @@ def test_garbage_collection_task(test_app):
 
     # Now validate the image has been deleted
     assert MediaEntry.query.filter_by(id=entry_id).first() is None
+
+
+def test_rebuild_counters(test_app):
+    user = fixture_add_user(u'counted', privileges=[u'active'])
+    media = fixture_media_entry(uploader=user.id, state=u'processed')
+    comments = [fixture_add_comment(author=user.id, media_entry=media)
+                for i in range(3)]
+    fixture_add_comment_notification(media.id, comments[0], user.id)
+    fixture_add_comment_notification(media.id, comments[1], user.id,
+                                     seen=True)
+    collection = fixture_add_collection(user=user)
+    collection = Collection.query.get(collection.id)
+    collection.add_to_collection(MediaEntry.query.get(media.id))
+    assert MediaEntry.query.get(media.id).num_comments == 3
+    assert User.query.get(user.id).num_unseen_notifications == 1
+
+    MediaEntry.query.update({'num_comments': 0})
+    Collection.query.update({'num_items': 7})
+    User.query.update({'num_unseen_notifications': None})
+    Session.commit()
+
+    rebuild_counters()
+
+    assert MediaEntry.query.get(media.id).num_comments == 3
+    assert Collection.query.get(collection.id).num_items == 1
+    assert User.query.get(user.id).num_unseen_notifications == 1
+
+    # Deleting a comment counts it out again
+    TextComment.query.get(comments[2].id).delete()
+    assert MediaEntry.query.get(media.id).num_comments == 2
+
+
+def test_conditional_get(test_app):
+    user = fixture_add_user(u'conditional', privileges=[u'active'])
+    media = fixture_media_entry(uploader=user.id, state=u'processed')
+
+    for url in ['/u/conditional/m/{0}/'.format(media.slug),
+                '/u/conditional/atom/', '/atom/']:
+        response = test_app.get(url)
+        assert response.status_int == 200
+        assert response.headers['Cache-Control'] == 'no-cache'
+        etag = response.headers['ETag']
+
+        response = test_app.get(url, headers={'If-None-Match': etag})
+        assert response.status_int == 304
+        assert not response.body
+
+    # A new comment changes the media page
+    url = '/u/conditional/m/{0}/'.format(media.slug)
+    etag = test_app.get(url).headers['ETag']
+    fixture_add_comment(author=user.id, media_entry=media)
+    response = test_app.get(url, headers={'If-None-Match': etag})
+    assert response.status_int == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_rendered_markdown(test_app):
+    user = fixture_add_user(u'marked', privileges=[u'active'])
+    media = fixture_media_entry(uploader=user.id, state=u'processed')
+    media = MediaEntry.query.get(media.id)
+    media.description = u'Some *emphasis*'
+    media.save()
+
+    # Stored when saving
+    media = MediaEntry.query.get(media.id)
+    assert media.rendered_html == u'<p>Some <em>emphasis</em></p>'
+    assert media.description_html == media.rendered_html
+
+    # Outdated renderings aren't used
+    MediaEntry.query.filter_by(id=media.id).update(
+        {'description': u'Some **strength**'})
+    Session.commit()
+    media = MediaEntry.query.get(media.id)
+    assert media.description_html == \
+        u'<p>Some <strong>strength</strong></p>'
+    assert media.rendered_html == u'<p>Some <em>emphasis</em></p>'
+
+    assert render_all_markdown() >= 1
+    media = MediaEntry.query.get(media.id)
+    assert media.rendered_html == u'<p>Some <strong>strength</strong></p>'
+    assert render_all_markdown() == 0
+
+
+def test_local_media_file(test_app):
+    # Files on disk are used as they are...
+    with open(GOOD_JPG, 'rb') as media_file:
+        media_file.read(10)
+        with local_media_file(media_file) as local_file:
+            assert local_file.name == GOOD_JPG
+            data = local_file.read()
+        # ... without moving media_file
+        assert media_file.tell() == 10
+
+    # ... only streams get spooled
+    with local_media_file(io.BytesIO(data)) as local_file:
+        assert local_file.name != GOOD_JPG
+        assert local_file.read() == data
+    assert not os.path.exists(local_file.name)
+
+    assert sniff_media(io.BytesIO(data), u'spooled.jpg')[0] == \
+        u'mediagoblin.media_types.image'
@@ -20,10 +20,12 @@ import six.moves.urllib.parse as urlparse
 
 from mediagoblin.tools import template, mail
 
-from mediagoblin.db.models import Notification, CommentSubscription
+from mediagoblin.db.models import Notification, CommentSubscription, \
+    MediaEntry
 from mediagoblin.db.base import Session
 
-from mediagoblin.notifications import mark_comment_notification_seen
+from mediagoblin.notifications import mark_comment_notification_seen, \
+    get_notification_count
 
 from mediagoblin.tests.tools import fixture_add_comment, \
     fixture_media_entry, fixture_add_user, \
@@ -113,6 +115,9 @@ class TestNotifications:
         assert notification.obj().get_actor.id == self.test_user.id
         assert notification.obj().content == u'Test comment #42'
 
+        assert get_notification_count(user_id) == 1
+        assert MediaEntry.query.get(media_entry_id).num_comments == 1
+
         if wants_email == True:
             assert mail.EMAIL_TEST_MBOX_INBOX == [
                 {'from': 'notice@mediagoblin.example.org',
@@ -138,6 +143,7 @@ otherperson@example.com\n\nSGkgb3RoZXJwZXJzb24sCmNocmlzIGNvbW1lbnRlZCBvbiB5b3VyI
         notification = Notification.query.filter_by(id=notification_id).first()
 
         assert notification.seen == True
+        assert get_notification_count(user_id) == 0
 
         self.test_app.get(media_uri_slug + 'notifications/silence/')
 
@@ -0,0 +1,136 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+
+import pytest
+
+from mediagoblin.db.base import FakeCursor
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.tests.tools import (fixture_add_user, fixture_media_entry,
+                                     fixture_add_comment)
+from mediagoblin.tools.pagination import (Pagination, KeysetPagination,
+                                          encode_marker, decode_marker,
+                                          InvalidMarker)
+
+
+def test_marker_roundtrip():
+    created = datetime.datetime(2015, 3, 1, 12, 30, 45, 1234)
+    marker = encode_marker(created, 42)
+    assert decode_marker(marker) == (created, 42)
+
+    with pytest.raises(InvalidMarker):
+        decode_marker(u'not a marker')
+
+
+def test_keyset_pagination(test_app):
+    user = fixture_add_user(u'keyset_user', privileges=[u'active'])
+    # Give several entries the same timestamp so the id tie-breaker matters
+    created = datetime.datetime(2015, 1, 1)
+    for i in range(7):
+        entry = fixture_media_entry(
+            title=u'Entry %d' % i, uploader=user.id, state=u'processed',
+            fake_upload=False, save=False, expunge=False)
+        entry.created = created + datetime.timedelta(days=i // 2)
+        entry.save()
+
+    cursor = MediaEntry.query.filter_by(actor=user.id, state=u'processed')
+    expected = [e.id for e in cursor.order_by(
+        MediaEntry.created.desc(), MediaEntry.id.desc())]
+
+    # Walk forward through all pages
+    seen = []
+    pagination = KeysetPagination(cursor, MediaEntry, per_page=3)
+    assert not pagination.has_prev
+    while True:
+        seen.extend(e.id for e in pagination())
+        if not pagination.has_next:
+            break
+        pagination = KeysetPagination(
+            cursor, MediaEntry, decode_marker(pagination.next_marker),
+            u'next', per_page=3)
+    assert seen == expected
+
+    # ... and one page back from the last page
+    last_page = [e.id for e in pagination()]
+    pagination = KeysetPagination(
+        cursor, MediaEntry, decode_marker(pagination.prev_marker),
+        u'prev', per_page=3)
+    assert [e.id for e in pagination()] == \
+        expected[-len(last_page) - 3:-len(last_page)]
+    assert pagination.has_next
+    assert pagination.has_prev
+
+    assert pagination.total_count == 7
+
+
+def test_gallery_marker_urls(test_app):
+    user = fixture_add_user(u'keyset_gallery', privileges=[u'active'])
+    for i in range(3):
+        fixture_media_entry(title=u'Entry %d' % i, uploader=user.id,
+                            state=u'processed')
+
+    res = test_app.get('/u/keyset_gallery/gallery/')
+    assert res.status_int == 200
+
+    res = test_app.get('/u/keyset_gallery/gallery/?marker=garbage',
+                       expect_errors=True)
+    assert res.status_int == 404
+
+    res = test_app.get('/u/keyset_gallery/gallery/?dir=sideways',
+                       expect_errors=True)
+    assert res.status_int == 404
+
+
+@pytest.mark.parametrize('ascending', [True, False])
+def test_jump_to_id(test_app, ascending):
+    user = fixture_add_user(u'jumper')
+    media = fixture_media_entry(uploader=user.id)
+    comments = [fixture_add_comment(author=user.id, media_entry=media)
+                for i in range(7)]
+    if not ascending:
+        comments.reverse()
+
+    for position, comment in enumerate(comments):
+        pagination = Pagination(1, media.get_comments(ascending), 3,
+                                comment.id)
+        assert pagination.page == 1 + position // 3
+        assert pagination.active_id == comment.id
+        assert comment.id in [c.id for c in pagination()]
+
+    # An unknown id just leaves us on the requested page
+    pagination = Pagination(2, media.get_comments(ascending), 3, 12345)
+    assert pagination.page == 2
+    assert pagination.active_id is None
+
+
+def test_jump_to_id_without_id_criterion(test_app):
+    user = fixture_add_user(u'walker')
+    entries = [fixture_media_entry(uploader=user.id) for i in range(5)]
+
+    def make_cursor():
+        return FakeCursor(
+            MediaEntry.query.filter_by(actor=user.id).order_by(MediaEntry.id),
+            lambda entry: entry)
+
+    for position, entry in enumerate(entries):
+        pagination = Pagination(1, make_cursor(), 2, entry.id)
+        assert pagination.page == 1 + position // 2
+        assert pagination.active_id == entry.id
+
+    pagination = Pagination(2, make_cursor(), 2, 12345)
+    assert pagination.page == 2
+    assert pagination.active_id is None
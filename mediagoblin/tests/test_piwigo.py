@@ -14,7 +14,20 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
+import datetime
+import hashlib
+import os
+import time
+
 import pytest
+import six
+
+from mediagoblin import mg_globals
+from mediagoblin.db.models import MediaEntry
+from .resources import GOOD_JPG
+from mediagoblin.plugins.piwigo.tools import (store_chunk, delete_chunks,
+    delete_stale_chunks)
 from .tools import fixture_add_user
 
 
@@ -26,7 +39,7 @@ class Test_PWG(object):
     def setup(self, test_app):
         self.test_app = test_app
 
-        fixture_add_user()
+        self.user_id = fixture_add_user().id
 
         self.username = u"chris"
         self.password = "toast"
@@ -64,3 +77,85 @@ class Test_PWG(object):
 
         resp = self.do_get("pwg.session.getStatus")
         assert resp.body == (XML_PREFIX + '<rsp stat="ok"><username>guest</username></rsp>').encode('ascii')
+
+    def login(self):
+        resp = self.do_post("pwg.session.login",
+            {"username": self.username, "password": self.password})
+        assert resp.body == (XML_PREFIX + '<rsp stat="ok">1</rsp>').encode('ascii')
+
+    def add_chunks(self, o_sum, data, chunk_size, skip=()):
+        for pos, start in enumerate(range(0, len(data), chunk_size)):
+            if pos in skip:
+                continue
+            chunk = data[start:start + chunk_size]
+            resp = self.do_post("pwg.images.addChunk",
+                {"original_sum": o_sum, "type": "file", "position": str(pos),
+                 "data": base64.b64encode(chunk).decode('ascii')})
+            assert resp.body == (XML_PREFIX + '<rsp stat="ok">1</rsp>').encode('ascii')
+
+    def test_chunked_upload(self):
+        with open(GOOD_JPG, 'rb') as f:
+            data = f.read()
+        o_sum = hashlib.md5(data).hexdigest()
+        add_params = {"original_sum": o_sum, "file_sum": o_sum,
+                      "name": u"Chunked", "original_filename": u"good.jpg"}
+
+        self.login()
+
+        # Leave out one chunk: the upload can't be assembled yet and
+        # the staged chunks are kept around.
+        self.add_chunks(o_sum, data, 1000, skip=(2,))
+        resp = self.do_post("pwg.images.add", dict(add_params))
+        assert b'<rsp stat="fail"><err code="1003"' in resp.body
+        assert not MediaEntry.query.filter_by(title=u"Chunked").count()
+        assert mg_globals.queue_store.file_exists(
+            ['piwigo_chunks', six.text_type(self.user_id), o_sum, u'000000'])
+
+        # Resume by sending the missing chunk only
+        self.add_chunks(o_sum, data, 1000,
+            skip=set(range(len(data) // 1000 + 1)) - set([2]))
+        resp = self.do_post("pwg.images.add", dict(add_params))
+        # The order of the response's elements depends on dict ordering
+        assert b'stat="ok"' in resp.body
+        assert b'<image_id>' in resp.body
+
+        entry = MediaEntry.query.filter_by(title=u"Chunked").one()
+        assert entry.media_type == u'mediagoblin.media_types.image'
+        assert not mg_globals.queue_store.file_exists(
+            ['piwigo_chunks', six.text_type(self.user_id), o_sum, u'000000'])
+
+        resp = self.do_get("pwg.images.exist",
+            {"md5sum_list": o_sum + "," + "0" * 32})
+        assert ('md5sum="%s"' % o_sum).encode('ascii') in resp.body
+        assert ('id="%d"' % entry.id).encode('ascii') in resp.body
+        assert resp.body.count(b'id=""') == 1
+
+    def test_stale_chunks(self):
+        user = fixture_add_user()
+        queue_store = mg_globals.queue_store
+        sums = ['a' * 32, 'b' * 32]
+        # Chunk 1 is missing, which shouldn't stop any cleanup
+        for o_sum in sums:
+            for pos in (0, 2):
+                store_chunk(queue_store, user, o_sum, pos, b'chunk')
+
+        def chunk_path(o_sum, pos):
+            return ['piwigo_chunks', six.text_type(user.id), o_sum,
+                    u'%06d' % pos]
+
+        # The first upload got its last chunk two days ago
+        two_days_ago = time.time() - 2 * 24 * 60 * 60
+        upload_dir = queue_store.get_local_path(chunk_path(sums[0], 0)[:-1])
+        for name in os.listdir(upload_dir) + ['.']:
+            os.utime(os.path.join(upload_dir, name),
+                     (two_days_ago, two_days_ago))
+
+        delete_stale_chunks(
+            queue_store,
+            datetime.datetime.utcnow() - datetime.timedelta(days=1))
+        assert not queue_store.file_exists(chunk_path(sums[0], 0))
+        assert not queue_store.file_exists(chunk_path(sums[0], 2))
+        assert queue_store.file_exists(chunk_path(sums[1], 0))
+
+        delete_chunks(queue_store, user, sums[1])
+        assert not queue_store.file_exists(chunk_path(sums[1], 2))
@@ -19,7 +19,9 @@ import pytest
 from datetime import date, timedelta
 from webtest import AppError
 
-from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
+from mediagoblin import mg_globals
+from mediagoblin.tests.tools import (fixture_add_user, fixture_media_entry,
+                                     QueryCounter)
 
 from mediagoblin.db.models import User, LocalUser, UserBan
 from mediagoblin.tools import template
@@ -68,6 +70,29 @@ class TestPrivilegeFunctionality:
         self.mod_user = LocalUser.query.filter(LocalUser.username==u'meow').first()
         self.user = LocalUser.query.filter(LocalUser.username==u'natalie').first()
 
+    def testPrivilegeChecksQueryCount(self):
+        counter = QueryCounter(mg_globals.database.engine)
+
+        # Checking privileges again and again only loads them once
+        with counter:
+            for i in range(5):
+                assert self.admin_user.has_privilege(u'uploader')
+                assert self.admin_user.has_privilege(u'admin', False)
+                assert not self.admin_user.has_privilege(u'uploader', False)
+                assert not self.admin_user.is_banned()
+        assert counter.count_touching('core__privileges') == 1
+        assert counter.count_touching('core__user_bans') == 1
+
+        # Views decorated with several privilege checks, and templates
+        # checking more, look privileges and bans up along with the user
+        self.login(u'alex')
+        for url in ['/submit/', '/mod/users/', '/mod/reports/',
+                    '/u/alex/']:
+            with counter:
+                self.test_app.get(url)
+            assert counter.count_touching('core__privileges_users') <= 1
+            assert counter.count_touching('core__user_bans') <= 1
+
     def testUserBanned(self):
         self.login(u'natalie')
         uid = self.user.id
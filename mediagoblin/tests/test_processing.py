@@ -1,6 +1,13 @@
 #!/usr/bin/env python
 
+import os
+import threading
+
+import pytest
+
+from mediagoblin import mg_globals as mgg
 from mediagoblin import processing
+from mediagoblin.tests.tools import fixture_media_entry
 
 class TestProcessing(object):
     def run_fill(self, input, format, output=None):
@@ -16,3 +23,42 @@ class TestProcessing(object):
     def test_long_filename_fill(self):
         self.run_fill('{0}.png'.format('A' * 300), 'image-{basename}{ext}',
                       'image-{0}.png'.format('A' * 245))
+
+
+def test_run_steps(test_app, tmpdir):
+    entry = fixture_media_entry(fake_upload=False, expunge=False)
+    local_file = tmpdir.join('rendition.txt')
+    local_file.write('rendition')
+
+    with processing.MediaProcessor(None, entry) as processor:
+        started = threading.Event()
+
+        def first():
+            # Only finishes if the second step runs at the same time
+            assert started.wait(10)
+            # Nothing is recorded before all steps finished
+            assert 'second' not in entry.media_files
+
+        def second():
+            started.set()
+            processor.store_public(
+                u'second', str(local_file), file_metadata={'size': 2})
+
+        processor.run_steps(first, None, second)
+
+        assert mgg.public_store.file_exists(entry.media_files['second'])
+        assert entry.get_file_metadata('second') == {'size': 2}
+
+        def stored():
+            processor.store_public(u'stored', str(local_file))
+
+        def failed():
+            raise processing.BadMediaFail()
+
+        with pytest.raises(processing.BadMediaFail):
+            processor.run_steps(failed, stored)
+
+        # The files of the steps which worked are gone again
+        assert 'stored' not in entry.media_files
+        assert os.listdir(mgg.public_store.get_local_path(
+            ['media_entries', str(entry.id)])) == ['rendition.txt']
@@ -0,0 +1,115 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import argparse
+
+try:
+    import mock
+except ImportError:
+    import unittest.mock as mock
+
+import celery
+import pytest
+
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.gmg_commands.reprocess import bulk_reprocess
+from mediagoblin.processing.task import ProcessMedia
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
+
+
+def bulk_args(start_after=0):
+    return argparse.Namespace(batch_size=2, max_in_flight=3,
+                              start_after=start_after)
+
+
+def add_entries(username):
+    """
+    Add five entries which can be reprocessed, then one of each kind
+    bulk_reprocess has to skip, and return the user and their ids.
+    """
+    user = fixture_add_user(username)
+    eligible = [
+        fixture_media_entry(uploader=user.id, state=u'processed').id
+        for i in range(5)]
+    ineligible = fixture_media_entry(uploader=user.id, state=u'failed')
+    # There's no "metadatabuilder" processor for audio...
+    no_processor = fixture_media_entry(uploader=user.id, state=u'processed',
+                                       fake_upload=False, save=False,
+                                       expunge=False)
+    no_processor.media_type = u'mediagoblin.media_types.audio'
+    no_processor.save()
+    # ... and no processing manager at all for u'image'
+    no_manager = fixture_media_entry(uploader=user.id, state=u'processed',
+                                     fake_upload=False)
+    return user, eligible, [ineligible.id, no_processor.id, no_manager.id]
+
+
+def recording_run(processed):
+    def run(self, media_id, feed_url, reprocess_action, reprocess_info=None):
+        processed.append((media_id, reprocess_action))
+    return run
+
+
+def test_bulk_reprocess(test_app, capsys):
+    user, eligible, skipped = add_entries(u'bulky')
+    query = MediaEntry.query.filter_by(actor=user.id)
+
+    processed = []
+    with mock.patch.object(ProcessMedia, 'run', recording_run(processed)):
+        bulk_reprocess(bulk_args(), query, u'metadatabuilder')
+
+    # All eligible entries are processed, over several batches
+    assert processed == [(media_id, u'metadatabuilder')
+                         for media_id in eligible]
+
+    out = capsys.readouterr()[0]
+    assert 'Examined 2/8 entries' in out
+    assert 'Examined 8/8 entries' in out
+    assert 'media "{0}" is not eligible'.format(skipped[0]) in out
+    assert ('No such processor "metadatabuilder" for media type '
+            '"mediagoblin.media_types.audio"') in out
+    assert 'No such processing manager for image' in out
+    assert 'resume with --start-after {0}'.format(skipped[-1]) in out
+    assert 'Queued 5 of 8 entries' in out
+
+
+def test_bulk_reprocess_resume(test_app, capsys):
+    user, eligible, skipped = add_entries(u'resumy')
+    query = MediaEntry.query.filter_by(actor=user.id)
+
+    processed = []
+    with mock.patch.object(ProcessMedia, 'run', recording_run(processed)):
+        bulk_reprocess(bulk_args(start_after=eligible[2]), query,
+                       u'metadatabuilder')
+
+    assert [media_id for media_id, action in processed] == eligible[3:]
+    assert 'Queued 2 of 5 entries' in capsys.readouterr()[0]
+
+
+def test_bulk_reprocess_dispatch_failure(test_app):
+    user, eligible, skipped = add_entries(u'failly')
+    query = MediaEntry.query.filter_by(actor=user.id)
+
+    with mock.patch.object(celery.group, 'apply_async',
+                           side_effect=IOError('The broker is down')):
+        with pytest.raises(IOError):
+            bulk_reprocess(bulk_args(), query, u'metadatabuilder')
+
+    # Only the batch which couldn't be queued is marked as failed
+    states = [MediaEntry.query.get(media_id).state for media_id in eligible]
+    assert states == [u'failed', u'failed', u'processed', u'processed',
+                      u'processed']
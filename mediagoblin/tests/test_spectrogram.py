@@ -0,0 +1,122 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import os
+import time
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+# The audio media type imports its GStreamer transcoders
+pytest.importorskip("gi.repository.Gst")
+
+from mediagoblin.media_types.audio import spectrogram
+from mediagoblin.tests.tools import benchmark
+
+
+class FakeSndfile(object):
+    """Stands in for audiolab.Sndfile, playing back a fixed signal"""
+    signal = None
+
+    def __init__(self, filename, mode='r'):
+        self.nframes = len(self.signal)
+        self.channels = 1
+        self.samplerate = 44100
+        self.position = 0
+
+    def seek(self, position):
+        self.position = int(position)
+
+    def read_frames(self, count):
+        samples = self.signal[self.position:self.position + count].copy()
+        self.position += count
+        return samples
+
+    def close(self):
+        pass
+
+
+@pytest.fixture()
+def fake_audio(monkeypatch):
+    class FakeAudiolab(object):
+        Sndfile = FakeSndfile
+    monkeypatch.setattr(spectrogram, 'audiolab', FakeAudiolab,
+                        raising=False)
+    return FakeSndfile
+
+
+def _render(tmpdir, name, **kwargs):
+    filename = os.path.join(str(tmpdir), name)
+    spectrogram.create_spectrogram_image(
+        'fake.ogg', filename, (640, 192), 4096, **kwargs)
+    with open(filename, 'rb') as image:
+        return image.read()
+
+
+@pytest.mark.parametrize('seconds', [0.1, 2, 120])
+def test_vectorized_spectrogram_matches(tmpdir, fake_audio, seconds):
+    # Short signals have overlapping windows, long ones sparse windows
+    random = numpy.random.RandomState(42)
+    fake_audio.signal = random.uniform(-1, 1, int(44100 * seconds))
+
+    per_column = _render(tmpdir, 'per_column.png', vectorized=False)
+    vectorized = _render(tmpdir, 'vectorized.png')
+    assert per_column == vectorized
+
+
+@benchmark
+def test_vectorized_spectrogram_benchmark(tmpdir, fake_audio):
+    random = numpy.random.RandomState(42)
+    fake_audio.signal = random.uniform(-1, 1, 44100 * 120)
+
+    start = time.time()
+    _render(tmpdir, 'per_column.png', vectorized=False)
+    per_column_time = time.time() - start
+    start = time.time()
+    _render(tmpdir, 'vectorized.png')
+    vectorized_time = time.time() - start
+
+    print('\nspectrogram of 120s: %.3fs per column, %.3fs vectorized' % (
+        per_column_time, vectorized_time))
+
+
+@pytest.mark.parametrize('seconds', [0.1, 2, 120])
+def test_streaming_spectrogram_reads_once(tmpdir, fake_audio, seconds):
+    random = numpy.random.RandomState(42)
+    fake_audio.signal = random.uniform(-1, 1, int(44100 * seconds))
+    max_level = spectrogram.get_max_level('fake.ogg')
+
+    reads = []
+    original_read_frames = FakeSndfile.read_frames
+
+    def counting_read_frames(self, count):
+        reads.append(count)
+        return original_read_frames(self, count)
+
+    # The streaming pass finds the same max level and produces the same
+    # image as reading with a known max level ...
+    known = _render(tmpdir, 'known.png', max_level=max_level)
+    FakeSndfile.read_frames = counting_read_frames
+    try:
+        streamed = _render(tmpdir, 'streamed.png')
+    finally:
+        FakeSndfile.read_frames = original_read_frames
+    assert known == streamed
+
+    # ... while decoding every sample exactly once
+    assert sum(reads) == len(fake_audio.signal)
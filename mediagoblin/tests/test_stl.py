@@ -0,0 +1,90 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import struct
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from mediagoblin.media_types.stl.model_loader import (
+    auto_detect, BinaryStlModel, ObjModel, ThreeDeeParseError)
+
+TRIANGLES = [
+    [(0, 0, 0), (2, 0, 0), (0, 4, 0)],
+    [(0, 0, 6), (2, 4, 6), (-2, 0, 0)]]
+
+
+def _binary_stl(triangles):
+    data = io.BytesIO()
+    data.write(b'\0' * 80)
+    data.write(struct.pack('<I', len(triangles)))
+    for triangle in triangles:
+        data.write(struct.pack('<3f', 0, 0, 1))
+        for vert in triangle:
+            data.write(struct.pack('<3f', *vert))
+        data.write(b'\0\0')
+    data.seek(0)
+    return data
+
+
+def _ascii_stl(triangles):
+    lines = ['solid test']
+    for triangle in triangles:
+        lines += ['facet normal 0 0 1', '  outer loop']
+        lines += ['    vertex %f %f %f' % vert for vert in triangle]
+        lines += ['  endloop', 'endfacet']
+    lines.append('endsolid test')
+    return io.BytesIO('\n'.join(lines).encode('ascii'))
+
+
+def _assert_dimensions(model):
+    assert model.width == 4
+    assert model.depth == 4
+    assert model.height == 6
+    assert model.average == [1 / 3.0, 4 / 3.0, 2]
+
+
+def test_binary_stl():
+    model = auto_detect(_binary_stl(TRIANGLES), 'stl')
+    assert isinstance(model, BinaryStlModel)
+    _assert_dimensions(model)
+
+
+def test_ascii_stl():
+    model = auto_detect(_ascii_stl(TRIANGLES), 'stl')
+    assert isinstance(model, ObjModel)
+    _assert_dimensions(model)
+
+
+def test_obj_skips_normals():
+    obj = io.BytesIO(b'# a comment\n'
+                     b'v 1 2 3\n'
+                     b'vn 0 0 100\n'
+                     b'vt 0.5 0.5\n'
+                     b'\n'
+                     b'v 3 4 5\n'
+                     b'f 1 2 1\n')
+    model = auto_detect(obj, 'obj')
+    assert model.average == [2, 3, 4]
+    assert (model.width, model.depth, model.height) == (2, 2, 2)
+
+
+def test_truncated_binary_stl():
+    data = _binary_stl(TRIANGLES).getvalue()[:-10]
+    with pytest.raises(ThreeDeeParseError):
+        BinaryStlModel(io.BytesIO(data))
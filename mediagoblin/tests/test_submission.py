@@ -21,6 +21,7 @@ if six.PY2:  # this hack only work in Python 2
     reload(sys)
     sys.setdefaultencoding('utf-8')
 
+import hashlib
 import os
 import pytest
 
@@ -39,6 +40,7 @@ from mediagoblin.db.models import MediaEntry, User, LocalUser
 from mediagoblin.db.base import Session
 from mediagoblin.tools import template
 from mediagoblin.media_types.image import ImageMediaManager
+from mediagoblin.media_types.tools import PROBE_CACHE
 from mediagoblin.media_types.pdf.processing import check_prerequisites as pdf_check_prerequisites
 
 from .resources import GOOD_JPG, GOOD_PNG, EVIL_FILE, EVIL_JPG, EVIL_PNG, \
@@ -169,6 +171,24 @@ class TestSubmission:
         # Now check that the public_id attribute is set.
         assert media.public_id != None
 
+    def test_duplicate_upload_linked(self):
+        with open(GOOD_JPG, 'rb') as f:
+            content_hash = hashlib.md5(f.read()).hexdigest()
+
+        mg_globals.app_config['link_duplicate_uploads'] = True
+        try:
+            for title in (u'Original goblin', u'Duplicate goblin'):
+                self.do_post({'title': title}, do_follow=True,
+                             **self.upload_data(GOOD_JPG))
+        finally:
+            mg_globals.app_config['link_duplicate_uploads'] = False
+
+        original = MediaEntry.query.filter_by(
+            title=u'Original goblin').one()
+        assert original.content_hash == content_hash
+        assert not MediaEntry.query.filter_by(
+            title=u'Duplicate goblin').count()
+
     def test_normal_png(self):
         self.check_normal_upload(u'Normal upload 2', GOOD_PNG)
 
@@ -400,6 +420,17 @@ class TestSubmission:
         with create_av(make_audio=True, make_video=True) as path:
             self.check_normal_upload('Audio and Video', path)
 
+    def test_video_discovered_once(self):
+        PROBE_CACHE.discoveries = 0
+        with create_av(make_audio=True, make_video=True) as path:
+            self.check_normal_upload('Discovered once', path)
+        media = self.check_media(None, {'title': u'Discovered once'}, 1)
+
+        # Sniffing and processing share the discovery of the upload,
+        # only the transcoded video (if any) gets discovered again
+        transcoded = 'webm_video' in media.media_files
+        assert PROBE_CACHE.discoveries == 1 + int(transcoded)
+
     def test_processing(self):
         public_store_dir = mg_globals.global_config[
             'storage:publicstore']['base_dir']
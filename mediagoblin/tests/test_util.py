@@ -19,14 +19,17 @@ try:
 except ImportError:
     import unittest.mock as mock
 import email
+import os
 import pytest
 import smtplib
 import pkg_resources
 
 import six
 
+from mediagoblin import mg_globals
 from mediagoblin.tests.tools import get_app
-from mediagoblin.tools import common, url, translate, mail, text, testing
+from mediagoblin.tools import common, url, translate, mail, text, testing, \
+    template, routing
 
 testing._activate_testing()
 
@@ -181,3 +184,43 @@ def test_html_cleaner():
         '<p><a href="javascript:nasty_surprise">innocent link!</a></p>')
     assert result == (
         '<p><a href="">innocent link!</a></p>')
+
+
+def test_bytecode_cache(tmpdir):
+    assert template.get_bytecode_cache({'bytecode_cache': ''}) is None
+
+    cache_dir = str(tmpdir.join('jinja2'))
+    cache = template.get_bytecode_cache({'bytecode_cache': cache_dir})
+    assert cache is template.get_bytecode_cache({'bytecode_cache': cache_dir})
+    assert os.path.isdir(cache_dir)
+
+
+def test_warmup_templates(test_app):
+    app = mg_globals.app
+    template.SETUP_JINJA_ENVS.clear()
+    template.TEMPLATE_TIMINGS.reset()
+
+    assert template.warmup_templates(
+        app, app.template_loader, ['en_US']) == 0
+
+    template_env = template.SETUP_JINJA_ENVS['en_US']
+    names = template.list_templates(template_env)
+    assert 'mediagoblin/base.html' in names
+    compiled = template.TEMPLATE_TIMINGS.compiled
+    assert compiled >= len(names)
+
+    # So requests don't need to compile the templates they render
+    test_app.get('/')
+    assert template.TEMPLATE_TIMINGS.compiled == compiled
+    assert template.TEMPLATE_TIMINGS.rendered > 0
+
+
+def test_import_controllers(test_app):
+    app = mg_globals.app
+    assert routing.import_controllers(app.url_map) == 0
+    for rule in app.url_map.iter_rules():
+        assert callable(rule.gmg_controller)
+
+    phases = [phase for phase, seconds in app.startup_timings]
+    for phase in ['config', 'plugins', 'database', 'routes']:
+        assert phase in phases
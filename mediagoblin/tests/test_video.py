@@ -14,8 +14,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from __future__ import print_function
+
 import tempfile
 import os
+import time
 from contextlib import contextmanager
 import imghdr
 
@@ -28,15 +31,22 @@ gi.require_version('Gst', '1.0')
 from gi.repository import Gst
 Gst.init(None)
 
+from mediagoblin import mg_globals as mgg
+from mediagoblin.media_types.video.processing import CommonVideoProcessor
 from mediagoblin.media_types.video.transcoders import (capture_thumb,
-        VideoTranscoder)
+        VideoTranscoder, SegmentedVideoTranscoder)
 from mediagoblin.media_types.tools import discover
+from mediagoblin.tests.tools import fixture_media_entry, benchmark
 
 @contextmanager
-def create_data(suffix=None, make_audio=False):
+def create_data(suffix=None, make_audio=False, seconds=None):
+    # 10 buffers unless the length is given, at 30 frames and about 43
+    # audio buffers per second
+    video_buffers = seconds * 30 if seconds else 10
+    audio_buffers = seconds * 44100 // 1024 if seconds else 10
     video = tempfile.NamedTemporaryFile()
     src = Gst.ElementFactory.make('videotestsrc', None)
-    src.set_property('num-buffers', 10)
+    src.set_property('num-buffers', video_buffers)
     videorate = Gst.ElementFactory.make('videorate', None)
     enc = Gst.ElementFactory.make('theoraenc', None)
     mux = Gst.ElementFactory.make('oggmux', None)
@@ -54,7 +64,7 @@ def create_data(suffix=None, make_audio=False):
     mux.link(dst)
     if make_audio:
         audio_src = Gst.ElementFactory.make('audiotestsrc', None)
-        audio_src.set_property('num-buffers', 10)
+        audio_src.set_property('num-buffers', audio_buffers)
         audiorate = Gst.ElementFactory.make('audiorate', None)
         audio_enc = Gst.ElementFactory.make('vorbisenc', None)
         pipeline.add(audio_src)
@@ -68,7 +78,7 @@ def create_data(suffix=None, make_audio=False):
     assert state[0] == Gst.StateChangeReturn.SUCCESS
     bus = pipeline.get_bus()
     message = bus.timed_pop_filtered(
-            3 * Gst.SECOND,
+            max(3, seconds or 0) * Gst.SECOND,
             Gst.MessageType.ERROR | Gst.MessageType.EOS)
     pipeline.set_state(Gst.State.NULL)
     if suffix:
@@ -130,3 +140,93 @@ def test_transcoder():
                 dimensions=(640, 640))
         assert len(discover(result_name).get_video_streams()) == 1
         assert len(discover(result_name).get_audio_streams()) == 1
+
+
+def _transcode(transcoder, video_name, result_name, **kwargs):
+    transcoder.transcode(
+            video_name, result_name,
+            vp8_quality=8,
+            vp8_threads=0,  # autodetect
+            vorbis_quality=0.3,
+            dimensions=(640, 640),
+            **kwargs)
+
+
+def test_segmented_transcoder():
+    with create_data(make_audio=True, seconds=6) as (video_name, result_name):
+        transcoder = SegmentedVideoTranscoder(3)
+        transcoder.min_segment_duration = Gst.SECOND
+        progress = []
+        _transcode(transcoder, video_name, result_name,
+                   progress_callback=progress.append)
+
+        result = discover(result_name)
+        assert transcoder.dst_data is not None
+        assert len(result.get_video_streams()) == 1
+        assert len(result.get_audio_streams()) == 1
+        # The joined segments make up all of the video
+        assert abs(result.get_duration() -
+                   discover(video_name).get_duration()) < Gst.SECOND
+        assert progress == sorted(progress)
+
+    # Too short to be worth splitting
+    with create_data() as (video_name, result_name):
+        transcoder = SegmentedVideoTranscoder(3)
+        _transcode(transcoder, video_name, result_name)
+        assert len(discover(result_name).get_video_streams()) == 1
+
+
+def test_transcoder_renditions():
+    segmented = SegmentedVideoTranscoder(2)
+    segmented.min_segment_duration = Gst.SECOND
+    for transcoder in (VideoTranscoder(), segmented):
+        with create_data(make_audio=True, seconds=4) as (video_name,
+                                                         result_name):
+            rendition = tempfile.NamedTemporaryFile(suffix='.webm')
+            _transcode(transcoder, video_name, result_name,
+                       renditions=[(120, rendition.name)])
+
+            assert transcoder.dst_data is not None
+            data = transcoder.rendition_data[rendition.name]
+            # Test videos are landscape, so the height is the short side
+            assert data.get_video_streams()[0].get_height() == 120
+            assert len(data.get_audio_streams()) == 1
+            assert discover(result_name).get_video_streams()[0] \
+                .get_width() == 640
+
+
+def test_delete_renditions(test_app):
+    entry = fixture_media_entry(fake_upload=False, expunge=False)
+    filepaths = {}
+    for keyname in (u'webm_video', u'webm_360p', u'webm_720p'):
+        filepaths[keyname] = [u'media_entries', u'%d' % entry.id, keyname]
+        with mgg.public_store.get_file(filepaths[keyname], 'wb') as f:
+            f.write(b'video')
+        entry.media_files[keyname] = filepaths[keyname]
+
+    with CommonVideoProcessor(None, entry) as processor:
+        processor._delete_renditions(keep=[u'webm_720p'])
+
+    assert sorted(entry.media_files) == [u'webm_720p', u'webm_video']
+    assert not mgg.public_store.file_exists(filepaths[u'webm_360p'])
+    assert mgg.public_store.file_exists(filepaths[u'webm_720p'])
+
+
+@benchmark
+def test_segmented_transcoder_benchmark():
+    with create_data(make_audio=True, seconds=60) as (video_name, result_name):
+        start = time.time()
+        _transcode(VideoTranscoder(), video_name, result_name)
+        single_time = time.time() - start
+
+        segmented = SegmentedVideoTranscoder(4)
+        segmented.min_segment_duration = 5 * Gst.SECOND
+        start = time.time()
+        _transcode(segmented, video_name, result_name)
+        segmented_time = time.time() - start
+
+        print('\ntranscoding a 60 second video:')
+        print('  single pipeline: %.3fs wall' % single_time)
+        print('  4 segments: %.3fs wall' % segmented_time)
+
+        assert segmented.dst_data is not None
@@ -19,9 +19,13 @@ import os
 import pkg_resources
 import shutil
 
+import pytest
+
 import six
 
 from paste.deploy import loadapp
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from webtest import TestApp
 
 from mediagoblin import mg_globals
@@ -48,6 +52,12 @@ TEST_APP_CONFIG = pkg_resources.resource_filename(
 
 USER_DEV_DIRECTORIES_TO_SETUP = ['media/public', 'media/queue']
 
+# Slow tests which only measure performance, run when this is set in the
+# environment, like: MEDIAGOBLIN_BENCHMARKS=1 py.test -s
+benchmark = pytest.mark.skipif(
+    not os.environ.get('MEDIAGOBLIN_BENCHMARKS'),
+    reason='set MEDIAGOBLIN_BENCHMARKS to run the benchmarks')
+
 
 class TestingMeddleware(BaseMeddleware):
     """
@@ -229,6 +239,12 @@ def fixture_add_comment_notification(entry, subject, user,
         seen=seen,
     )
     cn.obj = subject
+    if not seen:
+        # Counted like trigger_notification does
+        User.query.filter_by(id=user).update(
+            {User.num_unseen_notifications:
+                User.num_unseen_notifications + 1},
+            synchronize_session=False)
     cn.save()
 
     cn = Notification.query.filter_by(id=cn.id).first()
@@ -327,6 +343,10 @@ def fixture_add_comment(author=None, media_entry=None, comment=None):
     comment_link = Comment()
     comment_link.target = media_entry
     comment_link.comment = text_comment
+    # Counted like the comment views do
+    MediaEntry.query.filter_by(id=media_entry.id).update(
+        {MediaEntry.num_comments: MediaEntry.num_comments + 1},
+        synchronize_session=False)
     comment_link.save()
 
     Session.expunge(comment_link)
@@ -381,10 +401,49 @@ def fixture_add_activity(obj, verb="post", target=None, generator=None, actor=No
         generator=generator.id,
     )
 
-    activity.set_object(obj)
+    activity.object = obj
 
     if target is not None:
-        activity.set_target(target)
+        activity.target = target
 
     activity.save()
     return activity
+
+
+# The QueryCounters in their with block
+_active_query_counters = []
+
+
+# Listening on the Engine class, as this module is imported before any
+# engine is created: a listener added to an engine later on is missed by
+# the connections it already handed out, like the Session's.
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, *args):
+    for counter in _active_query_counters:
+        if conn.engine is counter.engine:
+            counter.statements.append(statement)
+
+
+class QueryCounter(object):
+    """
+    Count (and keep) the SQL statements executed on the engine while in
+    the with block
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def count_touching(self, table_name):
+        return len([s for s in self.statements if table_name in s])
+
+    def __enter__(self):
+        self.statements = []
+        _active_query_counters.append(self)
+        return self
+
+    def __exit__(self, *args):
+        _active_query_counters.remove(self)
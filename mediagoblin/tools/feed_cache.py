@@ -0,0 +1,84 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Caches the bodies of the Atom feeds.
+
+Feed bodies are cached by the request url and the feed's conditional
+GET validators (see mediagoblin.decorators.conditional_get): the newest
+created/updated time and the counts of what the feed shows.  Anything
+changing a feed changes those too, so no cache ever needs to be told
+about changes, whichever process makes them.  Bodies for old validators
+just fall out of the cache eventually, like old template fragments.
+"""
+
+import hashlib
+from functools import wraps
+
+from werkzeug.wrappers import Response
+
+from mediagoblin import mg_globals, __version__
+
+
+def get_feed_cache():
+    """The app's feed cache, or None if there's none (or no app)"""
+    return getattr(mg_globals.app, 'feed_cache', None)
+
+
+def feed_key(request, validators):
+    """The cache key of the feed at the request's url for validators"""
+    last_modified, values = validators
+    digest = hashlib.sha1(repr(
+        (__version__, request.url, request.locale,
+         last_modified.isoformat())
+        + tuple(values)).encode('utf-8')).hexdigest()
+    return u'feed:{0}'.format(digest)
+
+
+def cached_feed(get_validators):
+    """
+    Serve a feed controller's responses from the feed cache.
+
+    get_validators is the function the controller's conditional_get
+    uses; if it returns None the response isn't cached.  When
+    conditional_get already got them for the request they are reused.
+    Only successful responses are cached.
+    """
+    def decorator(controller):
+        @wraps(controller)
+        def wrapper(request, *args, **kwargs):
+            cache = get_feed_cache()
+            validators = None
+            if cache is not None and request.method in ('GET', 'HEAD'):
+                validators = getattr(request, 'conditional_validators', None)
+                if validators is None:
+                    validators = get_validators(request, *args, **kwargs)
+            if validators is None:
+                return controller(request, *args, **kwargs)
+
+            key = feed_key(request, validators)
+            body = cache.get(key)
+            if body is not None:
+                return Response(body, mimetype='application/atom+xml')
+
+            response = controller(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.data.decode('utf-8'))
+            return response
+
+        return wrapper
+
+    return decorator
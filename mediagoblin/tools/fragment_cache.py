@@ -0,0 +1,194 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Caches for rendered template fragments.
+
+Templates cache parts which only depend on one object (like the tags
+or license in the media sidebar) with the cache_fragment tag:
+
+.. code-block:: html+jinja
+
+  {% cache_fragment "media_license", media %}
+    ...
+  {% endcache_fragment %}
+
+The fragment is cached by its name, the object's table and id, the
+object's updated time and the locale.  Saving a MediaEntry sets its
+updated time, so anything changing an entry gets its fragments
+rendered again, even if other processes cached them.  Stale versions
+just fall out of the caches eventually.
+
+Fragments must not depend on the user looking at them.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+
+import six
+
+from mediagoblin import mg_globals
+from mediagoblin.tools import common
+
+_log = logging.getLogger(__name__)
+
+
+def get_fragment_cache():
+    """The app's fragment cache, or None if there's none (or no app)"""
+    return getattr(mg_globals.app, 'fragment_cache', None)
+
+
+def fragment_key(name, obj, locale):
+    """The cache key of fragment name of obj in locale"""
+    updated = getattr(obj, 'updated', None)
+    return u'{name}:{table}:{id}:{updated}:{locale}'.format(
+        name=name,
+        table=obj.__tablename__,
+        id=obj.id,
+        updated=updated.isoformat() if updated is not None else u'',
+        locale=locale)
+
+
+class MemoryFragmentCache(object):
+    """
+    Keeps the max_entries most recently used fragments in the memory
+    of this process.
+    """
+    def __init__(self, max_entries=1000):
+        self.max_entries = int(max_entries)
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            fragment = self._fragments.pop(key, None)
+            if fragment is not None:
+                # Most recently used go last
+                self._fragments[key] = fragment
+            return fragment
+
+    def set(self, key, fragment):
+        with self._lock:
+            self._fragments.pop(key, None)
+            self._fragments[key] = fragment
+            while len(self._fragments) > self.max_entries:
+                self._fragments.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+
+class FileFragmentCache(object):
+    """
+    Keeps fragments as files in base_dir, shared by all processes using
+    the same directory.
+
+    Fragments not read for max_age seconds are removed every now and
+    then, which keeps versions for old updated times from piling up.
+    """
+    # Look for old fragments after this many sets
+    PRUNE_INTERVAL = 1000
+
+    def __init__(self, base_dir, max_age=7 * 24 * 60 * 60):
+        self.base_dir = base_dir
+        self.max_age = int(max_age)
+        self._sets = 0
+        if not os.path.exists(base_dir):
+            os.makedirs(base_dir)
+
+    def _path(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.base_dir, name[:2], name)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with io.open(path, 'r', encoding='utf-8') as fragment_file:
+                fragment = fragment_file.read()
+        except (IOError, OSError):
+            return None
+        try:
+            # Keep it from being pruned
+            os.utime(path, None)
+        except OSError:
+            pass
+        return fragment
+
+    def set(self, key, fragment):
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another process was quicker
+                pass
+
+        # Write it next to its place and move it there, so readers never
+        # see half a fragment
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with io.open(fd, 'w', encoding='utf-8') as fragment_file:
+            fragment_file.write(six.text_type(fragment))
+        os.rename(tmp_path, path)
+
+        self._sets += 1
+        if self._sets % self.PRUNE_INTERVAL == 0:
+            self.prune()
+
+    def prune(self):
+        """Remove the fragments not used for max_age seconds"""
+        oldest = time.time() - self.max_age
+        for directory, dirnames, filenames in os.walk(self.base_dir):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    if os.path.getmtime(path) < oldest:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        for directory, dirnames, filenames in os.walk(self.base_dir):
+            for filename in filenames:
+                try:
+                    os.remove(os.path.join(directory, filename))
+                except OSError:
+                    pass
+
+
+def fragment_cache_from_config(config_section):
+    """
+    Set up the fragment cache of a [fragment_cache] config section.
+
+    The cache_class option is the import path of the cache, the other
+    options are passed to it.  Returns None if cache_class is empty,
+    which disables caching.
+    """
+    config_params = dict(six.iteritems(config_section))
+    cache_class = config_params.pop('cache_class', None)
+    if not cache_class:
+        return None
+
+    cache_class = common.import_component(cache_class)
+    return cache_class(**config_params)
@@ -15,15 +15,28 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import urllib
-import copy
-from math import ceil, floor
-from itertools import count
+import base64
+import datetime
+import time
+from math import ceil
 from werkzeug.datastructures import MultiDict
 
-from six.moves import zip
+import six
+from six.moves.urllib.parse import urlencode
+from sqlalchemy import and_, or_
+
+from mediagoblin.db.base import query_position
 
 PAGINATION_DEFAULT_PER_PAGE = 30
 
+# How long (in seconds) a total count computed for keyset pagination
+# may be reused before it is computed again, and how many such counts
+# are kept around at most.
+KEYSET_COUNT_CACHE_TIMEOUT = 300
+KEYSET_COUNT_CACHE_SIZE = 1000
+
+_MARKER_DATE_FORMAT = '%Y%m%d%H%M%S%f'
+
 
 class Pagination(object):
     """
@@ -32,9 +45,11 @@ class Pagination(object):
     Initialization through __init__(self, cursor, page=1, per_page=2),
     get actual data slice through __call__().
     """
+    # See KeysetPagination
+    is_keyset = False
 
     def __init__(self, page, cursor, per_page=PAGINATION_DEFAULT_PER_PAGE,
-                 jump_to_id=False):
+                 jump_to_id=False, total_count=None):
         """
         Initializes Pagination
 
@@ -44,22 +59,37 @@ class Pagination(object):
          - cursor: db cursor
          - jump_to_id: object id, sets the page to the page containing the
            object with id == jump_to_id.
+         - total_count: number of objects in cursor, if already known
+           (like from a counter column), so it needn't be counted.
         """
         self.page = page
         self.per_page = per_page
         self.cursor = cursor
-        self.total_count = self.cursor.count()
+        if total_count is None:
+            total_count = self.cursor.count()
+        self.total_count = total_count
         self.active_id = None
 
         if jump_to_id:
-            cursor = copy.copy(self.cursor)
+            position = self.position_of(jump_to_id)
+            if position is not None:
+                self.page = 1 + position // self.per_page
+                self.active_id = jump_to_id
+
+    def position_of(self, obj_id):
+        """
+        Return the 0-based position of the object with id obj_id in the
+        cursor, or None if it isn't there.
 
-            for (doc, increment) in list(zip(cursor, count(0))):
-                if doc.id == jump_to_id:
-                    self.page = 1 + int(floor(increment / self.per_page))
+        The position is computed by the database, so the cursor does not
+        need to be walked.  A FakeCursor decides for itself what obj_id
+        refers to, a plain query is searched by its entity's id.
+        """
+        if hasattr(self.cursor, 'position_of'):
+            return self.cursor.position_of(obj_id)
 
-                    self.active_id = jump_to_id
-                    break
+        entity = self.cursor.column_descriptions[0]['entity']
+        return query_position(self.cursor, entity.id == obj_id)
 
     def __call__(self):
         """
@@ -117,3 +147,201 @@ class Pagination(object):
         """
         return self.get_page_url_explicit(
             request.full_path, request.GET, page_no)
+
+
+class InvalidMarker(ValueError):
+    """Raised when a keyset pagination marker can't be decoded"""
+    pass
+
+
+def encode_marker(created, obj_id):
+    """
+    Encode a (created, id) pair into an opaque, url safe marker string
+    """
+    raw = u'%s.%d' % (created.strftime(_MARKER_DATE_FORMAT), obj_id)
+    return base64.urlsafe_b64encode(
+        raw.encode('ascii')).decode('ascii').rstrip(u'=')
+
+
+def decode_marker(marker):
+    """
+    Decode a marker produced by encode_marker() back into a
+    (created, id) tuple, raising InvalidMarker for anything else
+    """
+    try:
+        if isinstance(marker, six.text_type):
+            marker = marker.encode('ascii')
+        raw = base64.urlsafe_b64decode(
+            marker + b'=' * (-len(marker) % 4)).decode('ascii')
+        created, obj_id = raw.split(u'.')
+        return (datetime.datetime.strptime(created, _MARKER_DATE_FORMAT),
+                int(obj_id))
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise InvalidMarker(u'Invalid pagination marker: %s' % e)
+
+
+_count_cache = {}
+
+
+def cached_count(cache_key, cursor, timeout=KEYSET_COUNT_CACHE_TIMEOUT):
+    """
+    Return cursor.count(), reusing a previous result for cache_key if it
+    is younger than timeout seconds.
+
+    The returned number is therefore only approximate, but that's fine
+    for "about N items" style display and saves a full COUNT per hit.
+    """
+    now = time.time()
+    cached = _count_cache.get(cache_key)
+    if cached is not None and now - cached[0] < timeout:
+        return cached[1]
+
+    if len(_count_cache) >= KEYSET_COUNT_CACHE_SIZE:
+        _count_cache.clear()
+
+    total = cursor.count()
+    _count_cache[cache_key] = (now, total)
+    return total
+
+
+class KeysetPagination(object):
+    """
+    Keyset ("seek") pagination for database queries.
+
+    Instead of counting all rows and skipping over (page - 1) * per_page
+    of them, pages are addressed by an opaque marker which encodes the
+    (created, id) of the row a page continues from.  Together with an
+    index on created this makes every page, no matter how deep, cost the
+    same.
+
+    Rows are always ordered newest first.  Get the actual data through
+    __call__(), just like with Pagination.
+    """
+    is_keyset = True
+
+    def __init__(self, cursor, model, marker=None, direction=u'next',
+                 per_page=PAGINATION_DEFAULT_PER_PAGE, count_cache_key=None):
+        """
+        Initializes KeysetPagination
+
+        Args:
+         - cursor: db cursor, any ordering will be replaced
+         - model: model class providing the created and id columns
+         - marker: (created, id) tuple as returned from decode_marker(),
+           or None for the first page
+         - direction: u'next' for rows older than the marker, u'prev'
+           for rows newer than the marker
+         - per_page: number of objects per page
+         - count_cache_key: if given, total_count is cached under this
+           key for KEYSET_COUNT_CACHE_TIMEOUT seconds
+        """
+        if direction not in (u'next', u'prev'):
+            raise ValueError(u'Invalid direction: %r' % direction)
+
+        self.cursor = cursor
+        self.model = model
+        self.marker = marker
+        self.direction = direction
+        self.per_page = per_page
+        self.count_cache_key = count_cache_key
+        self._objects = None
+        self._has_more = False
+
+    def _fetch(self):
+        created, obj_id = self.model.created, self.model.id
+        cursor = self.cursor.order_by(None)
+
+        if self.marker is not None:
+            m_created, m_id = self.marker
+            if self.direction == u'next':
+                cursor = cursor.filter(or_(
+                    created < m_created,
+                    and_(created == m_created, obj_id < m_id)))
+            else:
+                cursor = cursor.filter(or_(
+                    created > m_created,
+                    and_(created == m_created, obj_id > m_id)))
+
+        if self.direction == u'next':
+            cursor = cursor.order_by(created.desc(), obj_id.desc())
+        else:
+            cursor = cursor.order_by(created.asc(), obj_id.asc())
+
+        # Fetch one more row than needed to know if there is another page
+        objects = list(cursor.limit(self.per_page + 1))
+        self._has_more = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+
+        if self.direction == u'prev':
+            objects.reverse()
+
+        self._objects = objects
+
+    def __call__(self):
+        """
+        Returns a list of objects for the requested page
+        """
+        if self._objects is None:
+            self._fetch()
+        return self._objects
+
+    @property
+    def has_prev(self):
+        self()
+        if self.direction == u'prev':
+            return self._has_more
+        return self.marker is not None
+
+    @property
+    def has_next(self):
+        self()
+        if self.direction == u'next':
+            return self._has_more
+        return self.marker is not None
+
+    @property
+    def prev_marker(self):
+        if not self.has_prev or not self._objects:
+            return None
+        first = self._objects[0]
+        return encode_marker(first.created, first.id)
+
+    @property
+    def next_marker(self):
+        if not self.has_next or not self._objects:
+            return None
+        last = self._objects[-1]
+        return encode_marker(last.created, last.id)
+
+    @property
+    def total_count(self):
+        """
+        Total number of rows, only computed when actually asked for
+        """
+        if self.count_cache_key is not None:
+            return cached_count(self.count_cache_key, self.cursor)
+        return self.cursor.count()
+
+    def get_marker_url_explicit(self, base_url, get_params, marker,
+                                direction):
+        """
+        Get a page url by adding marker= and dir= parameters to the
+        base url
+        """
+        if isinstance(get_params, MultiDict):
+            new_get_params = get_params.to_dict()
+        else:
+            new_get_params = dict(get_params) or {}
+
+        new_get_params.pop('page', None)
+        new_get_params['marker'] = marker
+        new_get_params['dir'] = direction
+        return "%s?%s" % (base_url, urlencode(new_get_params))
+
+    def get_prev_url_explicit(self, base_url, get_params):
+        return self.get_marker_url_explicit(
+            base_url, get_params, self.prev_marker, u'prev')
+
+    def get_next_url_explicit(self, base_url, get_params):
+        return self.get_marker_url_explicit(
+            base_url, get_params, self.next_marker, u'next')
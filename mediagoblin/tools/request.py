@@ -16,6 +16,11 @@
 
 import json
 import logging
+import tempfile
+from io import BytesIO
+
+from sqlalchemy.orm import joinedload
+from werkzeug import wrappers
 
 from mediagoblin.db.models import User, AccessToken
 from mediagoblin.oauth.tools.request import decode_authorization_header
@@ -27,6 +32,23 @@ _log = logging.getLogger(__name__)
 form_encoded = "application/x-www-form-urlencoded"
 json_encoded = "application/json"
 
+# Uploads bigger than this many bytes are spooled to disk
+UPLOAD_SPOOL_SIZE = 1024 * 500
+
+
+class Request(wrappers.Request):
+    """
+    Request spooling big uploads to *named* temporary files, so they can
+    be sniffed and queued from disk without being copied again first
+    (see mediagoblin.media_types.local_media_file).
+    """
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        if total_content_length is None or \
+                total_content_length > UPLOAD_SPOOL_SIZE:
+            return tempfile.NamedTemporaryFile('wb+')
+        return BytesIO()
+
 
 def setup_user_in_request(request):
     """
@@ -49,7 +71,11 @@ def setup_user_in_request(request):
         request.user = None
         return
 
-    request.user = User.query.get(request.session['user_id'])
+    # Load the privileges and ban state along with the user, they are
+    # checked over and over while handling the request
+    request.user = User.query.options(
+        joinedload(User.all_privileges),
+        joinedload(User.ban)).get(request.session['user_id'])
 
     if not request.user:
         # Something's wrong... this user doesn't exist?  Invalidate
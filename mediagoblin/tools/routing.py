@@ -61,6 +61,28 @@ def endpoint_to_controller(rule):
     return view_func
 
 
+def import_controllers(url_map):
+    """
+    Import the controllers of all routes in url_map (plugin routes
+    included) now, instead of on their first request.
+
+    Controllers failing to import are logged and tried again on request,
+    as usual.  Returns the number of those.
+    """
+    failures = 0
+    for rule in url_map.iter_rules():
+        if not isinstance(getattr(rule, 'gmg_controller', None),
+                          six.string_types):
+            continue
+        try:
+            endpoint_to_controller(rule)
+        except Exception:
+            _log.exception('Could not import the controller of {0}'.format(
+                rule.endpoint))
+            failures += 1
+    return failures
+
+
 def add_route(endpoint, url, controller, *args, **kwargs):
     """
     Add a route to the url mapping
@@ -14,11 +14,15 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
+import os
+import time
+
 import six
 
 import jinja2
 from jinja2.ext import Extension
-from jinja2.nodes import Include, Const
+from jinja2.nodes import Include, Const, CallBlock
 
 from babel.localedata import exists
 from werkzeug.urls import url_quote_plus
@@ -27,13 +31,100 @@ from mediagoblin import mg_globals
 from mediagoblin import messages
 from mediagoblin import _version
 from mediagoblin.tools import common
+from mediagoblin.tools.fragment_cache import fragment_key, get_fragment_cache
 from mediagoblin.tools.translate import is_rtl
 from mediagoblin.tools.translate import set_thread_locale
 from mediagoblin.tools.pluginapi import get_hook_templates, hook_transform
 from mediagoblin.tools.timesince import timesince
 from mediagoblin.meddleware.csrf import render_csrf_form_token
 
+_log = logging.getLogger(__name__)
+
 SETUP_JINJA_ENVS = {}
+SETUP_BYTECODE_CACHES = {}
+
+# The kinds of files in template directories which are templates
+TEMPLATE_EXTENSIONS = ('html', 'txt', 'xml')
+
+
+class TemplateTimings(object):
+    """
+    How many templates this process compiled and rendered, and how
+    long that took in total.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.compiled = 0
+        self.compile_time = 0.0
+        self.rendered = 0
+        self.render_time = 0.0
+
+    def add_compile(self, seconds):
+        self.compiled += 1
+        self.compile_time += seconds
+
+    def add_render(self, seconds):
+        self.rendered += 1
+        self.render_time += seconds
+
+    def __repr__(self):
+        return ('<{klass} compiled {compiled} in {compile_time:.3f}s, '
+                'rendered {rendered} in {render_time:.3f}s>').format(
+                    klass=type(self).__name__, **self.__dict__)
+
+
+TEMPLATE_TIMINGS = TemplateTimings()
+
+
+class TimedEnvironment(jinja2.Environment):
+    """
+    A jinja2.Environment recording the time spent compiling templates
+    in TEMPLATE_TIMINGS.  Templates loaded from the bytecode cache
+    aren't compiled, so don't show up there.
+    """
+    def compile(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return super(TimedEnvironment, self).compile(*args, **kwargs)
+        finally:
+            TEMPLATE_TIMINGS.add_compile(time.time() - start)
+
+
+def get_bytecode_cache(jinja2_config):
+    """
+    Get the bytecode cache configured by the bytecode_cache option of
+    the [jinja2] section, or None if it's not set.
+
+    The option is either a directory, or "memcached://" followed by a
+    comma separated list of memcached servers.
+    """
+    location = jinja2_config.get('bytecode_cache')
+    if not location:
+        return None
+
+    if location in SETUP_BYTECODE_CACHES:
+        return SETUP_BYTECODE_CACHES[location]
+
+    if location.startswith('memcached://'):
+        try:
+            import memcache
+        except ImportError:
+            from mediagoblin.init import ImproperlyConfigured
+            raise ImproperlyConfigured(
+                "A memcached bytecode_cache needs python-memcached "
+                "installed")
+        servers = location[len('memcached://'):].split(',')
+        bytecode_cache = jinja2.MemcachedBytecodeCache(
+            memcache.Client(servers), prefix='mediagoblin/jinja2/')
+    else:
+        if not os.path.exists(location):
+            os.makedirs(location)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(location)
+
+    SETUP_BYTECODE_CACHES[location] = bytecode_cache
+    return bytecode_cache
 
 
 def get_jinja_env(app, template_loader, locale):
@@ -58,12 +149,14 @@ def get_jinja_env(app, template_loader, locale):
 
     # jinja2.StrictUndefined will give exceptions on references
     # to undefined/unknown variables in templates.
-    template_env = jinja2.Environment(
+    template_env = TimedEnvironment(
         loader=template_loader, autoescape=True,
         undefined=jinja2.StrictUndefined,
+        bytecode_cache=get_bytecode_cache(jinja2_config),
         extensions=[
             'jinja2.ext.i18n', 'jinja2.ext.autoescape',
-            TemplateHookExtension] + local_exts)
+            TemplateHookExtension, FragmentCacheExtension] + local_exts)
+    template_env.extend(fragment_cache_locale=locale)
 
     if six.PY2:
         template_env.install_gettext_callables(mg_globals.thread_scope.translations.ugettext,
@@ -110,6 +203,59 @@ def get_jinja_env(app, template_loader, locale):
     return template_env
 
 
+def list_templates(template_env):
+    """
+    List the names of all templates template_env can load: those of
+    the core, the theme, the local templates and plugins, and all the
+    templates registered for template hooks.
+    """
+    try:
+        names = set(template_env.list_templates(
+            extensions=TEMPLATE_EXTENSIONS))
+    except TypeError:
+        # One of the loaders can't list its templates
+        _log.warning('Not all template directories can be listed')
+        names = set()
+
+    from mediagoblin.tools.pluginapi import PluginManager
+    for templates in PluginManager().template_hooks.values():
+        names.update(name for name in templates
+                     if isinstance(name, six.string_types))
+
+    return sorted(names)
+
+
+# What requests without any locale preference get
+DEFAULT_WARMUP_LOCALES = ['en_US']
+
+
+def warmup_templates(app, template_loader, locales):
+    """
+    Set up the jinja environments of locales and compile all templates
+    in them, so no request needs to wait for that.
+
+    When a bytecode cache is configured the templates are compiled only
+    once (for the first locale) and the other locales, like other
+    processes, load them from the cache.
+
+    Returns the number of templates which failed to compile.
+    """
+    failed = 0
+    start = time.time()
+    for locale in locales:
+        template_env = get_jinja_env(app, template_loader, locale)
+        for name in list_templates(template_env):
+            try:
+                template_env.get_template(name)
+            except jinja2.TemplateError as exc:
+                failed += 1
+                _log.warning('Could not compile template %s: %s', name, exc)
+
+    _log.info('Warmed up templates for %s in %.2fs (%r)',
+              ', '.join(locales), time.time() - start, TEMPLATE_TIMINGS)
+    return failed
+
+
 # We'll store context information here when doing unit tests
 TEMPLATE_TEST_CONTEXT = {}
 
@@ -141,7 +287,9 @@ def render_template(request, template_path, context):
     context = hook_transform(
         'template_context_prerender', context)
 
+    start = time.time()
     rendered = template.render(context)
+    TEMPLATE_TIMINGS.add_render(time.time() - start)
 
     if common.TESTS_ENABLED:
         TEMPLATE_TEST_CONTEXT[template_path] = context
@@ -179,3 +327,45 @@ class TemplateHookExtension(Extension):
                     True))
 
         return includes
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Cache a rendered part of a template which only depends on one
+    object, see mediagoblin.tools.fragment_cache.
+
+    Use:
+      {% cache_fragment "media_license", media %}
+        ...
+      {% endcache_fragment %}
+    """
+
+    tags = set(["cache_fragment"])
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache_locale=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        parser.stream.expect('comma')
+        args.append(parser.parse_expression())
+        body = parser.parse_statements(
+            ['name:endcache_fragment'], drop_needle=True)
+        return CallBlock(
+            self.call_method('_cache_fragment', args), [], [], body
+        ).set_lineno(lineno)
+
+    def _cache_fragment(self, name, obj, caller):
+        # Looked up now, as environments outlive apps (see get_jinja_env)
+        cache = get_fragment_cache()
+        if cache is None:
+            return caller()
+
+        key = fragment_key(name, obj, self.environment.fragment_cache_locale)
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            cache.set(key, six.text_type(fragment))
+        return jinja2.Markup(fragment)
@@ -14,8 +14,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+
 import wtforms
 import markdown
+from lxml import etree
 from lxml.html.clean import Cleaner
 
 from mediagoblin import mg_globals
@@ -122,3 +125,23 @@ def cleaned_markdown_conversion(text):
         return u''
 
     return clean_html(UNSAFE_MARKDOWN_INSTANCE.convert(text))
+
+
+# Bump this whenever changing the Markdown or HTML_CLEANER settings, so
+# renderings stored in the database get redone.
+MARKDOWN_RENDER_VERSION = 1
+
+_MARKDOWN_RENDERER = u'{0}:{1}:{2}:'.format(
+    MARKDOWN_RENDER_VERSION,
+    getattr(markdown, '__version__', getattr(markdown, 'version', '')),
+    etree.__version__)
+
+
+def markdown_stamp(text):
+    """
+    Stamp for the cleaned_markdown_conversion of text, which only
+    matches stored renderings of the same text by the same renderer
+    (this code and the Markdown and lxml versions).
+    """
+    return hashlib.sha1(
+        (_MARKDOWN_RENDERER + (text or u'')).encode('utf-8')).hexdigest()
@@ -17,7 +17,7 @@
 from mediagoblin import mg_globals
 from mediagoblin.db.base import Session
 from mediagoblin.db.models import CollectionItem, Report, TextComment, \
-                                  MediaEntry
+                                  MediaEntry, Collection
 from mediagoblin.tools.mail import send_email
 from mediagoblin.tools.pluginapi import hook_runall
 from mediagoblin.tools.template import render_template
@@ -69,9 +69,10 @@ def add_media_to_collection(collection, media, note=None, commit=True):
         collection_item.note = note
     Session.add(collection_item)
 
-    collection.num_items = collection.num_items + 1
+    collection.num_items = Collection.num_items + 1
     Session.add(collection)
-    Session.add(media)
+    # Its sidebar lists the collections it's in
+    media.save(commit=False)
 
     hook_runall('collection_add_media', collection_item=collection_item)
 
@@ -20,7 +20,10 @@ import json
 
 import six
 
+from sqlalchemy import and_
+
 from mediagoblin import messages, mg_globals
+from mediagoblin.db.util import newest_and_count
 from mediagoblin.db.models import (MediaEntry, MediaTag, Collection, Comment,
                                    CollectionItem, LocalUser, Activity, \
                                    GenericModelReference)
@@ -28,8 +31,9 @@ from mediagoblin.tools.response import render_to_response, render_404, \
     redirect, redirect_obj
 from mediagoblin.tools.text import cleaned_markdown_conversion
 from mediagoblin.tools.translate import pass_to_ugettext as _
-from mediagoblin.tools.pagination import Pagination
+from mediagoblin.tools.pagination import Pagination, KeysetPagination
 from mediagoblin.tools.federation import create_activity
+from mediagoblin.tools.feed_cache import cached_feed
 from mediagoblin.user_pages import forms as user_forms
 from mediagoblin.user_pages.lib import (send_comment_email,
 	add_media_to_collection, build_report_object)
@@ -37,11 +41,12 @@ from mediagoblin.notifications import trigger_notification, \
     add_comment_subscription, mark_comment_notification_seen
 from mediagoblin.tools.pluginapi import hook_transform
 
-from mediagoblin.decorators import (uses_pagination, get_user_media_entry,
+from mediagoblin.decorators import (uses_pagination, uses_keyset_pagination,
+    get_user_media_entry,
     get_media_entry_by_id, user_has_privilege, user_not_banned,
     require_active_login, user_may_delete_media, user_may_alter_collection,
     get_user_collection, get_user_collection_item, active_user_from_url,
-    get_optional_media_comment_by_id, allow_reporting)
+    get_optional_media_comment_by_id, allow_reporting, conditional_get)
 
 from werkzeug.contrib.atom import AtomFeed
 from werkzeug.exceptions import MethodNotAllowed
@@ -52,8 +57,8 @@ _log = logging.getLogger(__name__)
 _log.setLevel(logging.DEBUG)
 
 @user_not_banned
-@uses_pagination
-def user_home(request, page):
+@uses_keyset_pagination
+def user_home(request, marker, direction):
     """'Homepage' of a LocalUser()"""
     user = LocalUser.query.filter_by(username=request.matchdict['user']).first()
     if not user:
@@ -66,10 +71,12 @@ def user_home(request, page):
 
     cursor = MediaEntry.query.\
         filter_by(actor = user.id,
-                  state = u'processed').order_by(MediaEntry.created.desc())
+                  state = u'processed')
 
-    pagination = Pagination(page, cursor)
-    media_entries = pagination()
+    pagination = KeysetPagination(
+        cursor, MediaEntry, marker, direction,
+        count_cache_key=(u'user', user.id))
+    media_entries = MediaEntry.load_gallery_data(pagination())
 
     #if no data is available, return NotFound
     if media_entries == None:
@@ -89,13 +96,13 @@ def user_home(request, page):
 
 @user_not_banned
 @active_user_from_url
-@uses_pagination
-def user_gallery(request, page, url_user=None):
+@uses_keyset_pagination
+def user_gallery(request, marker, direction, url_user=None):
     """'Gallery' of a LocalUser()"""
     tag = request.matchdict.get('tag', None)
     cursor = MediaEntry.query.filter_by(
         actor=url_user.id,
-        state=u'processed').order_by(MediaEntry.created.desc())
+        state=u'processed')
 
     # Filter potentially by tag too:
     if tag:
@@ -104,8 +111,10 @@ def user_gallery(request, page, url_user=None):
                 MediaTag.slug == request.matchdict['tag']))
 
     # Paginate gallery
-    pagination = Pagination(page, cursor)
-    media_entries = pagination()
+    pagination = KeysetPagination(
+        cursor, MediaEntry, marker, direction,
+        count_cache_key=(u'user', url_user.id, tag))
+    media_entries = MediaEntry.load_gallery_data(pagination())
 
     #if no data is available, return NotFound
     # TODO: Should we really also return 404 for empty galleries?
@@ -122,8 +131,24 @@ def user_gallery(request, page, url_user=None):
 
 MEDIA_COMMENTS_PER_PAGE = 50
 
+def media_home_validators(request, media, **kwargs):
+    # The page shows the comments, and links to the previous and next
+    # media of the uploader
+    newest_comment, comment_count = newest_and_count(
+        Comment.query.join(Comment.target_helper).filter(and_(
+            GenericModelReference.obj_pk == media.id,
+            GenericModelReference.model_type == media.__tablename__)),
+        Comment.added)
+    newest_entry, entry_count = newest_and_count(
+        MediaEntry.query.filter_by(actor=media.actor, state=u'processed'),
+        MediaEntry.created)
+    return (max(media.updated, newest_comment, newest_entry),
+            (media.id, comment_count, entry_count))
+
+
 @user_not_banned
 @get_user_media_entry
+@conditional_get(media_home_validators)
 @uses_pagination
 def media_home(request, media, page, **kwargs):
     """
@@ -138,12 +163,12 @@ def media_home(request, media, page, **kwargs):
             page, media.get_comments(
                 mg_globals.app_config['comments_ascending']),
             MEDIA_COMMENTS_PER_PAGE,
-            comment_id)
+            comment_id, total_count=media.num_comments)
     else:
         pagination = Pagination(
             page, media.get_comments(
                 mg_globals.app_config['comments_ascending']),
-            MEDIA_COMMENTS_PER_PAGE)
+            MEDIA_COMMENTS_PER_PAGE, total_count=media.num_comments)
 
     comments = pagination()
 
@@ -197,12 +222,15 @@ def media_post_comment(request, media):
     else:
         create_activity("post", comment, comment.actor, target=media)
         add_comment_subscription(request.user, media)
-        comment.save()
+        comment.save(commit=False)
 
         link = request.db.Comment()
         link.target = media
         link.comment = comment
-        link.save()
+        link.save(commit=False)
+
+        media.num_comments = MediaEntry.num_comments + 1
+        media.save(set_updated=False)
 
         messages.add_message(
             request, messages.SUCCESS,
@@ -380,7 +408,7 @@ def user_collection(request, page, url_user=None):
     cursor = collection.get_collection_items()
 
     pagination = Pagination(page, cursor)
-    collection_items = pagination()
+    collection_items = CollectionItem.load_objects(pagination())
 
     # if no data is available, return NotFound
     # TODO: Should an empty collection really also return 404?
@@ -424,8 +452,8 @@ def collection_item_confirm_remove(request, collection_item):
             obj = collection_item.get_object()
             obj.save()
 
-            collection_item.delete()
-            collection.num_items = collection.num_items - 1
+            collection_item.delete(commit=False)
+            collection.num_items = Collection.num_items - 1
             collection.save()
 
             messages.add_message(
@@ -505,6 +533,20 @@ def collection_confirm_delete(request, collection):
 ATOM_DEFAULT_NR_OF_UPDATED_ITEMS = 15
 
 
+def atom_feed_validators(request):
+    user = LocalUser.query.filter_by(
+        username=request.matchdict['user']).first()
+    if not user:
+        return None
+
+    newest, count = newest_and_count(
+        MediaEntry.query.filter_by(actor=user.id, state=u'processed'),
+        MediaEntry.created, MediaEntry.updated)
+    return newest, (user.id, count)
+
+
+@conditional_get(atom_feed_validators)
+@cached_feed(atom_feed_validators)
 def atom_feed(request):
     """
     generates the atom feed with the newest images
@@ -546,7 +588,7 @@ def atom_feed(request):
                    user=request.matchdict['user']),
                links=atomlinks)
 
-    for entry in cursor:
+    for entry in MediaEntry.load_gallery_data(cursor):
         feed.add(
             entry.get('title'),
             entry.description_html,
@@ -568,6 +610,29 @@ def atom_feed(request):
     return feed.get_response()
 
 
+def collection_atom_feed_validators(request):
+    collection = Collection.query.join(
+        LocalUser, LocalUser.id == Collection.actor).filter(and_(
+            LocalUser.username == request.matchdict['user'],
+            Collection.slug == request.matchdict['collection'])).first()
+    if not collection:
+        return None
+
+    entries = MediaEntry.query.join(
+        GenericModelReference, and_(
+            GenericModelReference.obj_pk == MediaEntry.id,
+            GenericModelReference.model_type == MediaEntry.__tablename__)
+    ).join(
+        CollectionItem, CollectionItem.object_id == GenericModelReference.id
+    ).filter(CollectionItem.collection == collection.id)
+    newest, count = newest_and_count(
+        entries, CollectionItem.added, MediaEntry.updated)
+    return (max(newest, collection.updated),
+            (collection.id, collection.title, count))
+
+
+@conditional_get(collection_atom_feed_validators)
+@cached_feed(collection_atom_feed_validators)
 def collection_atom_feed(request):
     """
     generates the atom feed with the newest images from a collection
@@ -615,7 +680,7 @@ def collection_atom_feed(request):
                     slug=collection.slug),
                 links=atomlinks)
 
-    for item in cursor:
+    for item in CollectionItem.load_objects(cursor):
         obj = item.get_object()
         feed.add(
             obj.get('title'),
@@ -623,10 +688,10 @@ def collection_atom_feed(request):
             id=obj.url_for_self(request.urlgen, qualified=True),
             content_type='html',
             author={
-                'name': obj.get_actor().username,
+                'name': obj.get_actor.username,
                 'uri': request.urlgen(
                     'mediagoblin.user_pages.user_home',
-                    qualified=True, user=obj.get_actor().username)},
+                    qualified=True, user=obj.get_actor.username)},
             updated=item.get('added'),
             links=[{
                 'href': obj.url_for_self(
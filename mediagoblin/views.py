@@ -16,20 +16,21 @@
 
 from mediagoblin import mg_globals
 from mediagoblin.db.models import MediaEntry
-from mediagoblin.tools.pagination import Pagination
+from mediagoblin.tools.pagination import KeysetPagination
 from mediagoblin.tools.pluginapi import hook_handle
 from mediagoblin.tools.response import render_to_response, render_404
-from mediagoblin.decorators import uses_pagination, user_not_banned
+from mediagoblin.decorators import uses_keyset_pagination, user_not_banned
 
 
 @user_not_banned
-@uses_pagination
-def default_root_view(request, page):
-    cursor = request.db.query(MediaEntry).filter_by(state=u'processed').\
-        order_by(MediaEntry.created.desc())
+@uses_keyset_pagination
+def default_root_view(request, marker, direction):
+    cursor = request.db.query(MediaEntry).filter_by(state=u'processed')
 
-    pagination = Pagination(page, cursor)
-    media_entries = pagination()
+    pagination = KeysetPagination(
+        cursor, MediaEntry, marker, direction,
+        count_cache_key=u'root')
+    media_entries = MediaEntry.load_gallery_data(pagination())
     return render_to_response(
         request, 'mediagoblin/root.html',
         {'media_entries': media_entries,